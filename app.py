@@ -1,69 +1,183 @@
+# Must run before the heavy imports below, so time to first render includes them
+import time
+_STARTED = time.perf_counter()
 
-import os
+
+import importlib
+import functools
 import datetime as dt
-from typing import List, Tuple
+from typing import Callable, List, Tuple, Optional
 
 import streamlit as st
-import yaml
 import pandas as pd
 
-from src.pages import home, model, disclaimer, about
-from src.data import data
-
+from src import config as app_config
+from src.data import bundle, caching, data, instrument, locations, publish, refresh
+from src.model import risk_table
 
-with open('./config.yaml', 'r') as f:
-    _CONFIG: dict = yaml.safe_load(f)
 
+# Page modules, imported when their page is first selected
 _PAGES = {
-    # 'Home': home,
-    'Model': model,
-    'About': about,
-    'Disclaimer': disclaimer
+    # 'Home': 'src.pages.home',
+    'Model': 'src.pages.model',
+    'Overview': 'src.pages.overview',
+    'About': 'src.pages.about',
+    'Disclaimer': 'src.pages.disclaimer'
 }
 
 
+def get_config() -> dict:
+    """Return the app config, read once per process, and select its cache backend"""
+    config = app_config.load('./config.yaml')
+    # One cache shared by all sessions, keyed by data version
+    cache = config.get('cache', {})
+    caching.set_backend(
+        cache.get('backend', 'versioned'),
+        cache_dir=config['data_dir'] + 'cache/',
+        max_mb=cache.get('max_mb'),
+        disk=cache.get('disk'),
+        max_disk_mb=cache.get('max_disk_mb')
+    )
+
+    return config
+
+
 def main():
+    first = refresh.current() is None
+    with instrument.stage('render', first=first) as record:
+        write_app()
+        if first:
+            # Time to first render, from the start of this run and of the process
+            record['script_seconds'] = round(time.perf_counter() - _STARTED, 6)
+            record['process_seconds'] = instrument.process_uptime()
+
+    return None
+
+
+def write_app():
+    config = get_config()
+    data_dir = config['data_dir']
     st.write('Proof of concept - see Disclaimer page')
 
-    with st.spinner(text='Loading data...'):
-        df, vacc_data, countries = load_data(dt.date.today(), _CONFIG['data_dir'])
+    # Data is refreshed in the background; only the first request of a process
+    # waits for it to load, from the latest published or bundled snapshot if any
+    load = functools.partial(load_data, data_dir=data_dir, config=config)
+    with st.spinner(text='Loading data...'), instrument.stage('load_data'):
+        bar, caption = st.empty(), st.empty()
+        snapshot = refresh.ensure(
+            functools.partial(
+                load, progress=download_progress(bar, caption), stale=True
+            ),
+            data_dir
+        )
+        bar.empty()
+        caption.empty()
+    published = publish.current(data_dir + 'published/')
+    fresh = published['meta'].get('today') == str(dt.date.today())
+    refresh.start(
+        load,
+        data_dir,
+        interval=config.get('refresh', {}).get('interval_minutes', 60) * 60,
+        delay=None if fresh else 0
+    )
+    df, vacc_data, countries, index, table = snapshot['data']
     # Write sidebar and return user inputs
-    page, country, state, sub_region = write_sidebar(df, countries)
+    page, country, state, sub_region = write_sidebar(index, countries)
     # Write main page content
     args = {
         'Home': [],
-        'Model': [df, vacc_data, country, state, sub_region],
+        'Model': [
+            df,
+            vacc_data,
+            country,
+            state,
+            sub_region,
+            index,
+            table,
+            config.get('window', 15),
+            config.get('uncertainty')
+        ],
+        'Overview': [df, table, config.get('window', 15)],
         'About': [],
         'Disclaimer': []
     }
-    _PAGES[page].write(*args[page])
+    importlib.import_module(_PAGES[page]).write(*args[page])
+    if show_debug_panel(config):
+        write_debug_panel()
 
     return None
 
 
-@st.cache
-def load_data(today: dt.date, data_dir: str='./data/') -> pd.DataFrame:
+def load_data(
+    today: dt.date,
+    data_dir: str='./data/',
+    config: Optional[dict]=None,
+    download: bool=True,
+    progress: Optional[Callable[[int, int, int], None]]=None,
+    stale: bool=False
+) -> pd.DataFrame:
     """Load latest COVID data from JHU Github repo
 
     Args:
         today (dt.date): Todays's date
+        data_dir (str): root directory for app data
+        config (Optional[dict]): app config
+        download (bool): if False, only data already downloaded is used
+        progress (Optional[Callable]): download progress callback (see
+            data.load_cases)
+        stale (bool): if True, the latest published version is used as is, even if
+            not of today, e.g. for a fast first render. If nothing is published, it
+            is seeded from the bundled snapshot (see src.data.bundle), if any.
     Returns:
         df (pd.DataFrame): Last 14 days of daily covid incidence per 100k population by
             geography.
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        countries (List[str]): List of unique countries in df.Country_Region
+        index (dict): Location index of df (see locations.build_index)
+        table (pd.DataFrame): Model inputs for every location (see
+            risk_table.build_location_table)
     """
-    df = data.load_cases(today, data_dir)
+    config = config or {}
+    # Prepared frames are published once per data version and memory-mapped by
+    # every app process, so their pages are shared rather than copied per process
+    published_dir = data_dir + 'published/'
+    bundle.seed(config.get('snapshot_dir', './snapshot/'), published_dir)
+    published = publish.current(published_dir)
+    current = published is not None and published['meta'].get('today') == str(today)
+    if published is None or not (stale or (current and not download)):
+        bundle.prepare(
+            today, data_dir, config=config, download=download, progress=progress
+        )
+    frames = publish.open_frames(published_dir, ['cases', 'vaccinations'])
+    df, vacc_data = frames['cases'], frames['vaccinations']
     countries = data.get_regions(df)
+    index = locations.build_index(df)
 
-    vacc_data = data.load_vaccinations(data_dir=data_dir)
+    table = risk_table.build_location_table(
+        risk_table.build_daily_series(df), vacc_data
+    )
+    # Derived from the published frames, so shares their version
+    caching.set_version(table, '{}:table'.format(caching.get_version(df)))
     
-    return df, vacc_data, countries
+    return df, vacc_data, countries, index, table
+
 
+def download_progress(bar, caption) -> Callable[[int, int, int], None]:
+    """Return a download progress callback writing to the placeholders given"""
+    def update(done: int, total: int, received: int) -> None:
+        bar.progress(done / total)
+        caption.caption('Downloaded {} of {} daily reports ({:.1f} MB)'.format(
+            done, total, received / 1e6
+        ))
 
-def write_sidebar(df: pd.DataFrame, countries: List[str]) -> Tuple[str]:
+    return update
+
+
+def write_sidebar(index: dict, countries: List[str]) -> Tuple[str]:
     """Populate app sidebar and return user inputs
     
     Args:
-        df (pd.DataFrame): Last 14 days' JHU COVID data
+        index (dict): Location index of last 14 days' JHU COVID data
         Countries (List[str]): List of unique countries in df.Country_Region
     Returns:
         page (str): Selected page
@@ -90,11 +204,11 @@ def write_sidebar(df: pd.DataFrame, countries: List[str]) -> Tuple[str]:
                 state_label = 'Province/State'
                 county_label = 'Sub-region'
 
-            regions = get_regions(df, country)
+            regions = get_regions(index, country)
             
             if valid_regions(regions):
                 state = st.selectbox(state_label, regions)
-                sub_regions = get_subregions(df, country, state)
+                sub_regions = get_subregions(index, country, state)
             else:
                 state = None
                 sub_regions = []
@@ -118,37 +232,35 @@ def write_sidebar(df: pd.DataFrame, countries: List[str]) -> Tuple[str]:
     return (page, country, state, sub_region)
 
 
-def get_regions(df: pd.DataFrame, country: str):
+def show_debug_panel(config: dict) -> bool:
+    """Return True if the debug panel is enabled in config or by ?debug=1"""
+    query = st.experimental_get_query_params()
+
+    return any([config.get('debug_panel', False), query.get('debug') == ['1']])
+
+
+def write_debug_panel() -> None:
+    """Show recent pipeline stage timings in a collapsed sidebar expander"""
+    with st.sidebar.expander('Debug: pipeline stages', expanded=False):
+        records = instrument.get_records(last=100)
+        st.dataframe(pd.DataFrame(records[::-1]))
+
+    return None
+
+
+def get_regions(index: dict, country: str):
     """Return unique values of df.Province_State where df.Country_Region==country"""
-    regions = ['All'] + sorted(
-        list(
-            set(
-                df.loc[
-                    df.Country_Region==country, 'Province_State'
-                    ].fillna('Not Reported')
-            )
-        )
-    )
-    
+    regions = ['All'] + locations.get_children(index, country)
     
     return regions
 
 
-def get_subregions(df: pd.DataFrame, country: str, region: str):
+def get_subregions(index: dict, country: str, region: str):
     """
     Return unique values of df.Admin2 where df.Province_State==region and 
     df.Country_Region==country
     """
-    sub_regions = ['All'] + sorted(
-        list(
-            set(
-                df.loc[
-                    (df.Country_Region==country) & (df.Province_State==region),
-                    'Admin2'
-                ].fillna('Not Reported')
-            )
-        )
-    )
+    sub_regions = ['All'] + locations.get_children(index, country, region)
 
     return sub_regions
 
@@ -0,0 +1,79 @@
+"""Throughput of the scalar and batch risk models, and latency of uncertainty bands
+
+    python -m benchmarks.bench_covid_bayes --size 1000000 --draws 100000
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from src.model import covid_bayes
+
+
+def bench_predict_risk(size: int=1_000_000, repeat: int=5, seed: int=0) -> dict:
+    """Time predict_risk_batch on size random inputs, and predict_risk in a loop
+
+    Args:
+        size (int): number of evaluations per batch call
+        repeat (int): number of timed repeats (best is reported)
+        seed (int): random seed for inputs
+    Returns:
+        results (dict): evaluations per second for 'batch' and 'scalar'
+    """
+    rng = np.random.default_rng(seed)
+    infectious_rate = rng.uniform(0, 0.01, size)
+    vaccination_rate = rng.uniform(0, 1, size)
+    vaccine_efficacy = rng.uniform(0, 1, size)
+    identification_rate = rng.uniform(0.1, 1, size)
+
+    batch = min(timeit.repeat(
+        lambda: covid_bayes.predict_risk_batch(
+            infectious_rate, vaccination_rate, vaccine_efficacy, identification_rate
+        ),
+        number=1,
+        repeat=repeat
+    ))
+    n_scalar = min(size, 10_000)
+    scalar = min(timeit.repeat(
+        lambda: [
+            covid_bayes.predict_risk(
+                infectious_rate[i],
+                vaccination_rate[i],
+                vaccine_efficacy[i],
+                identification_rate=identification_rate[i]
+            )
+            for i in range(n_scalar)
+        ],
+        number=1,
+        repeat=repeat
+    ))
+
+    return {'batch': size / batch, 'scalar': n_scalar / scalar}
+
+
+def bench_predict_risk_uncertainty(
+    draws: int=100_000, repeat: int=5, seed: int=0
+) -> float:
+    """Return the best seconds per call of predict_risk_uncertainty with draws"""
+    new_cases = np.random.default_rng(seed).poisson(500, 14)
+
+    return min(timeit.repeat(
+        lambda: covid_bayes.predict_risk_uncertainty(
+            new_cases, 1e6, 0.6, vaccination_growth=1e-3, draws=draws, seed=seed
+        ),
+        number=1,
+        repeat=repeat
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1_000_000)
+    parser.add_argument('--draws', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, rate in bench_predict_risk(args.size, args.repeat).items():
+        print('{:>8}: {:,.0f} evaluations/s'.format(name, rate))
+    seconds = bench_predict_risk_uncertainty(args.draws, args.repeat)
+    print('uncertainty: {:.1f} ms for {:,} draws'.format(seconds * 1e3, args.draws))
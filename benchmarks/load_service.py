@@ -0,0 +1,209 @@
+"""Requests per second sustained by the JSON risk service
+
+    python -m benchmarks.load_service --seconds 10 --connections 8
+    python -m benchmarks.load_service --url http://127.0.0.1:8502/ --batch 100
+
+Without --url, a synthetic mirror is written to a temporary directory and the
+service is started on it in a subprocess pinned to one CPU. Queries are spread
+over every US county and state and the slider values of the model page.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+import datetime as dt
+from typing import List, Optional
+
+import numpy as np
+import yaml
+
+from benchmarks import synthetic
+
+
+def get_json(url: str, path: str) -> dict:
+    """Return the JSON response of a GET request"""
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def make_queries(url: str, country: str='US', seed: int=0) -> List[dict]:
+    """Return queries for every region and sub-region of country, random parameters"""
+    rng = random.Random(seed)
+    query = urllib.parse.urlencode({'country': country})
+    regions = get_json(url, '/locations?' + query)['regions']
+    locations = [{'country': country}]
+    for region in regions:
+        locations.append({'country': country, 'region': region})
+        query = urllib.parse.urlencode({'country': country, 'region': region})
+        for sub_region in get_json(url, '/locations?' + query)['sub_regions']:
+            locations.append(
+                {'country': country, 'region': region, 'sub_region': sub_region}
+            )
+
+    return [
+        dict(
+            location,
+            efficacy=rng.randint(1, 100) / 100,
+            detection=rng.randint(1, 100) / 100
+        )
+        for location in locations
+    ]
+
+
+def load_test(
+    url: str,
+    queries: List[dict],
+    seconds: float=10,
+    connections: int=8,
+    batch: int=1
+) -> dict:
+    """Send queries over keep-alive connections for a number of seconds
+
+    Args:
+        url (str): base URL of the service
+        queries (List[dict]): risk queries, sent in turn
+        seconds (float): duration of the test
+        connections (int): number of concurrent client connections
+        batch (int): queries per request. If 1, GET /risk is used, otherwise
+            POST /risk.
+    Returns:
+        results (dict): requests, queries and errors per second, and request
+            latency percentiles in milliseconds
+    """
+    parts = urllib.parse.urlsplit(url)
+    deadline = time.perf_counter() + seconds
+    latencies = [[] for _ in range(connections)]
+    errors = [0] * connections
+
+    def client(worker: int):
+        connection = http.client.HTTPConnection(parts.hostname, parts.port)
+        position = worker * len(queries) // connections
+        while time.perf_counter() < deadline:
+            chunk = [queries[(position + i) % len(queries)] for i in range(batch)]
+            position += batch
+            start = time.perf_counter()
+            if batch == 1:
+                connection.request('GET', '/risk?' + urllib.parse.urlencode(chunk[0]))
+            else:
+                connection.request(
+                    'POST',
+                    '/risk',
+                    body=json.dumps({'queries': chunk}),
+                    headers={'Content-Type': 'application/json'}
+                )
+            response = connection.getresponse()
+            response.read()
+            latencies[worker].append(time.perf_counter() - start)
+            errors[worker] += response.status != 200
+        connection.close()
+
+    threads = [
+        threading.Thread(target=client, args=(worker,)) for worker in range(connections)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    times = np.concatenate([np.array(worker) for worker in latencies]) * 1e3
+    requests = len(times)
+
+    return {
+        'requests_per_second': requests / elapsed,
+        'queries_per_second': requests * batch / elapsed,
+        'errors': int(sum(errors)),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p99_ms': float(np.percentile(times, 99))
+    }
+
+
+def start_service(workdir: str, n_counties: int=3000, n_countries: int=190):
+    """Start the service on a synthetic mirror, returning (process, url)"""
+    # The service loads data up to yesterday
+    config = synthetic.write_mirror(
+        os.path.join(workdir, 'mirror'),
+        dt.date.today(),
+        n_counties=n_counties,
+        n_countries=n_countries
+    )
+    config['data_dir'] = os.path.join(workdir, 'data') + '/'
+    config['refresh'] = {'interval_minutes': 24 * 60}
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    def pin():
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'src.service', '--config', config_path, '--port', '0'],
+        stdout=subprocess.PIPE,
+        text=True,
+        preexec_fn=pin
+    )
+    # The service prints its URL once the data is loaded
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError('service failed to start')
+
+    return process, line.strip().rsplit(' ', 1)[-1]
+
+
+def main(argv: Optional[List[str]]=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='running service (default: start one)')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--countries', type=int, default=190)
+    args = parser.parse_args(argv)
+
+    process = workdir = None
+    url = args.url
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix='covid-service-')
+            process, url = start_service(workdir, args.counties, args.countries)
+        queries = make_queries(url)
+        results = load_test(
+            url,
+            queries,
+            seconds=args.seconds,
+            connections=args.connections,
+            batch=args.batch
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print('{:,} distinct queries over {} connections for {:.0f}s'.format(
+        len(queries), args.connections, args.seconds
+    ))
+    for name, value in results.items():
+        print('{:>20}: {:,.1f}'.format(name, value))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""Offline benchmark suite for the data pipeline and risk model
+
+    python -m benchmarks.run --counties 3000 --countries 190 --output bench.json
+    python -m benchmarks.run --compare bench.json
+
+Builds a synthetic mirror of the JHU/CCI sources in a temporary directory, times
+each pipeline stage against it and saves the results as JSON. With --compare,
+median timings are compared against a previous run and regressions are flagged.
+"""
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+import datetime as dt
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import app
+from src.data import bundle, caching, data, locations, population, standin, store
+from src.model import covid_bayes, overview, risk_table, trends
+from src.pages import model
+from benchmarks import synthetic
+from benchmarks.bench_covid_bayes import (
+    bench_predict_risk, bench_predict_risk_uncertainty
+)
+
+
+_TODAY = dt.date(2021, 9, 1)
+
+
+def time_call(func: Callable, repeat: int=5, number: int=1) -> dict:
+    """Return min/median/mean seconds per call of func over repeat timed runs"""
+    times = np.array(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+    return {
+        'min': float(times.min()),
+        'median': float(np.median(times)),
+        'mean': float(times.mean()),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+def run_benchmarks(
+    n_counties: int=3000,
+    n_countries: int=190,
+    n_days: int=15,
+    repeat: int=5,
+    workdir: Optional[str]=None
+) -> dict:
+    """Run all benchmarks against a synthetic mirror at the given scale
+
+    Args:
+        n_counties (int): number of synthetic US counties
+        n_countries (int): number of synthetic countries other than the US
+        n_days (int): length of the case window in days
+        repeat (int): number of timed repeats of each benchmark
+        workdir (Optional[str]): directory for the mirror and data. If None, a
+            temporary directory is used and removed afterwards.
+    Returns:
+        results (dict): {'meta': {...}, 'results': {name: timings}}
+    """
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='covid-bench-')
+    caching.set_backend('none')
+    results = {}
+    try:
+        config = synthetic.write_mirror(
+            os.path.join(workdir, 'mirror'),
+            _TODAY,
+            n_counties=n_counties,
+            n_countries=n_countries,
+            n_days=n_days
+        )
+
+        def cold_load():
+            config['data_dir'] = tempfile.mkdtemp(dir=workdir) + '/'
+            data.load_cases(_TODAY, config['data_dir'], config=config, window=n_days)
+
+        results['load_cases_cold'] = time_call(cold_load, repeat=repeat)
+
+        # The same downloads over HTTP, from a local asyncio stand-in of upstream
+        server = standin.serve_async(os.path.join(workdir, 'mirror'))
+        http_config = dict(
+            config,
+            jhu_url=server.url + 'daily_reports/',
+            cci_us_url=server.url + 'vaccinations_us.csv',
+            cci_global_url=server.url + 'vaccinations_global.csv'
+        )
+
+        def cold_load_http():
+            http_config['data_dir'] = tempfile.mkdtemp(dir=workdir) + '/'
+            data.load_cases(
+                _TODAY, http_config['data_dir'], config=http_config, window=n_days
+            )
+
+        try:
+            results['load_cases_cold.http'] = time_call(cold_load_http, repeat=repeat)
+        finally:
+            server.close()
+
+        data_dir = config['data_dir']
+        dates = [
+            (_TODAY - dt.timedelta(days=d)).strftime('%m-%d-%Y')
+            for d in range(1, n_days + 1)
+        ]
+
+        # First load of a new app process from a bundled snapshot, without
+        # downloading (see app.load_data)
+        bundle_dir = os.path.join(workdir, 'bundle') + '/'
+        bundle.prepare(
+            _TODAY, data_dir, config=config, download=False, published_dir=bundle_dir
+        )
+        bundled_config = dict(config, snapshot_dir=bundle_dir)
+
+        def cold_start_bundled():
+            app.load_data(
+                _TODAY,
+                tempfile.mkdtemp(dir=workdir) + '/',
+                config=bundled_config,
+                download=False,
+                stale=True
+            )
+
+        results['cold_start.bundled'] = time_call(cold_start_bundled, repeat=repeat)
+
+        def ingest():
+            shutil.rmtree(store.partition_dir(data_dir))
+            store.ingest_JHU(dates, data_dir=data_dir)
+
+        results['ingest_JHU'] = time_call(ingest, repeat=repeat)
+
+        def backfill():
+            shutil.rmtree(store.partition_dir(data_dir))
+            store.ingest_JHU(dates, data_dir=data_dir, workers=os.cpu_count())
+
+        results['ingest_JHU.parallel'] = time_call(backfill, repeat=repeat)
+        results['load_and_concat'] = time_call(
+            lambda: data.load_and_concat(dates, data_dir=data_dir, today=_TODAY),
+            repeat=repeat
+        )
+
+        df = data.load_and_concat(dates, data_dir=data_dir, today=_TODAY)
+        vacc_data = data.load_vaccinations(data_dir=data_dir)
+        index = locations.build_index(df)
+        populations = population.build_table(df)
+        results['build_index'] = time_call(lambda: locations.build_index(df), repeat)
+
+        selections = {
+            'country': ('US', 'All', 'All'),
+            'state': ('US', 'State 0', 'All'),
+            'county': ('US', 'State 0', 'County 0'),
+            'other_country': ('Country 1', 'All', 'All')
+        }
+        for name, selection in selections.items():
+            country, region, sub_region = selection
+            results['subset_data.' + name] = time_call(
+                lambda: data.subset_data(df, *selection, populations=populations),
+                repeat
+            )
+            results['subset_data_indexed.' + name] = time_call(
+                lambda: data.subset_data(
+                    locations.select(df, index, *selection), *selection,
+                    populations=populations
+                ),
+                repeat
+            )
+            results['get_pop.' + name] = time_call(
+                lambda: model.get_pop(df, country, region=region), repeat
+            )
+            results['calc_vacc_rate.' + name] = time_call(
+                lambda: model.calc_vacc_rate(df, vacc_data, *selection), repeat
+            )
+
+        results['population.build_table'] = time_call(
+            lambda: population.build_table(df), repeat
+        )
+        results['build_location_table'] = time_call(
+            lambda: risk_table.build_location_table(
+                risk_table.build_daily_series(df), vacc_data
+            ),
+            repeat
+        )
+        # Computed once per selected location; slider moves then index into it
+        results['risk_grid'] = time_call(lambda: model.risk_grid(0.01, 0.6), repeat)
+        table = risk_table.build_location_table(
+            risk_table.build_daily_series(df), vacc_data
+        )
+        for view in overview.VIEWS:
+            # Locations are gathered once; points are re-evaluated on slider moves
+            locs = overview.build_overview(df, table, view)
+            name = 'overview.map_points.' + view.replace(' ', '_').lower()
+            results[name] = time_call(
+                lambda: overview.map_points(locs, 0.65, 1.0), repeat
+            )
+        series = risk_table.build_daily_series(df)
+        results['build_trend_table'] = time_call(
+            lambda: trends.build_trend_table(series), repeat
+        )
+        trend_table = trends.build_trend_table(series)
+        results['rank.sub_region'] = time_call(
+            lambda: trends.rank(trend_table, 'growth_rate', country='US'), repeat
+        )
+        results['predict_risk'] = time_call(
+            lambda: covid_bayes.predict_risk(0.01, 0.6, 0.65, identification_rate=0.5),
+            repeat=repeat,
+            number=1000
+        )
+        throughput = bench_predict_risk(size=1_000_000, repeat=repeat)
+        results['predict_risk_batch.1M'] = {
+            'median': 1_000_000 / throughput['batch'],
+            'evaluations_per_second': throughput['batch']
+        }
+        results['predict_risk_uncertainty.100k'] = {
+            'median': bench_predict_risk_uncertainty(draws=100_000, repeat=repeat)
+        }
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = {
+        'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'scale': {
+            'n_counties': n_counties,
+            'n_countries': n_countries,
+            'n_days': n_days,
+            'n_rows': int(len(df))
+        }
+    }
+
+    return {'meta': meta, 'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float=0.1) -> pd.DataFrame:
+    """Compare median timings of two runs, flagging slowdowns beyond threshold"""
+    rows = []
+    for name, timings in current['results'].items():
+        before = baseline['results'].get(name, {}).get('median', np.nan)
+        rows.append({
+            'benchmark': name,
+            'baseline': before,
+            'current': timings['median'],
+            'ratio': timings['median'] / before
+        })
+    comparison = pd.DataFrame(rows).set_index('benchmark')
+    comparison['regression'] = comparison.ratio > 1 + threshold
+
+    return comparison
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--countries', type=int, default=190)
+    parser.add_argument('--days', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workdir', help='keep the mirror and data here')
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1, help='slowdown flagged as regression'
+    )
+    args = parser.parse_args()
+
+    current = run_benchmarks(
+        n_counties=args.counties,
+        n_countries=args.countries,
+        n_days=args.days,
+        repeat=args.repeat,
+        workdir=args.workdir
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    summary = pd.DataFrame(current['results']).T[['median']]
+    print(summary.to_string(float_format='{:.6f}'.format))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        comparison = compare(current, baseline, threshold=args.threshold)
+        print(comparison.to_string(float_format='{:.4f}'.format))
+        if comparison.regression.any():
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
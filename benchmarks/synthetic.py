@@ -0,0 +1,247 @@
+"""Synthetic JHU daily reports and CCI vaccination files for offline benchmarks
+
+    python -m benchmarks.synthetic ./mirror/ --counties 3000 --countries 190 --days 30
+
+Files follow the schemas of the real sources, laid out as a mirror that the app can
+be pointed at with file:// URLs (see mirror_config):
+
+    <directory>/daily_reports/<%m-%d-%Y>.csv
+    <directory>/vaccinations_us.csv
+    <directory>/vaccinations_global.csv
+"""
+import os
+import argparse
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+
+_JHU_COLUMNS = [
+    'FIPS',
+    'Admin2',
+    'Province_State',
+    'Country_Region',
+    'Last_Update',
+    'Lat',
+    'Long_',
+    'Confirmed',
+    'Deaths',
+    'Recovered',
+    'Active',
+    'Combined_Key',
+    'Incident_Rate',
+    'Case_Fatality_Ratio'
+]
+
+
+def make_locations(
+    n_counties: int=3000,
+    n_states: int=50,
+    n_countries: int=190,
+    n_provinces: int=5,
+    seed: int=0
+) -> pd.DataFrame:
+    """Return synthetic locations with populations
+
+    US rows have a state and county (Admin2). One in ten other countries is split
+    into n_provinces provinces; the rest are reported at country level only. The
+    first of them is named 'United Kingdom', which the app lists after the US.
+    """
+    rng = np.random.default_rng(seed)
+    states = ['State {}'.format(i) for i in range(n_states)]
+    us = pd.DataFrame({
+        'FIPS': np.arange(n_counties) + 1000.0,
+        'Admin2': ['County {}'.format(i) for i in range(n_counties)],
+        'Province_State': [states[i % n_states] for i in range(n_counties)],
+        'Country_Region': 'US',
+        'population': rng.integers(1_000, 1_000_000, n_counties)
+    })
+
+    rows = []
+    names = ['United Kingdom'] + [
+        'Country {}'.format(i) for i in range(1, n_countries)
+    ]
+    for i, name in enumerate(names):
+        provinces = [
+            'Province {}'.format(p) for p in range(n_provinces)
+        ] if i % 10 == 0 else [np.nan]
+        for province in provinces:
+            rows.append({
+                'FIPS': np.nan,
+                'Admin2': np.nan,
+                'Province_State': province,
+                'Country_Region': name,
+            })
+    others = pd.DataFrame(rows)
+    others['population'] = rng.integers(100_000, 100_000_000, len(others))
+    locations = pd.concat([us, others], ignore_index=True)
+    locations['Lat'] = rng.uniform(-60, 70, len(locations))
+    locations['Long_'] = rng.uniform(-180, 180, len(locations))
+    locations['Combined_Key'] = (
+        locations.Admin2.fillna('') + ', ' + locations.Province_State.fillna('')
+        + ', ' + locations.Country_Region
+    )
+
+    return locations
+
+
+def write_jhu_reports(
+    directory: str,
+    today: dt.date,
+    locations: pd.DataFrame,
+    n_days: int=15,
+    seed: int=0
+) -> None:
+    """Write n_days of synthetic JHU daily reports up to the day before today"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(directory, 'daily_reports'), exist_ok=True)
+
+    # Cumulative cases, growing at a location-specific daily rate
+    daily_rate = rng.uniform(0, 1e-3, len(locations))
+    confirmed = np.floor(locations.population * rng.uniform(0.01, 0.15, len(locations)))
+    for d in range(n_days, 0, -1):
+        date = today - dt.timedelta(days=d)
+        confirmed = confirmed + rng.poisson(daily_rate * locations.population)
+        deaths = np.floor(confirmed * 0.015)
+        report = locations.drop('population', axis=1).assign(
+            Last_Update=(date + dt.timedelta(days=1)).strftime('%Y-%m-%d 04:21:24'),
+            Confirmed=confirmed.astype(np.int64),
+            Deaths=deaths.astype(np.int64),
+            Recovered=np.nan,
+            Active=np.nan,
+            Incident_Rate=confirmed / locations.population * 1e5,
+            Case_Fatality_Ratio=deaths / confirmed * 100
+        )
+        report[_JHU_COLUMNS].to_csv(
+            os.path.join(directory, 'daily_reports', date.strftime('%m-%d-%Y.csv')),
+            index=False
+        )
+
+    return None
+
+
+def write_vaccinations(
+    directory: str,
+    today: dt.date,
+    locations: pd.DataFrame,
+    n_days: int=30,
+    seed: int=0
+) -> None:
+    """Write synthetic CCI US (by state) and global (by country) vaccination files"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    dates = [(today - dt.timedelta(days=d)).isoformat() for d in range(n_days, 0, -1)]
+
+    us = locations.loc[locations.Country_Region == 'US']
+    states = us.groupby('Province_State').population.sum()
+    countries = locations.groupby('Country_Region').population.sum()
+
+    def series(populations: pd.Series) -> pd.DataFrame:
+        start = rng.uniform(0.2, 0.6, len(populations))
+        growth = rng.uniform(0, 2e-3, len(populations))
+        frames = []
+        for i, date in enumerate(dates):
+            fully = np.floor(populations.to_numpy() * np.minimum(start + growth * i, 1))
+            frames.append(pd.DataFrame({
+                'Date': date,
+                'Region': populations.index,
+                'fully': fully.astype(np.int64),
+                'partially': np.floor(fully * 0.1).astype(np.int64)
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+    vacc_us = series(states)
+    pd.DataFrame({
+        'FIPS': 1,
+        'Province_State': vacc_us.Region,
+        'Country_Region': 'US',
+        'Date': vacc_us.Date,
+        'Lat': 0.0,
+        'Long_': 0.0,
+        'Vaccine_Type': 'All',
+        'Doses_admin': vacc_us.fully * 2,
+        'People_Partially_Vaccinated': vacc_us.partially,
+        'People_Fully_Vaccinated': vacc_us.fully,
+        'Combined_Key': vacc_us.Region + ', US',
+        'UID': 84000000
+    }).to_csv(os.path.join(directory, 'vaccinations_us.csv'), index=False)
+
+    vacc_global = series(countries)
+    pd.DataFrame({
+        'Country_Region': vacc_global.Region,
+        'Date': vacc_global.Date,
+        'Doses_admin': vacc_global.fully * 2,
+        'People_partially_vaccinated': vacc_global.partially,
+        'People_fully_vaccinated': vacc_global.fully,
+        'Report_Date_String': vacc_global.Date,
+        'UID': 1,
+        'Province_State': np.nan
+    }).to_csv(os.path.join(directory, 'vaccinations_global.csv'), index=False)
+
+    return None
+
+
+def write_mirror(
+    directory: str,
+    today: dt.date,
+    n_counties: int=3000,
+    n_countries: int=190,
+    n_days: int=15,
+    seed: int=0
+) -> dict:
+    """Write a complete synthetic mirror and return an app config pointing at it
+
+    Args:
+        directory (str): mirror directory
+        today (dt.date): run date; reports are written up to the previous day
+        n_counties (int): number of US counties
+        n_countries (int): number of countries other than the US
+        n_days (int): number of daily reports
+        seed (int): random seed
+    Returns:
+        config (dict): see mirror_config
+    """
+    locations = make_locations(n_counties=n_counties, n_countries=n_countries, seed=seed)
+    write_jhu_reports(directory, today, locations, n_days=n_days, seed=seed)
+    write_vaccinations(directory, today, locations, n_days=max(n_days, 30), seed=seed)
+
+    return mirror_config(directory)
+
+
+def mirror_config(directory: str, data_dir: str='./data/') -> dict:
+    """Return an app config reading from a mirror written by write_mirror"""
+    base = 'file://' + os.path.abspath(directory) + '/'
+    config = {
+        'data_dir': data_dir,
+        'jhu_url': base + 'daily_reports/',
+        'cci_us_url': base + 'vaccinations_us.csv',
+        'cci_global_url': base + 'vaccinations_global.csv',
+        'fetch': {'workers': 8, 'retries': 0, 'timeout': 30, 'backoff': 0}
+    }
+
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--countries', type=int, default=190)
+    parser.add_argument('--days', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--today',
+        type=lambda s: dt.datetime.strptime(s, '%Y-%m-%d').date(),
+        default=dt.date.today()
+    )
+    args = parser.parse_args()
+
+    write_mirror(
+        args.directory,
+        args.today,
+        n_counties=args.counties,
+        n_countries=args.countries,
+        n_days=args.days,
+        seed=args.seed
+    )
@@ -0,0 +1,182 @@
+"""Run the risk pipeline headless, e.g. as a nightly job
+
+    python -m src.cli --efficacy 0.5 0.65 0.8 --detection 0.25 0.5 1.0 \\
+        --output risk.parquet
+
+Downloads and ingests the latest data, builds the model inputs for every location
+(in parallel across countries) and writes risk over the parameter grid to Parquet
+or CSV. With --trends, case growth rates and nowcasts are also written.
+"""
+import os
+import argparse
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.data import caching, data, locations
+from src.model import risk_table, trends
+
+
+_LEVELS = ['all', 'country', 'region', 'sub_region']
+
+
+def build_table(
+    df: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    infectious_duration: int=10,
+    workers: int=1
+) -> pd.DataFrame:
+    """Build model inputs for every location, split across a process pool by country
+
+    Args:
+        df (pd.DataFrame): JHU COVID data, as returned by data.load_cases
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        infectious_duration (int): Number of days following +ve test that individuals
+            are assumed to remain infectious
+        workers (int): number of worker processes
+    Returns:
+        table (pd.DataFrame): See risk_table.build_location_table
+    """
+    if workers <= 1:
+        return _build_table(df, vacc_data, infectious_duration)
+
+    # Balance countries across workers by row count, largest first
+    index = locations.build_index(df)
+    chunks = [[] for _ in range(workers)]
+    sizes = np.zeros(workers)
+    for country in sorted(index, key=lambda c: -len(index[c]['rows'])):
+        chunk = np.argmin(sizes)
+        chunks[chunk].append(index[country]['rows'])
+        sizes[chunk] += len(index[country]['rows'])
+    frames = [df.iloc[np.concatenate(rows)] for rows in chunks if rows]
+
+    with ProcessPoolExecutor(max_workers=len(frames)) as pool:
+        tables = list(pool.map(
+            _build_table, frames, repeat(vacc_data), repeat(infectious_duration)
+        ))
+
+    return pd.concat(tables)
+
+
+def write_results(results: pd.DataFrame, path: str, format: Optional[str]=None) -> None:
+    """Write results to path as Parquet or CSV, inferring format from the extension"""
+    if format is None:
+        format = 'csv' if path.endswith('.csv') else 'parquet'
+
+    results = results.reset_index()
+    if format == 'csv':
+        results.to_csv(path + '.tmp', index=False)
+    else:
+        results.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return None
+
+
+def main(argv: Optional[List[str]]=None) -> None:
+    args = _parse_args(argv)
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    caching.set_backend(args.cache, cache_dir=config['data_dir'] + 'cache/')
+
+    if args.ingest_workers:
+        config['ingest'] = {**config.get('ingest', {}), 'workers': args.ingest_workers}
+    window = args.window or config.get('window', 15)
+    df = data.load_cases(args.today, config['data_dir'], config=config, window=window)
+    vacc_data = data.load_vaccinations(
+        data_dir=config['data_dir'], as_of=args.today - dt.timedelta(days=1)
+    )
+    if args.countries:
+        df = df.loc[df.Country_Region.isin(args.countries)]
+
+    table = build_table(df, vacc_data, args.infectious_duration, workers=args.workers)
+    table = risk_table.select_level(table, args.level)
+    results = risk_table.risk_grid(table, args.efficacy, args.detection)
+    write_results(results, args.output, format=args.format)
+
+    print('Wrote {} rows for {} locations to {}'.format(
+        len(results), len(table), args.output
+    ))
+    if args.trends:
+        trend_table = trends.build_trend_table(
+            risk_table.build_daily_series(df), args.nowcast_durations
+        )
+        trend_table = risk_table.select_level(trend_table, args.level)
+        write_results(trend_table, args.trends, format=args.format)
+        print('Wrote trends for {} locations to {}'.format(
+            len(trend_table), args.trends
+        ))
+
+    return None
+
+
+def _build_table(
+    df: pd.DataFrame, vacc_data: pd.DataFrame, infectious_duration: int
+) -> pd.DataFrame:
+    series = risk_table.build_daily_series(df)
+
+    return risk_table.build_location_table(series, vacc_data, infectious_duration)
+
+
+def _parse_args(argv: Optional[List[str]]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--config', default='./config.yaml', help='app config file')
+    parser.add_argument(
+        '--today',
+        type=lambda s: dt.datetime.strptime(s, '%Y-%m-%d').date(),
+        default=dt.date.today(),
+        help='run date (YYYY-MM-DD); data up to the previous day is used'
+    )
+    parser.add_argument(
+        '--window', type=int, help='days of case data to load (default: config)'
+    )
+    parser.add_argument('--infectious-duration', type=int, default=10)
+    parser.add_argument(
+        '--efficacy', type=float, nargs='+', default=[0.65], help='vaccine efficacies'
+    )
+    parser.add_argument(
+        '--detection',
+        type=float,
+        nargs='+',
+        default=[1.0],
+        help='infection detection (identification) rates'
+    )
+    parser.add_argument(
+        '--countries', nargs='*', help='countries to include (default: all)'
+    )
+    parser.add_argument('--level', choices=_LEVELS, default='all')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument(
+        '--ingest-workers',
+        type=int,
+        help='processes parsing daily reports, e.g. to backfill a long --window '
+        '(default: config)'
+    )
+    parser.add_argument('--cache', choices=['disk', 'none'], default='disk')
+    parser.add_argument('--output', default='risk.parquet')
+    parser.add_argument('--format', choices=['parquet', 'csv'])
+    parser.add_argument(
+        '--trends', help='also write growth rates and nowcasts to this path'
+    )
+    parser.add_argument(
+        '--nowcast-durations',
+        type=int,
+        nargs='+',
+        default=[7, 10, 14],
+        help='infectious durations of the nowcasts written with --trends'
+    )
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main()
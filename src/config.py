@@ -0,0 +1,18 @@
+"""App configuration, read once per process
+
+Streamlit re-executes app.py on every interaction, so the config is read on first
+use and kept here, rather than on every run of the script.
+"""
+import functools
+
+import yaml
+
+
+@functools.lru_cache(maxsize=None)
+def load(path: str='./config.yaml') -> dict:
+    """Return the app config in path, read on the first call only
+
+    The config is shared by all callers, so must be treated as read-only.
+    """
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
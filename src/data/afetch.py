@@ -0,0 +1,524 @@
+"""Asynchronous download of remote data files over reused HTTP connections
+
+    results = afetch.fetch_many(jobs, workers=8, progress=callback)
+
+All downloads of a call run on one event loop and share a pool of keep-alive
+HTTP/1.1 connections per host, with at most `workers` requests in flight. Each
+response is streamed to a temporary file beside its destination, which is renamed
+over it only once the download completes, so a failed or cancelled download never
+leaves a partial file. file:// URLs (e.g. local mirrors), and URLs to be fetched
+through a proxy set in the environment (HTTP_PROXY, HTTPS_PROXY, NO_PROXY), are
+downloaded by fetch.fetch in a worker thread, as urllib honours proxies.
+"""
+import io
+import os
+import ssl
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from src.data import fetch as sync_fetch
+
+
+_CHUNK_SIZE = 1 << 16
+_MAX_REDIRECTS = 5
+# Seconds between progress callbacks while bytes are received
+_PROGRESS_INTERVAL = 0.1
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_REDIRECTS = {301, 302, 303, 307, 308}
+
+# Callback of (files done, files total, bytes received)
+Progress = Callable[[int, int, int], None]
+
+
+def fetch_many(
+    jobs: List[tuple],
+    workers: int=8,
+    progress: Optional[Progress]=None,
+    cancel: Optional[threading.Event]=None,
+    **kwargs
+) -> List[Tuple[bool, dict]]:
+    """Download jobs concurrently on a new event loop, see download_many
+
+    Args:
+        jobs (List[tuple]): (url, dest) pairs, or (url, dest, validators) triples for
+            conditional downloads
+        workers (int): maximum number of requests in flight
+        progress (Optional[Progress]): called with (files done, files total, bytes
+            received) as downloads progress, from the calling thread
+        cancel (Optional[threading.Event]): if set while downloading, in-flight
+            downloads are abandoned and asyncio.CancelledError is raised
+        **kwargs: passed to download (timeout, retries, backoff)
+    Returns:
+        results (List[Tuple[bool, dict]]): (changed, validators) of each job, in
+            order of jobs
+    """
+    if len(jobs) == 0:
+        return []
+
+    async def main():
+        task = asyncio.ensure_future(
+            download_many(jobs, workers=workers, progress=progress, **kwargs)
+        )
+        if cancel is not None:
+            watcher = asyncio.ensure_future(_cancel_on(cancel, task))
+            task.add_done_callback(lambda _: watcher.cancel())
+        return await task
+
+    return asyncio.run(main())
+
+
+async def download_many(
+    jobs: List[tuple],
+    workers: int=8,
+    progress: Optional[Progress]=None,
+    **kwargs
+) -> List[Tuple[bool, dict]]:
+    """Download jobs concurrently over shared keep-alive connections
+
+    If any job fails, or the calling task is cancelled, the other jobs are cancelled
+    and their temporary files removed before the error is raised.
+
+    Args:
+        jobs (List[tuple]): (url, dest) pairs, or (url, dest, validators) triples for
+            conditional downloads (see download)
+        workers (int): maximum number of requests in flight
+        progress (Optional[Progress]): called with (files done, files total, bytes
+            received) as downloads progress
+        **kwargs: passed to download (timeout, retries, backoff)
+    Returns:
+        results (List[Tuple[bool, dict]]): (changed, validators) of each job, in
+            order of jobs
+    """
+    pool = _Pool()
+    limit = asyncio.Semaphore(workers)
+    tracker = _Tracker(len(jobs), progress)
+
+    async def run(url, dest, validators=None):
+        async with limit:
+            result = await download(
+                pool, url, dest, validators, on_bytes=tracker.received, **kwargs
+            )
+        tracker.done()
+        return result
+
+    tasks = [asyncio.ensure_future(run(*job)) for job in jobs]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        pool.close()
+
+
+async def download(
+    pool: '_Pool',
+    url: str,
+    dest: str,
+    validators: Optional[dict]=None,
+    timeout: float=30,
+    retries: int=3,
+    backoff: float=0.5,
+    on_bytes: Optional[Callable[[int], None]]=None
+) -> Tuple[bool, dict]:
+    """Stream url to dest, retrying with exponential backoff
+
+    If validators is given, the request is made conditional on its ETag and
+    Last-Modified, and dest is only replaced if the content has changed, as in
+    fetch.fetch_if_changed.
+
+    Args:
+        pool (_Pool): connection pool of the event loop
+        url (str): http(s):// or file:// URL to download
+        dest (str): local path to save to
+        validators (Optional[dict]): 'etag', 'last_modified' and 'sha256' recorded
+            from the previous download
+        timeout (float): seconds allowed for connecting and for each read
+        retries (int): number of retries after the first failed attempt
+        backoff (float): initial delay in seconds between attempts, doubled after
+            each retry
+        on_bytes (Optional[Callable[[int], None]]): called with the size of each
+            chunk received
+    Returns:
+        changed (bool): True if new content was saved to dest
+        validators (dict): validators to record for the next call
+    """
+    if _use_urllib(url):
+        loop = asyncio.get_event_loop()
+        if validators is None:
+            await loop.run_in_executor(None, lambda: sync_fetch.fetch(
+                url, dest, timeout=timeout, retries=retries, backoff=backoff
+            ))
+            return True, {}
+        return await loop.run_in_executor(None, lambda: sync_fetch.fetch_if_changed(
+            url, dest, validators, timeout=timeout, retries=retries, backoff=backoff
+        ))
+
+    conditional = validators is not None
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    for attempt in range(retries + 1):
+        try:
+            return await _attempt(
+                pool, url, dest, headers, validators, conditional, timeout, on_bytes
+            )
+        except (urllib.error.URLError, OSError) as e:
+            delay = sync_fetch._retry_delay(e, attempt, retries, backoff)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+async def _attempt(
+    pool: '_Pool',
+    url: str,
+    dest: str,
+    headers: dict,
+    validators: dict,
+    conditional: bool,
+    timeout: float,
+    on_bytes: Optional[Callable[[int], None]]
+) -> Tuple[bool, dict]:
+    for _ in range(_MAX_REDIRECTS + 1):
+        response = await _request(pool, url, headers, timeout)
+        if response.status in _REDIRECTS and response.headers.get('Location'):
+            await response.discard()
+            url = urllib.parse.urljoin(url, response.headers['Location'])
+            continue
+        break
+
+    if response.status == 304:
+        await response.discard()
+        return False, validators
+    if response.status != 200:
+        await response.discard()
+        raise urllib.error.HTTPError(
+            url, response.status, response.reason, response.headers, None
+        )
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    unchanged = conditional and any([
+        etag and etag == validators.get('etag'),
+        not etag and last_modified and last_modified == validators.get('last_modified')
+    ])
+    if unchanged:
+        response.close()
+        return False, validators
+
+    sha256 = await _stream_to(
+        response.body(), dest, if_not_hash=validators.get('sha256'), on_bytes=on_bytes
+    )
+    new_validators = {'etag': etag, 'last_modified': last_modified, 'sha256': sha256}
+
+    return sha256 != validators.get('sha256'), new_validators
+
+
+async def _stream_to(
+    chunks: AsyncIterator[bytes],
+    dest: str,
+    if_not_hash: Optional[str]=None,
+    on_bytes: Optional[Callable[[int], None]]=None
+) -> str:
+    """Write chunks to dest via a temporary file and return their SHA-256
+
+    If the content hash equals if_not_hash, dest is left untouched. The temporary
+    file is removed if the download fails or is cancelled.
+    """
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            async for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                if on_bytes is not None:
+                    on_bytes(len(chunk))
+        if digest.hexdigest() != if_not_hash:
+            os.replace(tmp, dest)
+    finally:
+        # Releases or closes the connection if the body was not read to the end
+        await chunks.aclose()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return digest.hexdigest()
+
+
+async def _request(
+    pool: '_Pool', url: str, headers: dict, timeout: float
+) -> '_Response':
+    """Send a GET request for url, returning the response once its head is read"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in _DEFAULT_PORTS:
+        raise urllib.error.URLError('unsupported URL scheme: {}'.format(url))
+    key = (parts.scheme, parts.hostname, parts.port or _DEFAULT_PORTS[parts.scheme])
+    target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    host = parts.netloc.rpartition('@')[2]
+    lines = ['GET {} HTTP/1.1'.format(target), 'Host: {}'.format(host)]
+    lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+    lines += ['Accept-Encoding: identity', 'Connection: keep-alive', '', '']
+    request = '\r\n'.join(lines).encode('latin-1')
+
+    # An idle connection may have been closed by the server since its last use, in
+    # which case the request is resent once over a new connection
+    for fresh in [False, True]:
+        reader, writer, reused = await pool.acquire(key, timeout, fresh=fresh)
+        try:
+            writer.write(request)
+            await _wait(writer.drain(), timeout)
+            status_line = await _wait(reader.readline(), timeout)
+            if not status_line:
+                raise ConnectionResetError('connection closed by server')
+        except (ConnectionError, urllib.error.URLError):
+            writer.close()
+            if reused:
+                continue
+            raise
+        break
+
+    try:
+        version, status, reason = status_line.decode('latin-1').split(' ', 2)
+        status = int(status)
+        head = io.BytesIO()
+        while True:
+            line = await _wait(reader.readline(), timeout)
+            head.write(line)
+            if line in (b'\r\n', b'\n', b''):
+                break
+        head.seek(0)
+        response_headers = http.client.parse_headers(head)
+    except (ValueError, http.client.HTTPException) as e:
+        writer.close()
+        raise urllib.error.URLError('malformed response from {}: {}'.format(url, e))
+
+    return _Response(
+        pool, key, reader, writer, status, reason.strip(), response_headers, version,
+        timeout
+    )
+
+
+class _Response:
+    """Status, headers and streamed body of an HTTP response"""
+
+    def __init__(
+        self, pool, key, reader, writer, status, reason, headers, version, timeout
+    ):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._pool = pool
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        connection = (headers.get('Connection') or '').lower()
+        self._keep_alive = (
+            connection != 'close' and (version != 'HTTP/1.0' or connection == 'keep-alive')
+        )
+
+    async def body(self) -> AsyncIterator[bytes]:
+        """Yield the body in chunks, then return the connection to the pool"""
+        reader, timeout = self._reader, self._timeout
+        chunked = 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower()
+        length = self.headers.get('Content-Length')
+        reusable = self._keep_alive
+        try:
+            if self.status in (204, 304):
+                pass
+            elif chunked:
+                while True:
+                    size_line = await _wait(reader.readline(), timeout)
+                    size = _parse_size(size_line.split(b';')[0].strip() or b'0', 16)
+                    if size == 0:
+                        # Trailers end with a blank line
+                        while (await _wait(reader.readline(), timeout)).strip():
+                            pass
+                        break
+                    while size > 0:
+                        chunk = await _wait(reader.read(min(size, _CHUNK_SIZE)), timeout)
+                        if not chunk:
+                            raise _incomplete()
+                        size -= len(chunk)
+                        yield chunk
+                    await _wait(reader.readline(), timeout)
+            elif length is not None:
+                remaining = _parse_size(length)
+                while remaining > 0:
+                    chunk = await _wait(
+                        reader.read(min(remaining, _CHUNK_SIZE)), timeout
+                    )
+                    if not chunk:
+                        raise _incomplete()
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                # Delimited by the server closing the connection
+                reusable = False
+                while True:
+                    chunk = await _wait(reader.read(_CHUNK_SIZE), timeout)
+                    if not chunk:
+                        break
+                    yield chunk
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            if reusable:
+                self._pool.release(self._key, self._reader, self._writer)
+            else:
+                self._writer.close()
+
+    def close(self) -> None:
+        """Close the connection without reading the body"""
+        self._writer.close()
+
+        return None
+
+    async def discard(self) -> None:
+        """Read and drop the body, so the connection can be reused"""
+        async for _ in self.body():
+            pass
+
+        return None
+
+
+class _Pool:
+    """Idle keep-alive connections of an event loop, by (scheme, host, port)"""
+
+    def __init__(self):
+        self._idle = {}
+        self._ssl = None
+        self.opened = 0
+
+    async def acquire(self, key: tuple, timeout: float, fresh: bool=False) -> tuple:
+        """Return (reader, writer, reused), reusing an idle connection unless fresh"""
+        idle = self._idle.get(key, [])
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        if scheme == 'https' and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        reader, writer = await _wait(
+            asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == 'https' else None
+            ),
+            timeout
+        )
+        self.opened += 1
+
+        return reader, writer, False
+
+    def release(self, key: tuple, reader, writer) -> None:
+        self._idle.setdefault(key, []).append((reader, writer))
+
+        return None
+
+    def close(self) -> None:
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+        return None
+
+
+class _Tracker:
+    """Count files done and bytes received, reporting at most every interval"""
+
+    def __init__(self, total: int, progress: Optional[Progress]):
+        self.total = total
+        self.files = 0
+        self.bytes = 0
+        self._progress = progress
+        self._reported = 0.0
+
+    def received(self, size: int) -> None:
+        self.bytes += size
+        now = time.monotonic()
+        if self._progress is not None and now - self._reported >= _PROGRESS_INTERVAL:
+            self._reported = now
+            self._progress(self.files, self.total, self.bytes)
+
+        return None
+
+    def done(self) -> None:
+        self.files += 1
+        if self._progress is not None:
+            self._reported = time.monotonic()
+            self._progress(self.files, self.total, self.bytes)
+
+        return None
+
+
+async def _wait(awaitable, timeout: float):
+    """Await with a timeout, raised as a URLError so that it is retried
+
+    Unlike asyncio.wait_for on some Python versions, a cancellation arriving as the
+    awaitable completes is never swallowed.
+    """
+    future = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait([future], timeout=timeout)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    if not done:
+        future.cancel()
+        raise urllib.error.URLError('timed out after {}s'.format(timeout))
+
+    return future.result()
+
+
+async def _cancel_on(event: threading.Event, task: asyncio.Future) -> None:
+    """Cancel task once event is set"""
+    while not event.is_set():
+        await asyncio.sleep(0.05)
+    task.cancel()
+
+    return None
+
+
+def _use_urllib(url: str) -> bool:
+    """Return True if url is a file:// URL or is to be fetched through a proxy"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'file':
+        return True
+    proxied = parts.scheme in urllib.request.getproxies()
+
+    return proxied and not urllib.request.proxy_bypass(parts.hostname or '')
+
+
+def _parse_size(value, base: int=10) -> int:
+    """Parse a body or chunk size, raising a malformed one as a URLError to retry"""
+    try:
+        size = int(value, base)
+    except (TypeError, ValueError):
+        size = -1
+    if size < 0:
+        raise urllib.error.URLError('malformed body size: {!r}'.format(value))
+
+    return size
+
+
+def _incomplete() -> urllib.error.URLError:
+    return urllib.error.URLError('connection closed before the end of the body')
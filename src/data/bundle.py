@@ -0,0 +1,128 @@
+"""Prepared data snapshot bundled with the app for a fast cold start
+
+    python -m src.data.bundle ./snapshot/
+
+builds the frames served by the app and publishes them to a directory (see
+src.data.publish), e.g. when building the container image. On start, the app
+seeds its published data from the bundle if it has none, renders from it at once
+and fetches fresh data in the background.
+"""
+import os
+import shutil
+import hashlib
+import argparse
+import tempfile
+import datetime as dt
+from typing import Optional
+
+import yaml
+
+from src.data import afetch, caching, data, instrument, publish
+
+
+def prepare(
+    today: dt.date,
+    data_dir: str='./data/',
+    config: Optional[dict]=None,
+    download: bool=True,
+    progress: Optional[afetch.Progress]=None,
+    published_dir: Optional[str]=None
+) -> str:
+    """Load the case and vaccination frames served by the app and publish them
+
+    A new version is only published if the data has changed.
+
+    Args:
+        today (dt.date): Today's date
+        data_dir (str): root directory for app data
+        config (Optional[dict]): app config
+        download (bool): if False, only data already downloaded is used
+        progress (Optional[afetch.Progress]): download progress callback (see
+            data.load_cases)
+        published_dir (Optional[str]): publication directory, data_dir/published/
+            by default
+    Returns:
+        version (str): the current version
+    """
+    published_dir = published_dir or data_dir + 'published/'
+    df = data.load_cases(
+        today,
+        data_dir,
+        config=config,
+        window=(config or {}).get('window', 15),
+        download=download,
+        progress=progress
+    )
+    # Vaccination figures as of the last day of case data
+    vacc_data = data.load_vaccinations(
+        data_dir=data_dir, as_of=today - dt.timedelta(days=1)
+    )
+    version = hashlib.sha256('{}:{}'.format(
+        caching.get_version(df), caching.get_version(vacc_data)
+    ).encode()).hexdigest()[:16]
+
+    published = publish.current(published_dir)
+    if published is None or published['version'] != version:
+        publish.publish(
+            {'cases': df, 'vaccinations': vacc_data},
+            published_dir,
+            version,
+            today=today
+        )
+
+    return version
+
+
+def seed(bundle_dir: str, published_dir: str) -> bool:
+    """Publish the bundled snapshot's current version, if nothing is published yet
+
+    Args:
+        bundle_dir (str): directory of the bundled snapshot, as written by prepare
+        published_dir (str): publication directory of the app
+    Returns:
+        seeded (bool): True if the bundled version was published
+    """
+    bundled = publish.current(bundle_dir)
+    if bundled is None or publish.current(published_dir) is not None:
+        return False
+
+    with instrument.stage('seed_bundle', version=bundled['version']):
+        version_dir = os.path.join(published_dir, bundled['version'])
+        os.makedirs(published_dir, exist_ok=True)
+        if not os.path.exists(version_dir):
+            # Copied aside and renamed, as other processes may be seeding too
+            tmp = tempfile.mkdtemp(dir=published_dir, prefix='.seed-')
+            shutil.copytree(
+                os.path.join(bundle_dir, bundled['version']),
+                os.path.join(tmp, 'version')
+            )
+            try:
+                os.rename(os.path.join(tmp, 'version'), version_dir)
+            except OSError:
+                pass
+            shutil.rmtree(tmp, ignore_errors=True)
+        pointer = os.path.join(published_dir, 'CURRENT')
+        shutil.copyfile(os.path.join(bundle_dir, 'CURRENT'), pointer + '.tmp')
+        os.replace(pointer + '.tmp', pointer)
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', help='bundle directory, e.g. ./snapshot/')
+    parser.add_argument('--config', default='./config.yaml', help='app config file')
+    parser.add_argument(
+        '--today',
+        type=lambda s: dt.datetime.strptime(s, '%Y-%m-%d').date(),
+        default=dt.date.today(),
+        help='run date (YYYY-MM-DD); data up to the previous day is bundled'
+    )
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    version = prepare(
+        args.today, config['data_dir'], config=config, published_dir=args.directory
+    )
+    print('Bundled version {} in {}'.format(version, args.directory))
@@ -0,0 +1,327 @@
+"""Pluggable caching of pipeline functions
+
+Functions decorated with @cached are cached by the backend selected with
+set_backend at call time, so the same pipeline code runs inside a Streamlit server
+or headless:
+
+    'versioned' (default): in-process LRU cache, bounded by memory size and shared
+        by all sessions, optionally backed by disk. Objects registered with
+        set_version are keyed by their data-version token instead of being hashed,
+        and results are returned without copying, so must be treated as read-only.
+    'streamlit': st.cache
+    'disk': pickles under cache_dir
+    'none': no caching
+"""
+import os
+import sys
+import pickle
+import hashlib
+import weakref
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data import instrument
+
+
+_BACKEND = {
+    'name': 'versioned',
+    'cache_dir': './data/cache/',
+    'max_bytes': 1024 * 1e6,
+    'disk': False,
+    'max_disk_bytes': 2048 * 1e6
+}
+_LOCAL = threading.local()
+# Versioned backend state: key -> (value, size in bytes)
+_MEMORY = OrderedDict()
+_MEMORY_BYTES = [0]
+_LOCK = threading.RLock()
+# Data-version tokens by object id: id -> (weakref, token)
+_VERSIONS = {}
+
+
+def set_backend(
+    name: str,
+    cache_dir: Optional[str]=None,
+    max_mb: Optional[float]=None,
+    disk: Optional[bool]=None,
+    max_disk_mb: Optional[float]=None
+) -> None:
+    """Select the caching backend for all @cached functions
+
+    Args:
+        name (str): 'versioned', 'streamlit', 'disk' or 'none'
+        cache_dir (Optional[str]): directory for the 'disk' backend, and for the
+            'versioned' backend if disk is True
+        max_mb (Optional[float]): memory bound of the 'versioned' backend in MB
+        disk (Optional[bool]): back the 'versioned' backend with cache_dir
+        max_disk_mb (Optional[float]): size bound of cache_dir in MB; least recently
+            used results are removed beyond it
+    Returns:
+        None
+    """
+    if name not in _BACKENDS:
+        raise ValueError(
+            'Unknown cache backend {!r}, expected one of {}'.format(name, list(_BACKENDS))
+        )
+    _BACKEND['name'] = name
+    if cache_dir is not None:
+        _BACKEND['cache_dir'] = cache_dir
+    if max_mb is not None:
+        _BACKEND['max_bytes'] = max_mb * 1e6
+        with _LOCK:
+            _evict()
+    if disk is not None:
+        _BACKEND['disk'] = disk
+    if max_disk_mb is not None:
+        _BACKEND['max_disk_bytes'] = max_disk_mb * 1e6
+
+    return None
+
+
+def get_backend() -> str:
+    """Return the name of the selected caching backend"""
+    return _BACKEND['name']
+
+
+def set_version(obj: Any, token: str) -> None:
+    """Register the data-version token of obj, used in place of hashing its contents
+
+    The token applies to this exact object only; frames derived from it are hashed
+    as usual.
+    """
+    key = id(obj)
+
+    def forget(ref):
+        if _VERSIONS.get(key, (None,))[0] is ref:
+            del _VERSIONS[key]
+
+    _VERSIONS[key] = (weakref.ref(obj, forget), token)
+
+    return None
+
+
+def get_version(obj: Any) -> Optional[str]:
+    """Return the data-version token registered for obj, or None"""
+    entry = _VERSIONS.get(id(obj))
+    if entry is None or entry[0]() is not obj:
+        return None
+
+    return entry[1]
+
+
+def clear() -> None:
+    """Empty the in-memory cache of the 'versioned' backend"""
+    with _LOCK:
+        _MEMORY.clear()
+        _MEMORY_BYTES[0] = 0
+
+    return None
+
+
+def cached(func: Callable) -> Callable:
+    """Cache func with the backend selected at call time
+
+    Whether each call was a cache hit is recorded on the enclosing instrumented
+    stage, if any.
+    """
+    wrapped = {}
+
+    @functools.wraps(func)
+    def computed(*args, **kwargs):
+        # Flag the innermost open call as a cache miss
+        _LOCAL.calls[-1][0] = True
+        return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        name = _BACKEND['name']
+        if name not in wrapped:
+            wrapped[name] = _BACKENDS[name](computed)
+        calls = _LOCAL.__dict__.setdefault('calls', [])
+        calls.append([False])
+        try:
+            result = wrapped[name](*args, **kwargs)
+        finally:
+            miss = calls.pop()[0]
+        instrument.record_cache(hit=not miss)
+        return result
+
+    return wrapper
+
+
+def _versioned(func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = _hash_args(func, args, kwargs)
+        with _LOCK:
+            if key in _MEMORY:
+                _MEMORY.move_to_end(key)
+                return _MEMORY[key][0]
+
+        path = _disk_path(func, key)
+        if _BACKEND['disk'] and os.path.exists(path):
+            result = _load(path)
+        else:
+            result = func(*args, **kwargs)
+            if _BACKEND['disk']:
+                _save(path, result)
+
+        with _LOCK:
+            if key not in _MEMORY:
+                _MEMORY[key] = (result, _sizeof(result))
+                _MEMORY_BYTES[0] += _MEMORY[key][1]
+                _evict()
+
+        return result
+
+    return wrapper
+
+
+def _streamlit(func: Callable) -> Callable:
+    import streamlit as st
+
+    return st.cache(func)
+
+
+def _disk(func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        path = _disk_path(func, _hash_args(func, args, kwargs))
+        if os.path.exists(path):
+            return _load(path)
+
+        result = func(*args, **kwargs)
+        _save(path, result)
+
+        return result
+
+    return wrapper
+
+
+def _none(func: Callable) -> Callable:
+    return func
+
+
+def _evict() -> None:
+    """Drop least recently used entries until within the memory bound"""
+    while _MEMORY_BYTES[0] > _BACKEND['max_bytes'] and len(_MEMORY) > 1:
+        _, (_, size) = _MEMORY.popitem(last=False)
+        _MEMORY_BYTES[0] -= size
+
+    return None
+
+
+def _disk_path(func: Callable, key: str) -> str:
+    """Return the path of a cached result, salted with the code of func's module
+
+    Results of a previous version of the code are thus never loaded, and are
+    pruned once least recently used (see _prune).
+    """
+    return os.path.join(_BACKEND['cache_dir'], '{}-{}-{}.pkl'.format(
+        func.__name__, _code_salt(func.__module__), key
+    ))
+
+
+@functools.lru_cache(maxsize=None)
+def _code_salt(module: str) -> str:
+    """Return a short hash of the source file of module"""
+    path = getattr(sys.modules.get(module), '__file__', None)
+    if path is None:
+        return 'nosource'
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def _load(path: str) -> Any:
+    """Load a cached result, re-registering its data-version token"""
+    with open(path, 'rb') as f:
+        result, token = pickle.load(f)
+    if token is not None:
+        set_version(result, token)
+    # Marks the result as recently used, for _prune
+    os.utime(path)
+
+    return result
+
+
+def _save(path: str, result: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump((result, get_version(result)), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    _prune(os.path.dirname(path))
+
+    return None
+
+
+def _prune(cache_dir: str) -> None:
+    """Remove least recently used results until cache_dir is within its bound"""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.pkl'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    # The newest result is kept even if alone beyond the bound
+    for _, size, path in sorted(entries)[:-1]:
+        if total <= _BACKEND['max_disk_bytes']:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return None
+
+
+def _hash_args(func: Callable, args: tuple, kwargs: dict) -> str:
+    """Return a stable hash of a call's arguments
+
+    Objects with a registered data-version token are keyed by the token; other
+    DataFrames are hashed by content.
+    """
+    digest = hashlib.sha256(func.__qualname__.encode())
+    for name in sorted(kwargs):
+        digest.update(name.encode())
+    for value in list(args) + [kwargs[name] for name in sorted(kwargs)]:
+        token = get_version(value)
+        if token is not None:
+            digest.update(b'version:' + token.encode())
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+            digest.update(repr(list(getattr(value, 'columns', []))).encode())
+        else:
+            digest.update(pickle.dumps(value, protocol=4))
+
+    return digest.hexdigest()
+
+
+def _sizeof(value: Any) -> int:
+    """Return the approximate memory footprint of a cached value in bytes"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+
+    return sys.getsizeof(value)
+
+
+_BACKENDS = {
+    'versioned': _versioned,
+    'streamlit': _streamlit,
+    'disk': _disk,
+    'none': _none
+}
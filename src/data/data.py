@@ -1,17 +1,50 @@
 import os
+import json
 import datetime as dt
 from typing import List, Tuple, Optional
 
-import streamlit as st
 import pandas as pd
 
+from src.data import (
+    afetch, caching, instrument, manifest, population, store, vaccinations
+)
 
-def load_cases(today: dt.date, data_dir: str='./data/') -> pd.DataFrame:
+
+_JHU_URL = (
+    'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master'
+    '/csse_covid_19_data/csse_covid_19_daily_reports/'
+)
+_CCI_US_URL = (
+    'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables'
+    '/vaccine_data/us_data/hourly/vaccine_people_vaccinated_US.csv'
+)
+_CCI_GLOBAL_URL = (
+    'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables'
+    '/vaccine_data/global_data/time_series_covid19_vaccine_global.csv'
+)
+
+
+def load_cases(
+    today: dt.date,
+    data_dir: str='./data/',
+    config: Optional[dict]=None,
+    window: int=15,
+    download: bool=True,
+    progress: Optional[afetch.Progress]=None
+) -> pd.DataFrame:
     """
-    Load last 15 days of JHU COVID data.
+    Load the last `window` days of JHU COVID data.
 
     Args:
         today (dt.date)
+        data_dir (str): root directory for app data
+        config (Optional[dict]): app config, used for data source URLs and download
+            settings
+        window (int): number of days to load, including the additional day used to
+            calculate new case counts
+        download (bool): if False, only data already downloaded is used
+        progress (Optional[afetch.Progress]): called with (files done, files total,
+            bytes received) while daily reports are downloaded
     Returns:
         df (pd.DataFrame): DataFrame containing the last 15 days of JHU COVID 
             Incident_Rate and geographical info
@@ -23,63 +56,99 @@ def load_cases(today: dt.date, data_dir: str='./data/') -> pd.DataFrame:
     if not os.path.exists(data_dir + 'raw/vaccinations/'):
         os.mkdir(data_dir + 'raw/vaccinations/')
     # Additional day is downloaded to allow calc. of 14 days of new case counts
-    last_15 = [(today-dt.timedelta(days=d)).strftime('%m-%d-%Y') for d in range(1,16)]
+    last_15 = [
+        (today-dt.timedelta(days=d)).strftime('%m-%d-%Y') for d in range(1, window+1)
+    ]
 
-    raw_files = os.listdir(data_dir+'raw/')
-    downloaded = [f[:-4] for f in raw_files if f[-4:]=='.csv']
-    to_download = [f for f in last_15 if f not in downloaded]
+    # Reports and partitions not matching the manifest are removed, to be
+    # downloaded or ingested again
+    entries = manifest.read(data_dir)
+    to_download = manifest.validate(entries, last_15, data_dir, repair=download)
 
     # Download data from remote repositories
-    download_and_save_JHU(to_download, data_dir=data_dir)
-    download_and_save_CCI(data_dir)
+    config = config or {}
+    fetch_config = dict(config.get('fetch', {}))
+    workers = fetch_config.pop('workers', 8)
+    if download:
+        with instrument.stage('download_JHU', files=len(to_download)):
+            download_and_save_JHU(
+                to_download,
+                data_dir=data_dir,
+                base_url=config.get('jhu_url', _JHU_URL),
+                workers=workers,
+                progress=progress,
+                **fetch_config
+            )
+        manifest.add_downloads(entries, to_download, data_dir)
+        manifest.write(entries, data_dir)
+        with instrument.stage('download_CCI'):
+            download_and_save_CCI(
+                data_dir,
+                url_us=config.get('cci_us_url', _CCI_US_URL),
+                url_global=config.get('cci_global_url', _CCI_GLOBAL_URL),
+                **fetch_config
+            )
+        vaccinations.ingest(data_dir)
+    # Convert new daily reports to columnar partitions
+    with instrument.stage('ingest_JHU'):
+        store.ingest_JHU(
+            last_15,
+            data_dir=data_dir,
+            workers=config.get('ingest', {}).get('workers', 1)
+        )
+    if download:
+        manifest.add_partitions(entries, last_15, data_dir)
+        manifest.write(entries, data_dir)
 
     df = load_and_concat(last_15, data_dir=data_dir, today=today)
 
     return df
 
 
-def load_vaccinations(data_dir: str='./data/') -> pd.DataFrame:
+@instrument.timed()
+def load_vaccinations(
+    data_dir: str='./data/',
+    as_of: Optional[dt.date]=None,
+    history: bool=False
+) -> pd.DataFrame:
     """
-    Load latest CCI COVID vaccination data.
+    Load CCI COVID vaccination data.
 
     Args:
         data_dir (str): root directory for app data
+        as_of (Optional[dt.date]): date of the snapshot, e.g. the last date of the
+            case window. If None, the latest figures are used.
+        history (bool): if True, the full daily history is returned instead of a
+            snapshot
     Returns:
-        df (pd.DataFrame): DataFrame containing the last 15 days of CCI
-            COVID vaccination data for 'US' and 'Global'
+        df (pd.DataFrame): Snapshot of CCI COVID vaccination figures for 'US' states
+            and 'Global' countries, indexed by location (see vaccinations.snapshot),
+            or their daily history (see vaccinations.build_history)
     """
-    data_dir += 'raw/vaccinations/'
-    usecols_us = [
-        'Date',
-        'Country_Region',
-        'Province_State',
-        'People_Fully_Vaccinated',
-        'People_Partially_Vaccinated'
-    ]
-    usecols_global = [
-        'Date',
-        'Country_Region',
-        'Province_State',
-        'People_fully_vaccinated',
-        'People_partially_vaccinated'
-    ]
-    vacc_us = pd.read_csv(
-        data_dir+'vaccinations_us.csv', usecols=usecols_us
-    )
-    vacc_global = pd.read_csv(
-        data_dir+'vaccinations_global.csv', usecols=usecols_global
-    )
-    rename = {
-        'People_partially_vaccinated': 'People_Partially_Vaccinated',
-        'People_fully_vaccinated': 'People_Fully_Vaccinated'
-    }
-    vacc_global.rename(rename, axis=1, inplace=True)
-    vaccinations = pd.concat([vacc_us, vacc_global], axis=0)
- 
-    return vaccinations
+    vaccinations.ingest(data_dir)
+    df = vaccinations.read_history(data_dir)
+    if not history:
+        df = vaccinations.snapshot(
+            df, as_of=None if as_of is None else pd.Timestamp(as_of)
+        )
+    # The history is only rewritten when new data is downloaded, so its metadata
+    # identifies the data version
+    stat = os.stat(vaccinations.history_path(data_dir))
+    caching.set_version(df, '{}:{}:{}:{}'.format(
+        stat.st_size, stat.st_mtime_ns, as_of, history
+    ))
+
+    return df
 
 
-def download_and_save_JHU(to_download: List[str], data_dir: str='./data/') -> None:
+def download_and_save_JHU(
+    to_download: List[str],
+    data_dir: str='./data/',
+    base_url: str=_JHU_URL,
+    workers: int=8,
+    progress: Optional[afetch.Progress]=None,
+    **kwargs
+) -> None:
     """Download last 15* daily CSVs from JHU COVID tracker if not stored locally
     
     \* 15 days are pulled to allow a diff() operation to calculate new cases over the 
@@ -88,48 +157,133 @@ def download_and_save_JHU(to_download: List[str], data_dir: str='./data/') -> No
     Args:
         to_download (List[str]): dates to download in format '%m-%d-%Y'
         data_dir (str): root directory for app data
+        base_url (str): URL of the daily reports directory. May be a file:// mirror.
+        workers (int): maximum number of concurrent downloads
+        progress (Optional[afetch.Progress]): called with (files done, files total,
+            bytes received) as downloads progress
+        **kwargs: passed to afetch.download (timeout, retries, backoff)
     Returns:
         None
     """
     # Download any data from the last 15 days that is not stored locally
-    if len(to_download) > 0:
-        for d in to_download:
-            url = (
-                'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master'
-                '/csse_covid_19_data/csse_covid_19_daily_reports/{}.csv'.format(d)
-            )
-            pd.read_csv(url).to_csv(data_dir+'raw/{}.csv'.format(d))
+    jobs = [
+        (base_url + '{}.csv'.format(d), data_dir + 'raw/{}.csv'.format(d))
+        for d in to_download
+    ]
+    afetch.fetch_many(jobs, workers=workers, progress=progress, **kwargs)
 
     return None
 
 
-def download_and_save_CCI(data_dir: str='./data/raw/') -> None:
-    """Download the latest US and Global vaccination data from the CCI repo and save
+def download_and_save_CCI(
+    data_dir: str='./data/',
+    url_us: str=_CCI_US_URL,
+    url_global: str=_CCI_GLOBAL_URL,
+    **kwargs
+) -> None:
+    """Refresh the local US and Global vaccination data from the CCI repo
     
+    Each file is only downloaded if it has changed upstream since the last refresh,
+    as recorded in raw/vaccinations/sources.json. Only rows newer than the stored
+    high-water `Date` are then appended to the local copy.
+
     Args:
         data_dir (str): root directory for app data
+        url_us (str): URL of the CCI US vaccination time series
+        url_global (str): URL of the CCI global vaccination time series
+        **kwargs: passed to afetch.download (timeout, retries, backoff)
     Returns:
         None
     """
     data_dir += 'raw/vaccinations/'
-    url_us = (
-        'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables'
-        '/vaccine_data/us_data/hourly/vaccine_people_vaccinated_US.csv'
-    )
-    url_global = (
-        'https://raw.githubusercontent.com/govex/COVID-19/master/data_tables'
-        '/vaccine_data/global_data/time_series_covid19_vaccine_global.csv'
+    sources_path = data_dir + 'sources.json'
+    sources = {}
+    if os.path.exists(sources_path):
+        with open(sources_path, 'r') as f:
+            sources = json.load(f)
+
+    names = ['vaccinations_us.csv', 'vaccinations_global.csv']
+    # Both files are checked concurrently, then merged in turn
+    results = afetch.fetch_many(
+        [
+            (url, data_dir + name + '.download',
+                sources.get(name, {}).get('validators') or {})
+            for name, url in zip(names, [url_us, url_global])
+        ],
+        **kwargs
     )
-    pd.read_csv(url_us).to_csv(data_dir+'vaccinations_us.csv')
-    pd.read_csv(url_global, index_col=0).to_csv(data_dir+'vaccinations_global.csv')
+    for name, (changed, validators) in zip(names, results):
+        path = data_dir + name
+        source = sources.get(name, {})
+        if changed:
+            high_water = merge_vaccinations(
+                path + '.download', path, source.get('high_water'), source.get('size')
+            )
+            source = {'high_water': high_water, 'size': os.path.getsize(path)}
+        source['validators'] = validators
+        sources[name] = source
+
+        with open(sources_path + '.tmp', 'w') as f:
+            json.dump(sources, f, indent=2)
+        os.replace(sources_path + '.tmp', sources_path)
 
     return None
 
-@st.cache
+
+def merge_vaccinations(
+    new_path: str,
+    path: str,
+    high_water: Optional[str]=None,
+    size: Optional[int]=None
+) -> str:
+    """Append rows of new_path dated after high_water to path, and remove new_path
+
+    If there is no usable local copy at path, new_path replaces it.
+
+    Args:
+        new_path (str): freshly downloaded CCI vaccination CSV
+        path (str): local copy of the same file
+        high_water (Optional[str]): latest `Date` stored in path ('%Y-%m-%d')
+        size (Optional[int]): size of path in bytes when high_water was recorded
+    Returns:
+        high_water (str): latest `Date` now stored in path
+    """
+    new = pd.read_csv(new_path, dtype=str, keep_default_na=False)
+    dates = pd.to_datetime(new.Date)
+    latest = dates.max().strftime('%Y-%m-%d')
+
+    usable = (
+        high_water is not None
+        and size is not None
+        and os.path.exists(path)
+        and os.path.getsize(path) >= size
+    )
+    if usable:
+        usable = list(pd.read_csv(path, nrows=0).columns) == list(new.columns)
+
+    if not usable:
+        os.replace(new_path, path)
+        return latest
+
+    with open(path, 'r+b') as f:
+        # Drop anything written after the recorded size by an interrupted append
+        f.truncate(size)
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    rows = new.loc[dates > pd.Timestamp(high_water)]
+    rows.to_csv(path, mode='a', header=False, index=False)
+    os.remove(new_path)
+
+    return max(latest, high_water)
+
+
+@instrument.timed()
 def load_and_concat(
     last_15: List[str], data_dir: str='./data/', today: dt.date=None
 ) -> pd.DataFrame:
-    """Load and concatenate last 15 days of JHU COVID CSV data
+    """Load and concatenate last 15 days of ingested JHU COVID data
     
     Args:
         last_15 (list): Last 15 days' dates in format '%m-%d-%Y'
@@ -139,36 +293,41 @@ def load_and_concat(
         df (pd.DataFrame): DataFrame containing the last 15 days of JHU COVID 
             Incident_Rate and geographical info 
     """
-    kwargs = {
-        'usecols': [
-            'Admin2',
-            'Province_State',
-            'Country_Region',
-            'Last_Update',
-            'Incident_Rate',
-            'Confirmed'
-            ]
-    }
-    frames = [
-        pd.read_csv(data_dir+'raw/{}.csv'.format(date), **kwargs) for date in last_15
-    ]
-    # Do a little feature engineering
-    df = pd.concat(frames).reset_index(drop=True)
-    strptime_JHU = lambda x: dt.datetime.strptime(x, '%Y-%m-%d %H:%M:%S').date()
+    # Cached by the partitions' version, so re-ingested ones are read again
+    version = store.data_version(last_15, data_dir)
 
-    df['date'] = [strptime_JHU(d) for d in df.Last_Update]
-    df = df.sort_values(by='date').drop('Last_Update', axis=1)
+    return _read_window(last_15, data_dir, today, version)
 
-    df['population'] = (
-        df.Confirmed.div(df.Incident_Rate).mul(1e5).astype(int, errors='ignore')
-    )
+
+@caching.cached
+def _read_window(
+    last_15: List[str], data_dir: str, today: dt.date, version: str
+) -> pd.DataFrame:
+    """Return the window of load_and_concat for a version of its partitions"""
+    columns = [
+        'Admin2',
+        'Province_State',
+        'Country_Region',
+        'Lat',
+        'Long_',
+        'Incident_Rate',
+        'Confirmed',
+        'date',
+        'new_cases',
+        'rolling_7'
+    ]
+    df = store.read_window(last_15, data_dir=data_dir, columns=columns)
+    df = df.sort_values(by='date')
     
     # Additional date filter
-    df = df.loc[df.date >= (today - dt.timedelta(days=15))]
+    df = df.loc[df.date >= pd.Timestamp(today - dt.timedelta(days=len(last_15)))]
+    store.log_memory('cases', df)
+    caching.set_version(df, '{}:{}'.format(version, today))
 
     return df
 
-@st.cache
+@instrument.timed()
+@caching.cached
 def get_regions(df: pd.DataFrame) -> Tuple[List[str]]:
     """Return lists of countries, states, and sub-regions from df"""
     country_set = set(df.Country_Region)
@@ -179,20 +338,25 @@ def get_regions(df: pd.DataFrame) -> Tuple[List[str]]:
 
     return countries
 
-@st.cache
+@instrument.timed()
+@caching.cached
 def subset_data(
     df: pd.DataFrame,
     country: str,
     region: Optional[str]=None,
-    sub_region: Optional[str]=None
+    sub_region: Optional[str]=None,
+    populations: Optional[pd.DataFrame]=None
 ):
     """Return data subset of interest
     
     Args:
-        df (pd.DataFrame): Last 15 days' JHU COVID data
+        df (pd.DataFrame): Last 15 days' JHU COVID data, or the location's slice of it
+            (see locations.select)
         country (str): Country of interest
         region (str): Region of interest
         sub_region (str): Sub-region of interest
+        populations (Optional[pd.DataFrame]): Population table of the whole window
+            (see population.build_table), built from df if not given
     Returns:
         subset(pd.DataFrame): Last 14 days fo JHU COVID data with daily new case count 
         and rolling 7-day mean.
@@ -205,7 +369,7 @@ def subset_data(
     if all([sub_region, sub_region!='All']):
         filter = (filter) & (df.Admin2==sub_region)
 
-    subset = df.loc[filter, :].reset_index(drop=True).dropna(axis=1, how='all').copy()
+    subset = df.loc[filter, :].reset_index(drop=True)
 
     if region not in ['All', 'Not Reported']:
         by=['date', 'Country_Region', 'Province_State']
@@ -215,15 +379,18 @@ def subset_data(
         by=['date', 'Country_Region'
         ]
     try:
-        subset = (
-            subset.groupby(
-                by=by, as_index=False
-            ).agg({'Confirmed': sum, 'population': sum})
-        )
+        grouped = subset.groupby(by=by, observed=True)
+        subset = grouped[['Confirmed']].sum()
+        # New cases and rolling means are summed from those stored per location
+        subset[['new_cases', 'rolling_7']] = grouped[
+            ['new_cases', 'rolling_7']
+        ].sum(min_count=1)
+        subset = subset.reset_index()
+        # Joined from the table built once per data version
+        if populations is None:
+            populations = population.build_table(df)
+        subset['population'] = population.join(populations, subset[by[1:]])
         subset['Incident_Rate'] = subset.Confirmed.mul(1e5).div(subset.population)
-         # Diff to calulate new cases count
-        subset['new_cases'] = subset.Confirmed.diff()
-        subset['rolling_7'] = subset.new_cases.rolling(7).mean()
         subset = subset.iloc[1:].reset_index(drop=True)
     except:
         subset = None
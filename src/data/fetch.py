@@ -0,0 +1,156 @@
+"""Retrying download of remote data files, used directly and by afetch"""
+import os
+import time
+import hashlib
+import tempfile
+import urllib.error
+import urllib.request
+from typing import Callable, Optional, Tuple
+
+
+_CHUNK_SIZE = 1 << 16
+
+
+def fetch(
+    url: str,
+    dest: str,
+    timeout: float=30,
+    retries: int=3,
+    backoff: float=0.5
+) -> str:
+    """Stream the raw bytes at url to dest, retrying with exponential backoff
+
+    Bytes are written to a temporary file in the destination directory, which is
+    renamed over dest only once the download completes.
+
+    Args:
+        url (str): http(s):// or file:// URL to download
+        dest (str): local path to save to
+        timeout (float): socket timeout in seconds for each attempt
+        retries (int): number of retries after the first failed attempt
+        backoff (float): initial delay in seconds between attempts, doubled after
+            each retry
+    Returns:
+        dest (str): local path of the downloaded file
+    """
+    def attempt():
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            _stream_to(response, dest)
+        return dest
+
+    return _retry(attempt, retries=retries, backoff=backoff)
+
+
+def fetch_if_changed(
+    url: str,
+    dest: str,
+    validators: Optional[dict]=None,
+    timeout: float=30,
+    retries: int=3,
+    backoff: float=0.5
+) -> Tuple[bool, dict]:
+    """Download url to dest only if it has changed since validators were recorded
+
+    The request is made conditional on the recorded ETag and Last-Modified
+    headers. Where the server does not support conditional requests (e.g. file://
+    URLs), the SHA-256 of the downloaded content is compared instead.
+
+    Args:
+        url (str): http(s):// or file:// URL to download
+        dest (str): local path to save to
+        validators (Optional[dict]): 'etag', 'last_modified' and 'sha256' recorded
+            from the previous download
+        timeout (float): socket timeout in seconds for each attempt
+        retries (int): number of retries after the first failed attempt
+        backoff (float): initial delay in seconds between attempts
+    Returns:
+        changed (bool): True if new content was saved to dest
+        validators (dict): validators to record for the next call
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    def attempt():
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return False, validators
+            raise
+
+        with response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            unchanged = any([
+                etag and etag == validators.get('etag'),
+                not etag and last_modified
+                and last_modified == validators.get('last_modified')
+            ])
+            if unchanged:
+                return False, validators
+
+            sha256 = _stream_to(response, dest, if_not_hash=validators.get('sha256'))
+
+        new_validators = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'sha256': sha256
+        }
+        changed = sha256 != validators.get('sha256')
+
+        return changed, new_validators
+
+    return _retry(attempt, retries=retries, backoff=backoff)
+
+
+def _stream_to(response, dest: str, if_not_hash: Optional[str]=None) -> str:
+    """Copy response to dest via a temporary file and return its SHA-256
+
+    If the content hash equals if_not_hash, dest is left untouched.
+    """
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: response.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != if_not_hash:
+            os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return digest.hexdigest()
+
+
+def _retry(func: Callable, retries: int=3, backoff: float=0.5):
+    """Call func, retrying network errors with exponential backoff"""
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except (urllib.error.URLError, OSError) as e:
+            delay = _retry_delay(e, attempt, retries, backoff)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+def _retry_delay(
+    error: Exception, attempt: int, retries: int, backoff: float
+) -> Optional[float]:
+    """Return seconds to wait before retrying a failed attempt, or None to raise
+
+    Shared by _retry and the asynchronous downloads of afetch.
+    """
+    # Missing files will not appear on retry
+    missing = isinstance(error, urllib.error.HTTPError) and error.code == 404
+    if missing or attempt >= retries:
+        return None
+
+    return backoff * 2**attempt
@@ -0,0 +1,127 @@
+"""Lightweight timing, row count and memory instrumentation of pipeline stages
+
+Each stage records its wall time, resident memory before/after and any fields set
+by the caller (e.g. row counts, cache hit/miss). Records are kept in a bounded
+in-memory buffer for the app's debug panel and emitted as JSON log lines on the
+'src.data.instrument' logger.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+from collections import deque
+from typing import Callable, Iterator, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_RECORDS = deque(maxlen=1000)
+_LOCAL = threading.local()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+@contextlib.contextmanager
+def stage(name: str, **fields) -> Iterator[dict]:
+    """Record a pipeline stage
+
+    Usage:
+        with instrument.stage('ingest', files=len(dates)) as record:
+            ...
+            record['rows'] = len(df)
+
+    Args:
+        name (str): stage name
+        **fields: extra fields to record
+    Yields:
+        record (dict): the stage's record, to which fields may be added
+    """
+    record = {'stage': name, 'time': time.time()}
+    record.update(fields)
+    stack = _stack()
+    stack.append(record)
+    rss_before = _rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        rss = _rss()
+        record['rss_mb'] = round(rss / 1e6, 1)
+        record['rss_delta_mb'] = round((rss - rss_before) / 1e6, 1)
+        stack.pop()
+        _RECORDS.append(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str))
+
+
+def timed(name: Optional[str]=None) -> Callable:
+    """Decorate a function to record each call as a stage, with the result's length"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__) as record:
+                result = func(*args, **kwargs)
+                if hasattr(result, '__len__'):
+                    record['rows'] = len(result)
+            return result
+        return wrapper
+
+    return decorator
+
+
+def record_cache(hit: bool) -> None:
+    """Mark the innermost open stage as a cache hit or miss"""
+    stack = _stack()
+    if stack:
+        stack[-1]['cache'] = 'hit' if hit else 'miss'
+
+    return None
+
+
+def get_records(last: Optional[int]=None) -> List[dict]:
+    """Return recorded stages, oldest first"""
+    records = list(_RECORDS)
+
+    return records[-last:] if last else records
+
+
+def clear() -> None:
+    """Discard recorded stages"""
+    _RECORDS.clear()
+
+    return None
+
+
+def process_uptime() -> Optional[float]:
+    """Return seconds since this process started, or None where unavailable"""
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            # Fields after the parenthesised command name start at field 3
+            fields = f.read().rsplit(b')', 1)[1].split()
+        with open('/proc/uptime', 'rb') as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 3)
+    except (OSError, IndexError, ValueError, AttributeError):
+        return None
+
+
+def _stack() -> list:
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+
+    return _LOCAL.stack
+
+
+def _rss() -> int:
+    """Return current resident set size in bytes (0 where unavailable)"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
@@ -0,0 +1,124 @@
+"""Hierarchical index of locations (country -> province/state -> Admin2)"""
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data import instrument
+
+NOT_REPORTED = 'Not Reported'
+
+_LEVELS = ['Country_Region', 'Province_State', 'Admin2']
+
+
+@instrument.timed()
+def build_index(df: pd.DataFrame) -> dict:
+    """Build a location index over df, once per data version
+
+    Each node holds the sorted names of its children and the row positions
+    (for use with df.iloc) of its slice of df. Missing names are indexed as
+    'Not Reported'.
+
+    Args:
+        df (pd.DataFrame): JHU COVID data, as returned by data.load_cases
+    Returns:
+        index (dict): {country: {'rows', 'children', 'regions': {region: {'rows',
+            'children', 'sub_regions': {sub_region: {'rows'}}}}}}
+    """
+    keys = location_keys(df)
+
+    country_rows = keys.groupby(_LEVELS[0], observed=True).indices
+    region_rows = keys.groupby(_LEVELS[:2], observed=True).indices
+    sub_region_rows = keys.groupby(_LEVELS, observed=True).indices
+
+    index = {
+        country: {'rows': rows, 'children': [], 'regions': {}}
+        for country, rows in country_rows.items()
+    }
+    for (country, region), rows in region_rows.items():
+        index[country]['regions'][region] = {
+            'rows': rows, 'children': [], 'sub_regions': {}
+        }
+    for (country, region, sub_region), rows in sub_region_rows.items():
+        index[country]['regions'][region]['sub_regions'][sub_region] = {'rows': rows}
+
+    for country_node in index.values():
+        country_node['children'] = sorted(country_node['regions'])
+        for region_node in country_node['regions'].values():
+            region_node['children'] = sorted(region_node['sub_regions'])
+
+    return index
+
+
+def location_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the location columns of df, with missing names filled as NOT_REPORTED"""
+    keys = df[_LEVELS].copy()
+    for column in _LEVELS:
+        categorical = isinstance(keys[column].dtype, pd.CategoricalDtype)
+        if categorical and NOT_REPORTED not in keys[column].cat.categories:
+            keys[column] = keys[column].cat.add_categories(NOT_REPORTED)
+
+    return keys.fillna(NOT_REPORTED)
+
+
+def get_node(
+    index: dict,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> Optional[dict]:
+    """Return the index node for a location, or None if it is not in the index
+
+    A region or sub_region of None or 'All' selects the enclosing level.
+    """
+    node = index.get(country)
+    if node is None:
+        return None
+    if all([region, region != 'All']):
+        node = node['regions'].get(region)
+        if node is None:
+            return None
+        if all([sub_region, sub_region != 'All']):
+            node = node['sub_regions'].get(sub_region)
+
+    return node
+
+
+def get_children(
+    index: dict,
+    country: str,
+    region: Optional[str]=None
+) -> List[str]:
+    """Return sorted names of the regions of country, or sub-regions of region"""
+    node = index.get(country)
+    if all([node, region is not None]):
+        node = node['regions'].get(region)
+    if node is None:
+        return []
+
+    return node['children']
+
+
+def get_rows(
+    index: dict,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> np.ndarray:
+    """Return row positions of a location's slice of the indexed frame"""
+    node = get_node(index, country, region, sub_region)
+    if node is None:
+        return np.array([], dtype=np.intp)
+
+    return node['rows']
+
+
+def select(
+    df: pd.DataFrame,
+    index: dict,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> pd.DataFrame:
+    """Return a location's slice of df, as indexed by build_index(df)"""
+    return df.iloc[get_rows(index, country, region, sub_region)]
@@ -0,0 +1,194 @@
+"""Checksummed manifest of raw JHU daily reports and their ingested partitions
+
+data_dir/raw/manifest.json records each daily report once completely downloaded:
+
+    {"08-31-2021": {"size": ..., "mtime_ns": ..., "sha256": ..., "rows": ...,
+                    "status": "downloaded" | "ingested",
+                    "partition": {"path": ..., "size": ..., "mtime_ns": ...}}}
+
+The manifest is replaced atomically, so a half-written or truncated file is never
+listed. On load, the store is validated against the manifest (see validate):
+reports that are unlisted, missing or changed are removed, with their partitions,
+and downloaded again, and changed partitions are ingested again. Reports are
+checked from file metadata, and once per process and data directory also against
+their checksums and row counts, which catches changes that keep size and mtime.
+"""
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+from src.data import instrument, store
+
+
+_CHUNK_SIZE = 1 << 20
+# Data directories whose reports were checked against their checksums
+_VERIFIED = set()
+
+
+def manifest_path(data_dir: str='./data/') -> str:
+    """Return path of the raw data manifest"""
+    return data_dir + 'raw/manifest.json'
+
+
+def raw_path(date: str, data_dir: str='./data/') -> str:
+    """Return path of the raw daily report for date (format '%m-%d-%Y')"""
+    return data_dir + 'raw/{}.csv'.format(date)
+
+
+def read(data_dir: str='./data/') -> Dict[str, dict]:
+    """Return manifest entries by date, or none if there is no valid manifest"""
+    try:
+        with open(manifest_path(data_dir), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write(entries: Dict[str, dict], data_dir: str='./data/') -> None:
+    """Replace the manifest with entries, atomically"""
+    path = manifest_path(data_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+    return None
+
+
+def describe(path: str) -> dict:
+    """Return the size, mtime_ns, SHA-256 and row count of a raw CSV file"""
+    digest = hashlib.sha256()
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+        stat = os.fstat(f.fileno())
+    # The header is not a row; the last line may lack a newline
+    rows = max(lines - 1 + (last != b'\n'), 0)
+
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': digest.hexdigest(),
+        'rows': rows
+    }
+
+
+@instrument.timed()
+def validate(
+    entries: Dict[str, dict],
+    dates: List[str],
+    data_dir: str='./data/',
+    repair: bool=True,
+    deep: Optional[bool]=None
+) -> List[str]:
+    """Check raw reports and partitions for dates against the manifest
+
+    Only file metadata is read, unless checking deeply. With repair, invalid
+    reports are removed along with their partitions and entries, and partitions
+    that no longer match their entry are removed, so that they are downloaded or
+    ingested again.
+
+    Args:
+        entries (Dict[str, dict]): manifest entries, as returned by read. Updated
+            in place.
+        dates (List[str]): dates in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+        repair (bool): if False, nothing is removed, e.g. when nothing can be
+            downloaded again
+        deep (Optional[bool]): if True, reports are also read and checked against
+            their SHA-256 and row count. If None, only on the first validation of
+            data_dir in this process.
+    Returns:
+        invalid (List[str]): dates whose raw reports are to be downloaded
+    """
+    if deep is None:
+        deep = data_dir not in _VERIFIED
+    invalid = []
+    for date in dates:
+        entry = entries.get(date)
+        raw = _stat(raw_path(date, data_dir))
+        if (
+            entry is None
+            or raw != (entry['size'], entry['mtime_ns'])
+            or deep and not _intact(entry, raw_path(date, data_dir))
+        ):
+            invalid.append(date)
+            if repair:
+                entries.pop(date, None)
+                _remove(raw_path(date, data_dir))
+                _remove(store.partition_path(date, data_dir))
+            continue
+
+        partition = entry.get('partition')
+        if partition is None:
+            continue
+        path = store.partition_path(date, data_dir)
+        stat = _stat(path)
+        # Partitions of an older schema are superseded rather than invalid
+        if partition['path'] != path or stat != (partition['size'], partition['mtime_ns']):
+            if repair:
+                if partition['path'] == path:
+                    _remove(path)
+                entry['status'] = 'downloaded'
+                entry.pop('partition')
+    if deep and repair:
+        _VERIFIED.add(data_dir)
+
+    return invalid
+
+
+def add_downloads(
+    entries: Dict[str, dict], dates: List[str], data_dir: str='./data/'
+) -> None:
+    """Record the completely downloaded raw reports for dates in entries"""
+    for date in dates:
+        entries[date] = dict(describe(raw_path(date, data_dir)), status='downloaded')
+
+    return None
+
+
+def add_partitions(
+    entries: Dict[str, dict], dates: List[str], data_dir: str='./data/'
+) -> None:
+    """Record the ingested partitions of listed reports for dates in entries"""
+    for date in dates:
+        path = store.partition_path(date, data_dir)
+        stat = _stat(path)
+        if date not in entries or stat is None:
+            continue
+        entries[date]['status'] = 'ingested'
+        entries[date]['partition'] = {
+            'path': path, 'size': stat[0], 'mtime_ns': stat[1]
+        }
+
+    return None
+
+
+def _intact(entry: dict, path: str) -> bool:
+    """Return True if the content of path has the recorded checksum and row count"""
+    described = describe(path)
+
+    return (described['sha256'], described['rows']) == (entry['sha256'], entry['rows'])
+
+
+def _stat(path: str):
+    """Return (size, mtime_ns) of path, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+    return None
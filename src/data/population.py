@@ -0,0 +1,84 @@
+"""Population of every country, province/state and sub-region, once per data version
+
+JHU daily reports carry no population, only Confirmed and Incident_Rate (cases per
+100k), so population is estimated from their ratio. The per-row ratio is noisy, and
+undefined where either is zero or missing, so each location's estimate is the median
+of its valid ratios across the window. Aggregate levels sum the estimates of the
+locations they contain. Callers join against the table rather than carrying a
+population column per row:
+
+    table = population.build_table(df)
+    population.lookup(table, 'US', 'Texas')
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data import caching, instrument, locations
+
+
+# Location key of each row. Aggregate levels take the value 'All' below their depth.
+KEYS = ['Country_Region', 'Province_State', 'Admin2']
+
+
+@instrument.timed()
+@caching.cached
+def build_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the population of every location in df, at every level
+
+    Args:
+        df (pd.DataFrame): JHU COVID data window, as returned by data.load_cases
+    Returns:
+        table (pd.DataFrame): population, indexed by KEYS. NaN for locations
+            without a valid Confirmed / Incident_Rate ratio on any day.
+    """
+    frame = locations.location_keys(df)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = (
+            df.Confirmed.to_numpy(np.float64)
+            / df.Incident_Rate.to_numpy(np.float64)
+            * 1e5
+        )
+    frame['population'] = np.where(np.isfinite(ratios) & (ratios > 0), ratios, np.nan)
+    base = frame.groupby(KEYS, observed=True).population.median().round()
+
+    levels = []
+    for depth in range(1, len(KEYS) + 1):
+        level = base.groupby(
+            level=KEYS[:depth], observed=True
+        ).sum(min_count=1).reset_index()
+        level[KEYS[:depth]] = level[KEYS[:depth]].astype(object)
+        for key in KEYS[depth:]:
+            level[key] = 'All'
+        levels.append(level)
+
+    return pd.concat(levels, ignore_index=True).set_index(KEYS)
+
+
+def join(table: pd.DataFrame, keys: pd.DataFrame) -> np.ndarray:
+    """Return the population of each row of keys, NaN where it is not in table
+
+    Args:
+        table (pd.DataFrame): as returned by build_table
+        keys (pd.DataFrame): location columns of a level's rows. Columns of KEYS
+            missing from keys are taken as 'All'.
+    Returns:
+        population (np.ndarray): aligned with keys
+    """
+    keys = keys.astype(object).reindex(columns=KEYS, fill_value='All')
+
+    return table.population.reindex(pd.MultiIndex.from_frame(keys)).to_numpy()
+
+
+def lookup(
+    table: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> float:
+    """Return the population of a sidebar selection, NaN if it is not in table"""
+    if region in [None, 'All']:
+        region, sub_region = 'All', 'All'
+
+    return table.population.get((country, region, sub_region or 'All'), np.nan)
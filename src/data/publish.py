@@ -0,0 +1,158 @@
+"""Publish prepared frames as Arrow IPC files memory-mapped by every app process
+
+    publish.publish({'cases': df, 'vaccinations': vacc_data}, directory, version)
+    frames = publish.open_frames(directory, ['cases', 'vaccinations'])
+
+Frames of a version are written to <directory>/<version>/<name>.arrow, and the
+version is then made current by atomically replacing <directory>/CURRENT. Readers
+memory-map the files, so the frames they get are zero-copy, read-only views of
+pages shared by all processes on the host. Processes still holding a previous
+version keep reading it until they reopen, as unlinked files stay mapped.
+"""
+import os
+import json
+import shutil
+import logging
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from src.data import caching, instrument
+
+
+logger = logging.getLogger(__name__)
+
+# Number of versions kept, including the current one
+_KEEP = 2
+
+
+def publish(
+    frames: Dict[str, pd.DataFrame],
+    directory: str,
+    version: str,
+    **meta
+) -> None:
+    """Write frames as a new version and make it current
+
+    Args:
+        frames (Dict[str, pd.DataFrame]): frames by name
+        directory (str): publication directory
+        version (str): name of the version, e.g. a data-version token
+        **meta: recorded with the version, see current
+    Returns:
+        None
+    """
+    version_dir = os.path.join(directory, version)
+    with instrument.stage('publish', version=version) as record:
+        os.makedirs(version_dir, exist_ok=True)
+        for name, df in frames.items():
+            table = to_table(df)
+            path = os.path.join(version_dir, name + '.arrow')
+            with pa.OSFile(path + '.tmp', 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(path + '.tmp', path)
+        record['bytes'] = sum(
+            os.path.getsize(os.path.join(version_dir, name))
+            for name in os.listdir(version_dir)
+        )
+
+        pointer = os.path.join(directory, 'CURRENT')
+        with open(pointer + '.tmp', 'w') as f:
+            json.dump({'version': version, 'meta': meta}, f, default=str)
+        os.replace(pointer + '.tmp', pointer)
+    _remove_old_versions(directory, version)
+
+    return None
+
+
+def current(directory: str) -> Optional[dict]:
+    """Return {'version', 'meta'} of the current version, or None if unpublished"""
+    try:
+        with open(os.path.join(directory, 'CURRENT'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_frames(
+    directory: str, names: List[str], version: Optional[str]=None
+) -> Dict[str, pd.DataFrame]:
+    """Memory-map published frames as read-only pandas views
+
+    Each frame is registered with the caching module under its version, so
+    cached functions taking it are keyed without hashing it.
+
+    Args:
+        directory (str): publication directory
+        names (List[str]): names of the frames
+        version (Optional[str]): version to open, the current one by default
+    Returns:
+        frames (Dict[str, pd.DataFrame]): frames by name
+    """
+    version = version or current(directory)['version']
+    frames = {}
+    for name in names:
+        source = pa.memory_map(os.path.join(directory, version, name + '.arrow'))
+        frames[name] = from_table(pa.ipc.open_file(source).read_all())
+        caching.set_version(frames[name], '{}:{}'.format(version, name))
+
+    return frames
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """Convert df to an Arrow table that converts back to pandas without copying
+
+    Categoricals are dictionary-encoded with their codes, datetimes are kept in
+    nanoseconds, and floats keep NaN as a value rather than a null, as columns with
+    nulls are copied on conversion. A named index is stored as columns.
+    """
+    index = [name for name in df.index.names if name is not None]
+    if index:
+        df = df.reset_index()
+
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            columns[name] = pa.DictionaryArray.from_arrays(
+                codes,
+                pa.array(values.cat.categories.to_numpy()),
+                mask=codes < 0 if (codes < 0).any() else None
+            )
+        elif values.dtype.kind in 'biufM':
+            columns[name] = pa.array(values.to_numpy())
+        else:
+            columns[name] = pa.array(values, from_pandas=True)
+    table = pa.table(columns)
+
+    return table.replace_schema_metadata({'index': json.dumps(index)})
+
+
+def from_table(table: pa.Table) -> pd.DataFrame:
+    """Convert a table written by to_table back to pandas, as views of its buffers"""
+    df = table.to_pandas(split_blocks=True, date_as_object=False)
+    index = json.loads((table.schema.metadata or {}).get(b'index', b'[]'))
+    if index:
+        df = df.set_index(index)
+
+    return df
+
+
+def _remove_old_versions(directory: str, version: str) -> None:
+    """Remove all but the newest _KEEP versions, including version"""
+    versions = sorted(
+        (
+            entry for entry in os.scandir(directory)
+            if entry.is_dir() and entry.name != version
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in versions[_KEEP - 1:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        logger.info('Removed published version %s', entry.name)
+
+    return None
@@ -0,0 +1,170 @@
+"""Background refresh of app data, off the request path
+
+A daemon thread polls upstream on a schedule (and just after midnight), builds the
+next data version with a load function and swaps it in atomically. Requests are
+served the previous version until the new one is ready:
+
+    snapshot = refresh.ensure(load_data, data_dir)  # loads on first use only
+    refresh.start(load_data, data_dir, interval=3600)
+
+Refreshes are single-flight per host: the process holding the file lock
+data_dir/refresh.lock downloads and ingests, while other processes wait for it and
+then load the result from disk without downloading.
+"""
+import os
+import logging
+import threading
+import contextlib
+import datetime as dt
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: refreshes are only single-flight per process
+    fcntl = None
+
+from src.data import instrument
+
+
+logger = logging.getLogger(__name__)
+
+_STATE = {'current': None, 'thread': None}
+_LOCK = threading.Lock()
+_REFRESH_LOCK = threading.RLock()
+_STOP = threading.Event()
+
+
+def current() -> Optional[dict]:
+    """Return the current snapshot, {'today', 'loaded', 'data'}, or None"""
+    return _STATE['current']
+
+
+def refresh(
+    load: Callable[..., Any], data_dir: str='./data/', today: Optional[dt.date]=None
+) -> dict:
+    """Build the next data version and swap it in as the current snapshot
+
+    Args:
+        load (Callable): load(today, download=...) returning the app data
+        data_dir (str): root directory for app data, where the lock file is kept
+        today (Optional[dt.date]): run date, today by default
+    Returns:
+        snapshot (dict): the new current snapshot
+    """
+    today = today or dt.date.today()
+    os.makedirs(data_dir, exist_ok=True)
+    with _REFRESH_LOCK, instrument.stage('refresh', today=today) as record:
+        with single_flight(data_dir + 'refresh.lock') as leader:
+            record['leader'] = leader
+            # Followers waited for the leader, so the data is already downloaded
+            result = load(today, download=leader)
+
+        snapshot = {'today': today, 'loaded': dt.datetime.now(), 'data': result}
+        _STATE['current'] = snapshot
+
+    return snapshot
+
+
+def ensure(load: Callable[..., Any], data_dir: str='./data/') -> dict:
+    """Return the current snapshot, loading it first if there is none yet"""
+    snapshot = _STATE['current']
+    if snapshot is None:
+        # Concurrent first requests wait for a single load
+        with _REFRESH_LOCK:
+            snapshot = _STATE['current'] or refresh(load, data_dir)
+
+    return snapshot
+
+
+def start(
+    load: Callable[..., Any],
+    data_dir: str='./data/',
+    interval: float=3600,
+    delay: Optional[float]=None
+) -> threading.Thread:
+    """Start the refresh thread of this process, if not already running
+
+    The first refresh is made after interval; see ensure for the initial load.
+
+    Args:
+        load (Callable): load(today, download=...) returning the app data
+        data_dir (str): root directory for app data
+        interval (float): seconds between polls of upstream
+        delay (Optional[float]): seconds until the first refresh, if not interval,
+            e.g. 0 if the initial load was from a stale snapshot
+    Returns:
+        thread (threading.Thread): the refresh thread
+    """
+    with _LOCK:
+        thread = _STATE['thread']
+        if thread is not None and thread.is_alive():
+            return thread
+
+        _STOP.clear()
+        thread = threading.Thread(
+            target=_run,
+            args=(load, data_dir, interval, delay),
+            name='refresh',
+            daemon=True
+        )
+        thread.start()
+        _STATE['thread'] = thread
+
+    return thread
+
+
+def stop() -> None:
+    """Stop the refresh thread after its current refresh"""
+    _STOP.set()
+
+    return None
+
+
+@contextlib.contextmanager
+def single_flight(path: str) -> Iterator[bool]:
+    """Hold an exclusive lock on path, yielding whether it was acquired uncontended
+
+    If another process holds the lock, waits for it to be released first and yields
+    False.
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            leader = True
+        except BlockingIOError:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            leader = False
+        try:
+            yield leader
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _run(
+    load: Callable[..., Any],
+    data_dir: str,
+    interval: float,
+    delay: Optional[float]=None
+) -> None:
+    wait = _next_poll(interval) if delay is None else delay
+    while not _STOP.wait(wait):
+        try:
+            refresh(load, data_dir)
+        except Exception:
+            # Keep serving the previous version and retry at the next poll
+            logger.exception('Data refresh failed')
+        wait = _next_poll(interval)
+
+    return None
+
+
+def _next_poll(interval: float) -> float:
+    """Return seconds until the next poll: after interval, or just after midnight"""
+    now = dt.datetime.now()
+    midnight = dt.datetime.combine(now.date() + dt.timedelta(days=1), dt.time())
+
+    return min(interval, (midnight - now).total_seconds() + 60)
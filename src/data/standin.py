@@ -0,0 +1,223 @@
+"""Local HTTP stand-ins for the remote JHU and CCI repositories
+
+Serve a directory of data files over HTTP, with Last-Modified and conditional
+request support, so the download path can be exercised offline. e.g.
+
+    python -m src.data.standin ./mirror/ --port 8000
+
+and point the URLs in config.yaml at http://127.0.0.1:8000/.
+
+serve runs a threaded http.server. serve_async runs an asyncio server with
+keep-alive connections, ETags, optionally chunked bodies and an optional delay per
+chunk, which counts the connections and requests it handles, e.g. to check
+connection reuse and cancellation of slow downloads by afetch.
+"""
+import os
+import asyncio
+import argparse
+import functools
+import threading
+import email.utils
+import urllib.parse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        return None
+
+
+def serve(directory: str, port: int=0) -> ThreadingHTTPServer:
+    """Serve directory on 127.0.0.1 from a background thread
+
+    Args:
+        directory (str): directory of files to serve
+        port (int): port to listen on. If 0, a free port is chosen.
+    Returns:
+        server (ThreadingHTTPServer): running server. Its base URL is
+            'http://127.0.0.1:{}/'.format(server.server_port); call
+            server.shutdown() to stop it.
+    """
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+class AsyncStandIn:
+    """asyncio HTTP server running on its own event loop in a background thread
+
+    Attributes:
+        url (str): base URL of the served directory
+        connections (int): number of connections accepted
+        requests (int): number of requests handled
+    """
+
+    def __init__(
+        self, directory: str, port: int=0, delay: float=0.0, chunked: bool=False
+    ):
+        self.directory = os.path.realpath(directory)
+        self.delay = delay
+        self.chunked = chunked
+        self.connections = 0
+        self.requests = 0
+        self._handlers = set()
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, '127.0.0.1', port)
+        )
+        self.url = 'http://127.0.0.1:{}/'.format(
+            self._server.sockets[0].getsockname()[1]
+        )
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the server and its event loop"""
+        async def shutdown():
+            self._server.close()
+            # Drop open keep-alive connections
+            for handler in self._handlers:
+                handler.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+        return None
+
+    async def _handle(self, reader, writer) -> None:
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                self.requests += 1
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                await self._respond(writer, method, target, headers)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            # Cancelled by close
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+        return None
+
+    async def _respond(self, writer, method: str, target: str, headers: dict) -> None:
+        path = self._translate(target)
+        if method not in ('GET', 'HEAD'):
+            return await self._send(writer, 405, 'Method Not Allowed')
+        if path is None or not os.path.isfile(path):
+            return await self._send(writer, 404, 'Not Found')
+
+        stat = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        validators = {'ETag': etag, 'Last-Modified': last_modified}
+        if 'if-none-match' in headers:
+            not_modified = headers['if-none-match'] == etag
+        else:
+            not_modified = headers.get('if-modified-since') == last_modified
+        if not_modified:
+            return await self._send(writer, 304, 'Not Modified', validators)
+
+        if self.chunked:
+            framing = {'Transfer-Encoding': 'chunked'}
+        else:
+            framing = {'Content-Length': stat.st_size}
+        await self._send(writer, 200, 'OK', dict(validators, **framing))
+        if method == 'GET':
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    if self.chunked:
+                        chunk = b'%x\r\n%s\r\n' % (len(chunk), chunk)
+                    writer.write(chunk)
+                    await writer.drain()
+            if self.chunked:
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+
+        return None
+
+    async def _send(
+        self, writer, status: int, reason: str, headers: Optional[dict]=None
+    ) -> None:
+        headers = headers or {}
+        if 'Transfer-Encoding' not in headers:
+            headers = dict({'Content-Length': 0}, **headers)
+        lines = ['HTTP/1.1 {} {}'.format(status, reason)]
+        lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        return None
+
+    def _translate(self, target: str) -> Optional[str]:
+        """Return the served path of a request target, or None if outside directory"""
+        relative = urllib.parse.unquote(urllib.parse.urlsplit(target).path).lstrip('/')
+        path = os.path.realpath(os.path.join(self.directory, relative))
+        if os.path.commonpath([path, self.directory]) != self.directory:
+            return None
+
+        return path
+
+
+def serve_async(
+    directory: str, port: int=0, delay: float=0.0, chunked: bool=False
+) -> AsyncStandIn:
+    """Serve directory on 127.0.0.1 from an asyncio server in a background thread
+
+    Args:
+        directory (str): directory of files to serve
+        port (int): port to listen on. If 0, a free port is chosen.
+        delay (float): seconds to wait before sending each 64 KiB chunk, to simulate
+            a slow upstream
+        chunked (bool): if True, bodies are sent with chunked transfer encoding
+    Returns:
+        server (AsyncStandIn): running server. Its base URL is server.url; call
+            server.close() to stop it.
+    """
+    return AsyncStandIn(directory, port=port, delay=delay, chunked=chunked)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--asyncio', action='store_true', help='use serve_async')
+    parser.add_argument(
+        '--delay', type=float, default=0.0, help='seconds per chunk (with --asyncio)'
+    )
+    args = parser.parse_args()
+
+    if args.asyncio:
+        server = serve_async(args.directory, port=args.port, delay=args.delay)
+        stop = server.close
+    else:
+        server = serve(args.directory, port=args.port)
+        stop = server.shutdown
+    print('Serving {} at http://127.0.0.1:{}/'.format(args.directory, args.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stop()
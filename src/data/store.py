@@ -0,0 +1,378 @@
+"""Columnar (Parquet) store of ingested JHU daily reports"""
+import os
+import hashlib
+import logging
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.data import instrument
+
+logger = logging.getLogger(__name__)
+
+# Columns read from each raw JHU daily report
+_RAW_COLUMNS = [
+    'Admin2',
+    'Province_State',
+    'Country_Region',
+    'Last_Update',
+    'Lat',
+    'Long_',
+    'Incident_Rate',
+    'Confirmed'
+]
+# Columns renamed since older JHU daily reports
+_RENAMED_COLUMNS = {
+    'Province/State': 'Province_State',
+    'Country/Region': 'Country_Region',
+    'Last Update': 'Last_Update',
+    'Latitude': 'Lat',
+    'Longitude': 'Long_',
+    'Incidence_Rate': 'Incident_Rate'
+}
+# Typed schema of each ingested daily partition. Location columns are read back as
+# categoricals and dates as datetime64. new_cases and rolling_7 are computed per
+# location at ingest, from the previous days' partitions.
+_SCHEMA = pa.schema([
+    ('Admin2', pa.string()),
+    ('Province_State', pa.string()),
+    ('Country_Region', pa.string()),
+    ('Lat', pa.float32()),
+    ('Long_', pa.float32()),
+    ('Incident_Rate', pa.float32()),
+    ('Confirmed', pa.int32()),
+    ('date', pa.date32()),
+    ('new_cases', pa.float32()),
+    ('rolling_7', pa.float32()),
+])
+# Bumped whenever _SCHEMA changes, so stale partitions are re-ingested
+_SCHEMA_VERSION = 5
+_LOCATION_COLUMNS = ['Admin2', 'Province_State', 'Country_Region']
+_ROLLING_DAYS = 7
+
+
+def partition_path(date: str, data_dir: str='./data/') -> str:
+    """Return path of the ingested partition for date (format '%m-%d-%Y')"""
+    return partition_dir(data_dir) + '{}.parquet'.format(date)
+
+
+def partition_dir(data_dir: str='./data/') -> str:
+    """Return directory of ingested partitions for the current schema version"""
+    return data_dir + 'processed/v{}/'.format(_SCHEMA_VERSION)
+
+
+def ingest_JHU(dates: List[str], data_dir: str='./data/', workers: int=1) -> None:
+    """Convert downloaded JHU daily reports to Parquet partitions, once per date
+
+    New dates are ingested oldest first, as each partition's daily changes are
+    computed from the partitions before it. Stored partitions within 7 days after a
+    new date, e.g. when the window is extended back or a report is fetched again,
+    depend on it, so their daily changes are recomputed and they are rewritten in
+    date order with the new ones. When backfilling many dates, reports can be
+    parsed in parallel by a pool of worker processes while partitions are written
+    in order by this process.
+
+    Args:
+        dates (List[str]): dates to ingest in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+        workers (int): number of processes parsing reports
+    Returns:
+        None
+    """
+    os.makedirs(partition_dir(data_dir), exist_ok=True)
+    missing = [
+        date for date in sorted(dates, key=_parse_date)
+        if not os.path.exists(partition_path(date, data_dir))
+    ]
+
+    new = set(missing)
+    dates = sorted(missing + _dependents(missing, data_dir), key=_parse_date)
+
+    def reports(parsed: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        parsed = iter(parsed)
+        for date in dates:
+            yield next(parsed) if date in new else _read_partition(date, data_dir)
+
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+            write_reports(
+                dates,
+                reports(pool.map(parse_report, missing, repeat(data_dir))),
+                data_dir
+            )
+    else:
+        write_reports(
+            dates, reports(parse_report(date, data_dir) for date in missing), data_dir
+        )
+
+    return None
+
+
+def ingest_report(date: str, data_dir: str='./data/') -> None:
+    """Parse a single raw JHU daily report and write it as a typed Parquet partition
+
+    Args:
+        date (str): date of report in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+    Returns:
+        None
+    """
+    write_reports([date], [parse_report(date, data_dir)], data_dir)
+
+    return None
+
+
+def parse_report(date: str, data_dir: str='./data/') -> pd.DataFrame:
+    """Parse a raw JHU daily report of any era into the columns of the store
+
+    Only the columns used by the app are kept, under their current names, along
+    with the derived `date` column. The date of every row is that of the report's
+    latest update, as older reports carry stale timestamps for some locations.
+    Population is estimated per location from the loaded window (see
+    src.data.population).
+
+    Args:
+        date (str): date of report in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+    Returns:
+        df (pd.DataFrame): parsed report indexed by location key, without daily
+            changes (see write_reports)
+    """
+    with instrument.stage('parse_report', date=date) as record:
+        df = pd.read_csv(
+            data_dir + 'raw/{}.csv'.format(date),
+            usecols=lambda column: _RENAMED_COLUMNS.get(column, column) in _RAW_COLUMNS
+        )
+        record['rows'] = len(df)
+    log_memory('csv', df)
+
+    df = df.rename(columns=_RENAMED_COLUMNS).reindex(columns=_RAW_COLUMNS)
+    # Timestamp formats vary across eras, so only the few distinct values are parsed
+    updates = [pd.Timestamp(value) for value in df.Last_Update.dropna().unique()]
+    updated = max(updates) if updates else pd.Timestamp(_parse_date(date))
+    df['date'] = updated.normalize()
+    df = df.drop('Last_Update', axis=1)
+    df['Confirmed'] = df.Confirmed.fillna(0)
+    df.index = _location_key(df)
+
+    return df
+
+
+def write_reports(
+    dates: List[str], reports: Iterable[pd.DataFrame], data_dir: str='./data/'
+) -> None:
+    """Add daily changes to parsed reports and write them as partitions, in order
+
+    Args:
+        dates (List[str]): dates of reports in format '%m-%d-%Y', oldest first
+        reports (Iterable[pd.DataFrame]): parsed reports, as returned by
+            parse_report, in the order of dates
+        data_dir (str): root directory for app data
+    Returns:
+        None
+    """
+    # Recent partitions by date, so daily changes need not read them back
+    recent = {}
+    for date, df in zip(dates, reports):
+        key = df.index
+        df['new_cases'], df['rolling_7'] = daily_changes(
+            df, date, data_dir=data_dir, recent=recent, key=key
+        )
+        table = pa.Table.from_pandas(df, schema=_SCHEMA, preserve_index=False)
+        # Write to a temporary file first so a partial write is never read as valid
+        path = partition_path(date, data_dir)
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        recent[date] = _keyed(df, key)
+        oldest = _parse_date(date) - dt.timedelta(days=_ROLLING_DAYS - 1)
+        for stale in [d for d in recent if _parse_date(d) < oldest]:
+            del recent[stale]
+
+    return None
+
+
+def daily_changes(
+    df: pd.DataFrame,
+    date: str,
+    data_dir: str='./data/',
+    recent: Optional[Dict[str, pd.DataFrame]]=None,
+    key: Optional[pd.Index]=None
+) -> tuple:
+    """Return new cases and their rolling 7-day mean by location for a daily report
+
+    Only the previous days' partitions are read, so appending a day costs the same
+    however long the stored history. Values are NaN for locations without a
+    report on the previous day, or on any of the previous 6 days for rolling_7.
+
+    Args:
+        df (pd.DataFrame): parsed daily report for date
+        date (str): date of report in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+        recent (Optional[Dict[str, pd.DataFrame]]): partitions by date, as returned
+            by _keyed, used instead of reading the stored partitions. Partitions
+            read are added.
+        key (Optional[pd.Index]): location key of df, if already computed
+    Returns:
+        new_cases (np.ndarray): Confirmed less the previous day's Confirmed
+        rolling_7 (np.ndarray): mean of new_cases over the last 7 days
+    """
+    key = _location_key(df) if key is None else key
+    day = _parse_date(date)
+    previous = [
+        (day - dt.timedelta(days=d)).strftime('%m-%d-%Y')
+        for d in range(1, _ROLLING_DAYS)
+    ]
+
+    recent = {} if recent is None else recent
+    partitions = [_read_keyed(d, data_dir, recent) for d in previous]
+
+    def aligned(partition: Optional[pd.DataFrame], column: str) -> np.ndarray:
+        if partition is None:
+            return np.full(len(key), np.nan)
+        positions = partition.index.get_indexer(key)
+        values = partition[column].to_numpy().take(positions)
+        values[positions < 0] = np.nan
+        return values
+
+    new_cases = df.Confirmed.to_numpy(dtype=np.float64) - aligned(
+        partitions[0], 'Confirmed'
+    )
+    window = [new_cases] + [aligned(p, 'new_cases') for p in partitions]
+    # Mean is NaN unless all 7 days are present
+    rolling_7 = np.sum(window, axis=0) / _ROLLING_DAYS
+
+    return new_cases, rolling_7
+
+
+def read_window(
+    dates: List[str],
+    data_dir: str='./data/',
+    columns: Optional[List[str]]=None
+) -> pd.DataFrame:
+    """Read ingested partitions for dates as a single columnar scan
+
+    Args:
+        dates (List[str]): dates to read in format '%m-%d-%Y'
+        data_dir (str): root directory for app data
+        columns (Optional[List[str]]): columns to read. If None, all columns are read.
+    Returns:
+        df (pd.DataFrame): Concatenated partitions, with categorical location columns
+            and datetime64 dates
+    """
+    paths = [partition_path(date, data_dir) for date in dates]
+    dataset = ds.dataset(paths, schema=_SCHEMA, format='parquet')
+    df = dataset.to_table(columns=columns).to_pandas(
+        strings_to_categorical=True, date_as_object=False
+    )
+    log_memory('window', df)
+
+    return df
+
+
+def data_version(dates: List[str], data_dir: str='./data/') -> str:
+    """Return a token identifying the ingested partitions for dates
+
+    The token changes whenever a partition is (re-)ingested, and is derived from
+    file metadata alone, without reading the partitions.
+    """
+    digest = hashlib.sha256('v{}'.format(_SCHEMA_VERSION).encode())
+    for date in sorted(dates):
+        stat = os.stat(partition_path(date, data_dir))
+        digest.update('{}:{}:{}'.format(date, stat.st_size, stat.st_mtime_ns).encode())
+
+    return digest.hexdigest()
+
+
+def _parse_date(date: str) -> dt.date:
+    return dt.datetime.strptime(date, '%m-%d-%Y').date()
+
+
+def _dependents(dates: List[str], data_dir: str='./data/') -> List[str]:
+    """Return stored dates, other than dates, whose daily changes depend on dates
+
+    A partition's new_cases depends on the previous day and its rolling_7 on the
+    new_cases of the previous 6 days, so on the Confirmed of the previous 7 days.
+    """
+    dependents = set()
+    for date in dates:
+        day = _parse_date(date)
+        for d in range(1, _ROLLING_DAYS + 1):
+            later = (day + dt.timedelta(days=d)).strftime('%m-%d-%Y')
+            if later not in dates and os.path.exists(partition_path(later, data_dir)):
+                dependents.add(later)
+
+    return sorted(dependents, key=_parse_date)
+
+
+def _read_partition(date: str, data_dir: str='./data/') -> pd.DataFrame:
+    """Return a stored partition as returned by parse_report, to be written again"""
+    df = pq.read_table(partition_path(date, data_dir)).to_pandas()
+    df.index = _location_key(df)
+
+    return df
+
+
+def _location_key(df: pd.DataFrame) -> pd.Index:
+    """Return a unique key for each row of a daily report
+
+    Rows are keyed by location, numbered within the (rare) duplicate locations.
+    """
+    columns = [df[column].astype(object).fillna('') for column in _LOCATION_COLUMNS]
+    key = columns[0] + '|' + columns[1] + '|' + columns[2]
+    if key.duplicated().any():
+        key = key + '|' + key.groupby(key, sort=False).cumcount().astype(str)
+
+    return pd.Index(key)
+
+
+def _keyed(df: pd.DataFrame, key: Optional[pd.Index]=None) -> pd.DataFrame:
+    """Return Confirmed and new_cases of a partition, indexed by location key"""
+    return pd.DataFrame({
+        'Confirmed': df.Confirmed.to_numpy(dtype=np.float64),
+        'new_cases': df.new_cases.to_numpy(dtype=np.float64)
+    }, index=_location_key(df) if key is None else key)
+
+
+def _read_keyed(
+    date: str, data_dir: str, recent: Dict[str, pd.DataFrame]
+) -> Optional[pd.DataFrame]:
+    """Return the partition for date as returned by _keyed, or None if missing"""
+    path = partition_path(date, data_dir)
+    if date not in recent and os.path.exists(path):
+        recent[date] = _keyed(pq.read_table(
+            path, columns=_LOCATION_COLUMNS + ['Confirmed', 'new_cases']
+        ).to_pandas())
+
+    return recent.get(date)
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the dtype and deep memory usage in bytes of each column of df"""
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(index=False, deep=True)
+    })
+
+    return report
+
+
+def log_memory(stage: str, df: pd.DataFrame) -> None:
+    """Log the row count and deep memory usage of df at a pipeline stage"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            '%s: %d rows, %.1f MB\n%s',
+            stage,
+            len(df),
+            df.memory_usage(index=True, deep=True).sum() / 1e6,
+            memory_report(df).to_string()
+        )
+
+    return None
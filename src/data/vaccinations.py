@@ -0,0 +1,177 @@
+"""Compact daily history and latest snapshot of CCI vaccination data
+
+The raw US (hourly-updated, by state) and global (by country) time series are
+ingested once per download into a daily history with one row per location and date,
+keyed by (Country_Region, Province_State). Country-level figures have a
+Province_State of 'All'; for the US, these are the largest figure reported by any
+US row on each date.
+
+Lookups read a snapshot of the history as of a date, indexed by location.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.data import instrument
+
+
+KEYS = ['Country_Region', 'Province_State']
+VALUES = ['People_Fully_Vaccinated', 'People_Partially_Vaccinated']
+
+
+def history_path(data_dir: str='./data/') -> str:
+    """Return path of the ingested vaccination history"""
+    return data_dir + 'processed/vaccinations.parquet'
+
+
+def ingest(data_dir: str='./data/') -> None:
+    """Convert the downloaded vaccination files to a daily history, if changed
+
+    Args:
+        data_dir (str): root directory for app data
+    Returns:
+        None
+    """
+    raw_dir = data_dir + 'raw/vaccinations/'
+    path = history_path(data_dir)
+    raw_mtime = max(
+        os.stat(raw_dir + name).st_mtime_ns
+        for name in ['vaccinations_us.csv', 'vaccinations_global.csv']
+    )
+    if os.path.exists(path) and os.stat(path).st_mtime_ns >= raw_mtime:
+        return None
+
+    with instrument.stage('ingest_vaccinations') as record:
+        history = build_history(read_raw(raw_dir))
+        record['rows'] = len(history)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    history.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return None
+
+
+def read_raw(raw_dir: str) -> pd.DataFrame:
+    """Return the merged raw US and global vaccination time series"""
+    usecols_us = ['Date', 'Country_Region', 'Province_State'] + VALUES
+    usecols_global = [
+        'Date',
+        'Country_Region',
+        'Province_State',
+        'People_fully_vaccinated',
+        'People_partially_vaccinated'
+    ]
+    vacc_us = pd.read_csv(raw_dir + 'vaccinations_us.csv', usecols=usecols_us)
+    vacc_global = pd.read_csv(
+        raw_dir + 'vaccinations_global.csv', usecols=usecols_global
+    )
+    rename = {
+        'People_partially_vaccinated': 'People_Partially_Vaccinated',
+        'People_fully_vaccinated': 'People_Fully_Vaccinated'
+    }
+    vacc_global.rename(rename, axis=1, inplace=True)
+
+    return pd.concat([vacc_us, vacc_global], axis=0, ignore_index=True)
+
+
+def build_history(raw: pd.DataFrame) -> pd.DataFrame:
+    """Return the daily history of raw vaccination data, one row per location and date
+
+    Args:
+        raw (pd.DataFrame): merged raw time series, as returned by read_raw
+    Returns:
+        history (pd.DataFrame): KEYS, Date and VALUES, sorted by KEYS and Date
+    """
+    raw = raw.assign(
+        Province_State=raw.Province_State.fillna('All'),
+        Date=pd.to_datetime(raw.Date)
+    )
+    history = raw.groupby(KEYS + ['Date'], as_index=False)[VALUES].max()
+    # The US figure is the largest of any US row, including the states
+    us = raw.loc[raw.Country_Region == 'US'].groupby('Date', as_index=False)[
+        VALUES
+    ].max().assign(Country_Region='US', Province_State='All')
+    us_total = (history.Country_Region == 'US') & (history.Province_State == 'All')
+    history = pd.concat([history.loc[~us_total], us[history.columns]])
+
+    return history.sort_values(KEYS + ['Date']).reset_index(drop=True)
+
+
+def read_history(data_dir: str='./data/') -> pd.DataFrame:
+    """Return the ingested vaccination history (see build_history)"""
+    return pd.read_parquet(history_path(data_dir))
+
+
+def align(
+    frame: pd.DataFrame, history: pd.DataFrame, on: str='date'
+) -> pd.DataFrame:
+    """As-of join of the latest vaccination figures up to each row's date
+
+    Args:
+        frame (pd.DataFrame): rows with KEYS and a datetime64 column on
+        history (pd.DataFrame): vaccination history, as returned by read_history
+        on (str): date column of frame
+    Returns:
+        aligned (pd.DataFrame): frame with VALUES and the vaccination Date added,
+            NaN where no figures were reported up to the row's date
+    """
+    left = frame[KEYS + [on]].astype({key: object for key in KEYS})
+    left['_row'] = np.arange(len(frame))
+    right = history.assign(**{on: history.Date})
+    aligned = pd.merge_asof(
+        left.sort_values(on),
+        right.sort_values(on),
+        on=on,
+        by=KEYS,
+        direction='backward'
+    ).sort_values('_row')
+
+    return frame.assign(**{
+        column: aligned[column].to_numpy() for column in ['Date'] + VALUES
+    })
+
+
+def snapshot(
+    history: pd.DataFrame, as_of: Optional[pd.Timestamp]=None, prior_days: int=7
+) -> pd.DataFrame:
+    """Return the latest vaccination figures of every location as of a date
+
+    Args:
+        history (pd.DataFrame): vaccination history, as returned by read_history
+        as_of (Optional[pd.Timestamp]): date of the snapshot. If None, the latest
+            figures are used.
+        prior_days (int): figures are also given as of this many days earlier, e.g.
+            for growth rates
+    Returns:
+        snapshot (pd.DataFrame): Date and VALUES as of the date, and Prior_Date and
+            People_Fully_Vaccinated_Prior as of prior_days earlier, indexed by KEYS
+    """
+    locations = history[KEYS].drop_duplicates()
+    if as_of is None:
+        as_of = history.Date.max()
+    locations['date'] = pd.Timestamp(as_of)
+    latest = align(locations, history).dropna(subset=['Date'])
+    prior = align(
+        latest.assign(date=latest.Date - pd.Timedelta(days=prior_days)), history
+    )
+    latest['Prior_Date'] = prior.Date
+    latest['People_Fully_Vaccinated_Prior'] = prior.People_Fully_Vaccinated
+
+    return latest.drop('date', axis=1).set_index(KEYS)
+
+
+def lookup(
+    snapshot: pd.DataFrame, country: str, region: Optional[str]=None
+) -> Optional[pd.Series]:
+    """Return the snapshot row for a location, or None if not reported
+
+    Vaccination data is by country, and by state in the US.
+    """
+    if country != 'US' or region in [None, 'All']:
+        region = 'All'
+    try:
+        return snapshot.loc[(country, region)]
+    except KeyError:
+        return None
@@ -1,6 +1,29 @@
-from typing import Optional
+from typing import Dict, Optional, Union
 
 import numpy as np
+import pandas as pd
+
+
+ArrayLike = Union[float, np.ndarray, pd.Series]
+# A fixed value, or a distribution spec such as {'dist': 'beta', 'concentration': 50}
+# (see sample)
+Prior = Union[float, dict]
+
+# Fields of the structured arrays returned by predict_risk_batch
+RISK_DTYPE = np.dtype([
+    ('vaccinated', np.float64),
+    ('unvaccinated', np.float64),
+    ('p_vi', np.float64),
+    ('p_nv_i', np.float64)
+])
+# Default distributions of uncertain inputs for predict_risk_uncertainty. Efficacy and
+# detection rate are centred on the user's point values.
+DEFAULT_PRIORS = {
+    'vaccine_efficacy': {'dist': 'beta', 'concentration': 50},
+    'identification_rate': {'dist': 'beta', 'concentration': 20},
+    'infectious_duration': {'dist': 'randint', 'low': 7, 'high': 14},
+    'vaccination_lag': {'dist': 'randint', 'low': 0, 'high': 7}
+}
 
 
 def predict_risk(
@@ -32,6 +55,9 @@ def predict_risk(
     
     Assumptions include:
         - Equal risk of virus exposure to vaccinated and unvaccianted individuals
+
+    This is a scalar wrapper around predict_risk_batch, with risks rounded to 3
+    decimal places.
     
     Args:
         incfectious_rate (float): Local rate of  active infection (range 0 to 1)
@@ -42,21 +68,256 @@ def predict_risk(
     Returns:
         risk (dict): Current risk of infection in vaccinated and unvaccinated individuals
     """
+    batch = predict_risk_batch(
+        infectious_rate,
+        vaccination_rate,
+        vaccine_efficacy,
+        identification_rate=identification_rate
+    )
     risk = {}
+    risk['vaccinated'] = np.round(batch['vaccinated'][()], 3)
+    risk['unvaccinated'] = np.round(batch['unvaccinated'][()], 3)
+    risk['p_vi'] = batch['p_vi'][()]
+    risk['p_nv_i'] = batch['p_nv_i'][()]
+    
+    return risk
 
 
-    if identification_rate:
-        infectious_rate /= identification_rate # Adjust infeciton rate to account for missed diagnoses
-    
-    p_v = vaccination_rate # P(V)
-    p_nv = 1 - vaccination_rate # P(¬V)
-    p_i = infectious_rate # P(I)
-    p_vi = (p_v*(1 - vaccine_efficacy)) / ((p_v*(1 - vaccine_efficacy)) + p_nv) # P(V|I)
-    p_nv_i = p_nv / ((p_v*(1 - vaccine_efficacy)) + p_nv) # P(¬V|I)
-    
-    risk['vaccinated'] = np.round(p_vi * p_i / p_v, 3)
-    risk['unvaccinated'] = np.round(p_nv_i * p_i / p_nv, 3)
-    risk['p_vi'] = p_vi
-    risk['p_nv_i'] = p_nv_i
-    
-    return risk
\ No newline at end of file
+def predict_risk_batch(
+    infectious_rate: ArrayLike,
+    vaccination_rate: ArrayLike,
+    vaccine_efficacy: ArrayLike,
+    identification_rate: Optional[ArrayLike]=None
+) -> np.ndarray:
+    """Vectorized predict_risk over broadcast array inputs
+
+    Inputs are broadcast against each other, so e.g. per-location rates can be
+    combined with a grid of efficacies. Undefined results are masked rather than
+    raised: 'vaccinated' is NaN where vaccination_rate is 0, 'unvaccinated' is NaN
+    where vaccination_rate is 1, and missing (NaN) or zero identification rates are
+    treated as 1.0.
+
+    Args:
+        infectious_rate (ArrayLike): Local rate of active infection (0.0-1.0)
+        vaccination_rate (ArrayLike): Local vaccination rate (0.0-1.0)
+        vaccine_efficacy (ArrayLike): Proportion of potential infections blocked by
+            vaccine (0.0-1.0)
+        identification_rate (Optional[ArrayLike]): Proportion of true infection count
+            represented in data. If None, infection_rate assumed to be accurate.
+    Returns:
+        risk (np.ndarray): Structured array of RISK_DTYPE with the broadcast shape
+            of the inputs, unrounded
+    """
+    if identification_rate is None:
+        identification_rate = 1.0
+    p_i, p_v, efficacy, id_rate = np.broadcast_arrays(
+        *[
+            np.asarray(x, dtype=np.float64)
+            for x in [
+                infectious_rate, vaccination_rate, vaccine_efficacy, identification_rate
+            ]
+        ]
+    )
+    risk = np.empty(p_i.shape, dtype=RISK_DTYPE)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Adjust infection rate to account for missed diagnoses
+        p_i = p_i / np.where(id_rate > 0, id_rate, 1.0)
+        p_nv = 1 - p_v # P(¬V)
+        p_v_exposed = p_v * (1 - efficacy)
+        denominator = p_v_exposed + p_nv
+        p_vi = np.divide(p_v_exposed, denominator, out=risk['p_vi']) # P(V|I)
+        p_nv_i = np.divide(p_nv, denominator, out=risk['p_nv_i']) # P(¬V|I)
+
+        risk['vaccinated'] = np.where(p_v > 0, p_vi * p_i / p_v, np.nan)
+        risk['unvaccinated'] = np.where(p_nv > 0, p_nv_i * p_i / p_nv, np.nan)
+
+    return risk
+
+
+def predict_risk_frame(
+    inputs: pd.DataFrame,
+    vaccine_efficacy: Optional[ArrayLike]=None,
+    identification_rate: Optional[ArrayLike]=None
+) -> pd.DataFrame:
+    """Apply predict_risk_batch to the rows of a DataFrame
+
+    Args:
+        inputs (pd.DataFrame): DataFrame with columns infectious_rate and
+            vaccination_rate, and optionally vaccine_efficacy and identification_rate
+        vaccine_efficacy (Optional[ArrayLike]): Used where inputs has no
+            vaccine_efficacy column
+        identification_rate (Optional[ArrayLike]): Used where inputs has no
+            identification_rate column
+    Returns:
+        risk (pd.DataFrame): Columns of RISK_DTYPE, indexed like inputs
+    """
+    if 'vaccine_efficacy' in inputs:
+        vaccine_efficacy = inputs.vaccine_efficacy.to_numpy()
+    if 'identification_rate' in inputs:
+        identification_rate = inputs.identification_rate.to_numpy()
+    if vaccine_efficacy is None:
+        raise ValueError('vaccine_efficacy must be given as a column or argument')
+
+    risk = predict_risk_batch(
+        inputs.infectious_rate.to_numpy(),
+        inputs.vaccination_rate.to_numpy(),
+        vaccine_efficacy,
+        identification_rate=identification_rate
+    )
+
+    return pd.DataFrame(risk, index=inputs.index)
+
+
+def predict_risk_uncertainty(
+    new_cases: ArrayLike,
+    population: float,
+    vaccination_rate: float,
+    vaccine_efficacy: float=0.65,
+    identification_rate: Optional[float]=None,
+    infectious_duration: int=10,
+    vaccination_growth: float=0.0,
+    priors: Optional[Dict[str, Prior]]=None,
+    draws: int=100_000,
+    seed: Optional[int]=0,
+    interval: float=0.9
+) -> Dict[str, Dict[str, float]]:
+    """Return the median and credible interval of risk under uncertain inputs
+
+    Efficacy, detection rate, infectious duration and vaccination-data lag are drawn
+    from priors and propagated through the formula of predict_risk. The infectious
+    rate of each draw is the sum of the last infectious_duration days of new_cases
+    over population, and the vaccination rate is that reported, plus
+    vaccination_growth per day of lag in the data.
+
+    Args:
+        new_cases (ArrayLike): Daily new cases of the location, most recent last
+        population (float): Population of the location
+        vaccination_rate (float): Reported vaccination rate (0.0-1.0)
+        vaccine_efficacy (float): Point value of vaccine efficacy (0.0-1.0)
+        identification_rate (Optional[float]): Point value of the detection rate. If
+            None, 1.0.
+        infectious_duration (int): Point value of days individuals remain infectious
+        vaccination_growth (float): Daily increase in vaccination rate
+        priors (Optional[Dict[str, Prior]]): Priors overriding DEFAULT_PRIORS for
+            'vaccine_efficacy', 'identification_rate', 'infectious_duration' and
+            'vaccination_lag'. Distributions without a centre (mean, lam, ...) are
+            centred on the point values.
+        draws (int): Number of Monte Carlo draws
+        seed (Optional[int]): Random seed, for reproducible intervals
+        interval (float): Probability mass of the credible interval
+    Returns:
+        risk (Dict[str, Dict[str, float]]): 'median', 'lower' and 'upper' risk of
+            infection, for 'vaccinated' and 'unvaccinated' individuals
+    Raises:
+        ValueError: if new_cases is empty or population is not a positive number
+    """
+    new_cases = np.nan_to_num(np.asarray(new_cases, dtype=np.float64))
+    if new_cases.size == 0:
+        raise ValueError('new_cases is empty')
+    if not population > 0:
+        raise ValueError('population must be positive, got {}'.format(population))
+    priors = {**DEFAULT_PRIORS, **(priors or {})}
+    rng = np.random.default_rng(seed)
+    # Infectious cases for each possible duration, indexed by duration
+    cases = np.concatenate([[0.0], np.cumsum(new_cases[::-1])])
+
+    duration = sample(priors['infectious_duration'], draws, rng, infectious_duration)
+    np.clip(duration, 1, len(new_cases), out=duration)
+    p_i = cases.take(duration.astype(np.intp))
+    p_i /= population
+    id_rate = sample(
+        priors['identification_rate'],
+        draws,
+        rng,
+        1.0 if identification_rate is None else identification_rate
+    )
+    np.clip(id_rate, 1e-6, 1.0, out=id_rate)
+    p_i /= id_rate
+    np.clip(p_i, 0.0, 1.0, out=p_i)
+
+    lag = sample(priors['vaccination_lag'], draws, rng, 0)
+    np.maximum(lag, 0, out=lag)
+    p_v = lag
+    p_v *= vaccination_growth
+    p_v += vaccination_rate
+    np.clip(p_v, 0.0, 1.0, out=p_v)
+
+    efficacy = sample(priors['vaccine_efficacy'], draws, rng, vaccine_efficacy)
+    np.clip(efficacy, 0.0, 1.0, out=efficacy)
+
+    # P(I|¬V) = P(¬V|I) P(I) / P(¬V) = P(I) / (P(V) (1 - efficacy) + P(¬V)), and
+    # P(I|V) = (1 - efficacy) P(I|¬V). Buffers are reused to limit allocations.
+    unvaccinated = efficacy
+    np.subtract(1.0, efficacy, out=unvaccinated)
+    vaccinated = id_rate
+    np.multiply(p_i, unvaccinated, out=vaccinated)
+    unvaccinated *= p_v
+    unvaccinated += 1.0
+    unvaccinated -= p_v
+    vaccinated /= unvaccinated
+    np.divide(p_i, unvaccinated, out=unvaccinated)
+    # Undefined where nobody is (un)vaccinated, as in predict_risk_batch
+    if vaccination_rate <= 0 and vaccination_growth <= 0:
+        vaccinated.fill(np.nan)
+    if vaccination_rate >= 1 and vaccination_growth >= 0:
+        unvaccinated.fill(np.nan)
+
+    tail = (1 - interval) / 2
+    risk = {}
+    for name, values in [('vaccinated', vaccinated), ('unvaccinated', unvaccinated)]:
+        lower, median, upper = np.quantile(values, [tail, 0.5, 1 - tail])
+        risk[name] = {'median': median, 'lower': lower, 'upper': upper}
+
+    return risk
+
+
+def sample(
+    prior: Prior, size: int, rng: np.random.Generator, centre: float=0.0
+) -> np.ndarray:
+    """Draw size samples of an input from its prior
+
+    Priors are either a fixed value, or a dict with 'dist' one of:
+        'fixed': value (default centre)
+        'uniform': low, high (default centre -/+ width / 2)
+        'normal': mean (default centre), sd
+        'beta': mean (default centre), concentration (a + b)
+        'triangular': low, mode (default centre), high
+        'randint': low, high (inclusive)
+        'poisson': lam (default centre)
+
+    Args:
+        prior (Prior): fixed value or distribution spec
+        size (int): number of samples
+        rng (np.random.Generator): random generator
+        centre (float): default centre of the distribution
+    Returns:
+        samples (np.ndarray): float64 samples
+    """
+    if not isinstance(prior, dict):
+        return np.full(size, prior, dtype=np.float64)
+
+    dist = prior.get('dist', 'fixed')
+    if dist == 'fixed':
+        return np.full(size, prior.get('value', centre), dtype=np.float64)
+    if dist == 'uniform':
+        width = prior.get('width', 0.0)
+        return rng.uniform(
+            prior.get('low', centre - width / 2), prior.get('high', centre + width / 2), size
+        )
+    if dist == 'normal':
+        return rng.normal(prior.get('mean', centre), prior['sd'], size)
+    if dist == 'beta':
+        mean = np.clip(prior.get('mean', centre), 1e-6, 1 - 1e-6)
+        concentration = prior['concentration']
+        return rng.beta(mean * concentration, (1 - mean) * concentration, size)
+    if dist == 'triangular':
+        return rng.triangular(prior['low'], prior.get('mode', centre), prior['high'], size)
+    if dist == 'randint':
+        return rng.integers(prior['low'], prior['high'], size, endpoint=True).astype(
+            np.float64
+        )
+    if dist == 'poisson':
+        return rng.poisson(prior.get('lam', centre), size).astype(np.float64)
+
+    raise ValueError('Unknown distribution {!r}'.format(dist))
@@ -0,0 +1,155 @@
+"""Risk of every country or US county at once, for the overview map
+
+    locs = overview.build_overview(df, table, 'US counties')
+    points = overview.map_points(locs, vaccine_efficacy=0.65, identification_rate=1.0)
+
+Model inputs and coordinates of a view's locations are gathered once per data
+version into flat arrays, so a change of model parameters is a single vectorized
+call of covid_bayes.predict_risk_batch over them.
+"""
+import numpy as np
+import pandas as pd
+
+from src.data import caching, instrument, locations, population
+from src.model import covid_bayes, risk_table
+
+
+KEYS = risk_table.KEYS
+# Locations shown by each view: level of the location hierarchy and country, if any
+VIEWS = {
+    'Countries': ('country', None),
+    'US counties': ('sub_region', 'US')
+}
+
+
+@instrument.timed()
+@caching.cached
+def build_overview(
+    df: pd.DataFrame,
+    table: pd.DataFrame,
+    view: str='Countries',
+    n_days: int=14
+) -> pd.DataFrame:
+    """Return model inputs and coordinates of every location of a map view
+
+    Args:
+        df (pd.DataFrame): JHU COVID data window, as returned by data.load_cases
+        table (pd.DataFrame): Model inputs for every location, as returned by
+            risk_table.build_location_table
+        view (str): one of VIEWS
+        n_days (int): number of days of data expected for each location; others
+            are left out, as on the model page
+    Returns:
+        overview (pd.DataFrame): name, lat, lon, infectious_rate and
+            vaccination_rate of each location with coordinates
+    """
+    level, country = VIEWS[view]
+    rows = risk_table.select_level(table, level)
+    if country is not None:
+        rows = rows.loc[rows.index.get_level_values('Country_Region') == country]
+    rows = rows.loc[rows.n_days == n_days]
+    depth = len(KEYS) if level == 'sub_region' else 1
+    coordinates = _centroids(df, depth).reindex(rows.index)
+
+    # Innermost name first, without the country of a single-country view
+    names = [
+        ', '.join(
+            name for name in key[::-1][:len(KEYS) - (country is not None)]
+            if name not in ['All', locations.NOT_REPORTED]
+        )
+        for key in rows.index
+    ]
+    overview = pd.DataFrame({
+        'name': names,
+        'lat': np.round(coordinates.lat.to_numpy(), 3).astype(np.float32),
+        'lon': np.round(coordinates.lon.to_numpy(), 3).astype(np.float32),
+        'infectious_rate': rows.infectious_rate.to_numpy(),
+        'vaccination_rate': rows.vaccination_rate.to_numpy()
+    })
+    overview = overview.loc[overview.lat.notna()].reset_index(drop=True)
+    token = caching.get_version(table)
+    if token is not None:
+        caching.set_version(overview, '{}:overview:{}'.format(token, view))
+
+    return overview
+
+
+@caching.cached
+def map_points(
+    overview: pd.DataFrame,
+    vaccine_efficacy: float=0.65,
+    identification_rate: float=1.0,
+    measure: str='unvaccinated'
+) -> pd.DataFrame:
+    """Return the points of a map view for model parameters
+
+    Args:
+        overview (pd.DataFrame): Locations of a view, as returned by build_overview
+        vaccine_efficacy (float): Proportion of potential infections blocked by
+            vaccine (0.0-1.0)
+        identification_rate (float): Proportion of true infection count represented
+            in data
+        measure (str): 'vaccinated' or 'unvaccinated', the risk points are coloured by
+    Returns:
+        points (pd.DataFrame): name, lat, lon, vaccinated and unvaccinated risk (%)
+            and shade (0-255, darkest for the highest risk) of each location with a
+            defined risk, ordered so that the darkest are drawn last
+    """
+    risk = covid_bayes.predict_risk_batch(
+        overview.infectious_rate.to_numpy(),
+        overview.vaccination_rate.to_numpy(),
+        vaccine_efficacy,
+        identification_rate=identification_rate
+    )
+    points = overview[['name', 'lat', 'lon']].copy()
+    for name in ['vaccinated', 'unvaccinated']:
+        # Shown as by covid_bayes.predict_risk, rounded to 0.1%
+        points[name] = np.round(100 * np.round(risk[name], 3), 2)
+    defined = ~np.isnan(risk[measure])
+    points = points.loc[defined]
+    values = risk[measure][defined]
+
+    # Shades span 0 to the 95th percentile of the unrounded risk, so outliers do not
+    # wash out the rest
+    scale = np.percentile(values, 95) if len(values) else 0.0
+    share = values / scale if scale > 0 else np.zeros(len(values))
+    points['shade'] = np.round(255 * np.clip(share, 0, 1)).astype(np.uint8)
+
+    return points.sort_values('shade').reset_index(drop=True)
+
+
+def _centroids(df: pd.DataFrame, depth: int) -> pd.DataFrame:
+    """Return population-weighted mean coordinates of locations at a depth of KEYS
+
+    Reported coordinates of (0, 0) are missing ones. Locations of unknown population
+    are weighted as a single person.
+    """
+    keys = locations.location_keys(df)
+    lat = df.Lat.to_numpy(np.float64)
+    lon = df.Long_.to_numpy(np.float64)
+    valid = np.isfinite(lat) & np.isfinite(lon) & ~((lat == 0) & (lon == 0))
+    frame = keys.assign(
+        lat=np.where(valid, lat, np.nan), lon=np.where(valid, lon, np.nan)
+    )
+    # Coordinates of each location, weighted by its population from the table
+    points = frame.groupby(KEYS, observed=True)[['lat', 'lon']].mean().reset_index()
+    weight = population.join(population.build_table(df), points[KEYS])
+    weight = np.where(points.lat.notna(), np.where(weight > 0, weight, 1.0), 0.0)
+    points = points.assign(
+        weight=weight,
+        lat=points.lat.fillna(0.0) * weight,
+        lon=points.lon.fillna(0.0) * weight
+    )
+
+    sums = points.groupby(KEYS[:depth], observed=True)[['weight', 'lat', 'lon']].sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroids = pd.DataFrame({
+            'lat': sums.lat / sums.weight,
+            'lon': sums.lon / sums.weight
+        })
+    index = sums.index.to_frame(index=False).astype(object)
+    for key in KEYS[depth:]:
+        index[key] = 'All'
+    centroids.index = pd.MultiIndex.from_frame(index[KEYS])
+
+    return centroids
@@ -0,0 +1,253 @@
+"""Model inputs and risk for every location, computed in a few grouped passes"""
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.data import caching, instrument, locations, population
+from src.model import covid_bayes
+
+
+# Location key of each row. Aggregate levels take the value 'All' below their depth.
+KEYS = population.KEYS
+
+
+@instrument.timed()
+@caching.cached
+def build_daily_series(df: pd.DataFrame) -> pd.DataFrame:
+    """Return daily case series for every country, province/state and sub-region
+
+    Equivalent to data.subset_data for every possible selection at once.
+
+    Args:
+        df (pd.DataFrame): JHU COVID data window, as returned by data.load_cases
+    Returns:
+        series (pd.DataFrame): Confirmed, population, new_cases, rolling_7 and
+            Incident_Rate by KEYS and date, for all but the first day of the window
+    """
+    frame = locations.location_keys(df)
+    values = ['Confirmed', 'new_cases', 'rolling_7']
+    for column in ['date'] + values:
+        frame[column] = df[column].to_numpy()
+
+    levels = []
+    for depth in range(1, len(KEYS) + 1):
+        grouped = frame.groupby(by=KEYS[:depth] + ['date'], observed=True)
+        daily = grouped[['Confirmed']].sum()
+        # New cases and rolling means are summed from those stored per location
+        daily[['new_cases', 'rolling_7']] = grouped[
+            ['new_cases', 'rolling_7']
+        ].sum(min_count=1)
+        daily = daily.reset_index()
+        daily[KEYS[:depth]] = daily[KEYS[:depth]].astype(object)
+        for key in KEYS[depth:]:
+            daily[key] = 'All'
+        levels.append(daily)
+    # Rows of each location are contiguous and sorted by date
+    series = pd.concat(levels, ignore_index=True)
+    series['population'] = population.join(population.build_table(df), series[KEYS])
+    series = series[KEYS + ['date', 'Confirmed', 'population', 'new_cases', 'rolling_7']]
+
+    group_id = series.groupby(KEYS, sort=False).ngroup()
+    position = series.groupby(group_id).cumcount()
+    series['Incident_Rate'] = series.Confirmed.mul(1e5).div(series.population)
+    # The window's additional first day is dropped, as in data.subset_data
+    series = series.loc[position >= 1].reset_index(drop=True)
+
+    return series
+
+
+@instrument.timed()
+def build_location_table(
+    series: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    infectious_duration: int=10
+) -> pd.DataFrame:
+    """Return model inputs for every location in series
+
+    Equivalent to get_model_inputs and calc_vacc_rate in src.pages.model for every
+    possible selection at once.
+
+    Args:
+        series (pd.DataFrame): Daily case series, as returned by build_daily_series
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        infectious_duration (int): Number of days following +ve test that individuals
+            are assumed to remain infectious
+    Returns:
+        table (pd.DataFrame): n_days, population, infectious_cases, infectious_rate,
+            vacc_count, vacc_population and vaccination_rate, indexed by KEYS
+    """
+    group = series.groupby(KEYS, sort=False)
+    recent = series.new_cases.where(group.cumcount(ascending=False) < infectious_duration)
+    table = series.assign(recent=recent).groupby(KEYS, sort=False).agg(
+        n_days=('date', 'size'),
+        population=('population', 'last'),
+        infectious_cases=('recent', 'sum')
+    )
+    table['infectious_rate'] = table.infectious_cases.div(table.population)
+
+    # Vaccination data is available by country, and by state in the US
+    countries = table.index.get_level_values('Country_Region')
+    regions = table.index.get_level_values('Province_State')
+    vacc_keys = pd.MultiIndex.from_arrays([
+        countries,
+        np.where(countries == 'US', regions, 'All'),
+        np.full(len(table), 'All', dtype=object)
+    ])
+    table['vacc_population'] = table.population.reindex(vacc_keys).to_numpy()
+    table['vacc_count'] = _vaccination_counts(vacc_data).reindex(
+        vacc_keys.droplevel(2)
+    ).to_numpy()
+    table['vaccination_rate'] = table.vacc_count.div(table.vacc_population)
+
+    return table
+
+
+def add_risk(
+    table: pd.DataFrame,
+    vaccine_efficacy: float=0.65,
+    identification_rate: Optional[float]=None
+) -> pd.DataFrame:
+    """Return table with vaccinated and unvaccinated risk for every location
+
+    Args:
+        table (pd.DataFrame): Model inputs, as returned by build_location_table
+        vaccine_efficacy (float): Proportion of potential infections blocked by
+            vaccine (0.0-1.0)
+        identification_rate (Optional[float]): Proportion of true infection count
+            represented in data
+    Returns:
+        table (pd.DataFrame): Copy of table with risk columns added
+    """
+    risk = covid_bayes.predict_risk_frame(
+        table,
+        vaccine_efficacy=vaccine_efficacy,
+        identification_rate=identification_rate
+    )
+
+    return table.join(risk[['vaccinated', 'unvaccinated']])
+
+
+def risk_grid(
+    table: pd.DataFrame,
+    vaccine_efficacy: Sequence[float],
+    identification_rate: Sequence[float]
+) -> pd.DataFrame:
+    """Return risk for every location over a grid of model parameters
+
+    Args:
+        table (pd.DataFrame): Model inputs, as returned by build_location_table
+        vaccine_efficacy (Sequence[float]): Vaccine efficacies to evaluate
+        identification_rate (Sequence[float]): Identification rates to evaluate
+    Returns:
+        grid (pd.DataFrame): table repeated for each combination of parameters, with
+            vaccine_efficacy, identification_rate, vaccinated and unvaccinated columns
+    """
+    efficacy = np.asarray(vaccine_efficacy, dtype=np.float64)
+    id_rate = np.asarray(identification_rate, dtype=np.float64)
+    risk = covid_bayes.predict_risk_batch(
+        table.infectious_rate.to_numpy()[:, None, None],
+        table.vaccination_rate.to_numpy()[:, None, None],
+        efficacy[None, :, None],
+        identification_rate=id_rate[None, None, :]
+    )
+    n_params = efficacy.size * id_rate.size
+
+    grid = table.iloc[np.repeat(np.arange(len(table)), n_params)].copy()
+    grid['vaccine_efficacy'] = np.tile(np.repeat(efficacy, id_rate.size), len(table))
+    grid['identification_rate'] = np.tile(id_rate, len(table) * efficacy.size)
+    grid['vaccinated'] = risk['vaccinated'].ravel()
+    grid['unvaccinated'] = risk['unvaccinated'].ravel()
+
+    return grid
+
+
+def build_risk_table(
+    df: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    infectious_duration: int=10,
+    vaccine_efficacy: float=0.65,
+    identification_rate: Optional[float]=None
+) -> pd.DataFrame:
+    """Return model inputs and risk for every country, province/state and sub-region
+
+    Args:
+        df (pd.DataFrame): Last 15 days' JHU COVID data
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        infectious_duration (int): Number of days following +ve test that individuals
+            are assumed to remain infectious
+        vaccine_efficacy (float): Proportion of potential infections blocked by
+            vaccine (0.0-1.0)
+        identification_rate (Optional[float]): Proportion of true infection count
+            represented in data
+    Returns:
+        table (pd.DataFrame): See build_location_table and add_risk
+    """
+    series = build_daily_series(df)
+    table = build_location_table(series, vacc_data, infectious_duration)
+
+    return add_risk(table, vaccine_efficacy, identification_rate)
+
+
+def lookup(
+    table: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> Optional[pd.Series]:
+    """Return the table row for a sidebar selection, or None if it is not present"""
+    key = (country, region or 'All', sub_region or 'All')
+    if region in [None, 'All']:
+        key = (country, 'All', 'All')
+    try:
+        return table.loc[key]
+    except KeyError:
+        return None
+
+
+def location_series(
+    series: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None
+) -> pd.DataFrame:
+    """Return the daily series of a sidebar selection, empty if it is not present
+
+    Args:
+        series (pd.DataFrame): Daily case series, as returned by build_daily_series
+        country (str): Country of interest
+        region (Optional[str]): Region of interest
+        sub_region (Optional[str]): Sub-region of interest
+    Returns:
+        rows (pd.DataFrame): rows of series for the location, oldest first
+    """
+    if region in [None, 'All']:
+        region, sub_region = 'All', 'All'
+    key = (country, region, sub_region or 'All')
+    mask = np.logical_and.reduce([
+        series[column].to_numpy() == value for column, value in zip(KEYS, key)
+    ])
+
+    return series.loc[mask]
+
+
+def select_level(table: pd.DataFrame, level: str='all') -> pd.DataFrame:
+    """Return rows of table at a level of the location hierarchy"""
+    regions = table.index.get_level_values('Province_State')
+    sub_regions = table.index.get_level_values('Admin2')
+    masks = {
+        'all': np.ones(len(table), dtype=bool),
+        'country': regions == 'All',
+        'region': (regions != 'All') & (sub_regions == 'All'),
+        'sub_region': sub_regions != 'All'
+    }
+
+    return table.loc[masks[level]]
+
+
+def _vaccination_counts(vacc_data: pd.DataFrame) -> pd.Series:
+    """Return People_Fully_Vaccinated by (country, state) from a vaccination snapshot
+
+    Countries are keyed with a state of 'All' (see src.data.vaccinations).
+    """
+    return vacc_data.People_Fully_Vaccinated
@@ -0,0 +1,147 @@
+"""Case trends and nowcasts for every location, from a locations x days array
+
+    series = risk_table.build_daily_series(df)
+    table = trends.build_trend_table(series, infectious_durations=[7, 10, 14])
+    trends.rank(table, 'growth_rate', level='sub_region', country='US')
+
+Growth rates compare the latest 7-day mean of new cases with the one 7 days
+earlier, so a window of 15 days (14 days of new cases) is needed for them.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.data import instrument
+from src.model import risk_table
+
+
+KEYS = risk_table.KEYS
+
+
+def build_matrix(series: pd.DataFrame, columns: Sequence[str]=('new_cases',)) -> dict:
+    """Return columns of series as 2-D arrays of locations x days
+
+    Args:
+        series (pd.DataFrame): Daily case series, as returned by
+            risk_table.build_daily_series
+        columns (Sequence[str]): columns of series to convert
+    Returns:
+        matrix (dict): 'keys' (pd.MultiIndex of locations), 'dates'
+            (pd.DatetimeIndex of days), 'population' (latest population of each
+            location) and a float64 array per column, NaN where a location has no
+            row for a day
+    """
+    # Rows of each location are contiguous and sorted by date
+    codes = series.groupby(KEYS, sort=False).ngroup().to_numpy()
+    first = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    dates = pd.DatetimeIndex(np.sort(series.date.unique()))
+    day = dates.searchsorted(series.date.to_numpy())
+
+    matrix = {
+        'keys': pd.MultiIndex.from_frame(series[KEYS].iloc[first]),
+        'dates': dates,
+        'population': series.population.groupby(codes).last().to_numpy()
+    }
+    for column in columns:
+        values = np.full((len(first), len(dates)), np.nan)
+        values[codes, day] = series[column].to_numpy()
+        matrix[column] = values
+
+    return matrix
+
+
+@instrument.timed()
+def build_trend_table(
+    series: pd.DataFrame,
+    infectious_durations: Sequence[int]=(7, 10, 14),
+    period: int=7
+) -> pd.DataFrame:
+    """Return the latest case trends and nowcasts of every location
+
+    Args:
+        series (pd.DataFrame): Daily case series, as returned by
+            risk_table.build_daily_series
+        infectious_durations (Sequence[int]): Numbers of days following +ve test that
+            individuals are assumed to remain infectious, one nowcast for each
+        period (int): days between the 7-day means compared for growth rates
+    Returns:
+        table (pd.DataFrame): indexed by KEYS, with columns
+            - n_days, population
+            - new_cases: new cases on the latest day
+            - rolling_7, rolling_7_prior: 7-day means of new cases on the latest day
+              and period days earlier
+            - weekly_change: relative change from rolling_7_prior to rolling_7
+            - growth_rate: daily exponential growth rate of the 7-day mean
+            - doubling_time: days for the 7-day mean to double at growth_rate, NaN
+              if it is not growing
+            - infectious_rate_<d>: nowcast of the proportion of the population
+              currently infectious, from new cases of the last d days, for each d
+              of infectious_durations. NaN if fewer than d days are available.
+    """
+    matrix = build_matrix(series, ['new_cases', 'rolling_7'])
+    new_cases, rolling_7 = matrix['new_cases'], matrix['rolling_7']
+    population = matrix['population']
+    n_days = new_cases.shape[1]
+
+    table = pd.DataFrame(index=matrix['keys'])
+    table['n_days'] = (~np.isnan(new_cases)).sum(axis=1)
+    table['population'] = population
+    table['new_cases'] = new_cases[:, -1]
+    table['rolling_7'] = rolling_7[:, -1]
+    prior = rolling_7[:, -1 - period] if n_days > period else np.nan
+    table['rolling_7_prior'] = prior
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = rolling_7[:, -1] / prior
+        growth_rate = np.where(ratio > 0, np.log(ratio) / period, np.nan)
+        table['weekly_change'] = ratio - 1
+        table['growth_rate'] = growth_rate
+        table['doubling_time'] = np.where(
+            growth_rate > 0, np.log(2) / growth_rate, np.nan
+        )
+
+        # Cumulative sums back from the latest day give every duration at once
+        recent = np.nancumsum(new_cases[:, ::-1], axis=1)
+        for duration in infectious_durations:
+            table['infectious_rate_{}'.format(duration)] = (
+                recent[:, duration - 1] / population
+                if duration <= n_days else np.nan
+            )
+
+    return table
+
+
+def rank(
+    table: pd.DataFrame,
+    by: str='growth_rate',
+    level: str='sub_region',
+    country: Optional[str]=None,
+    n: int=20,
+    min_rolling: float=10.0,
+    ascending: bool=False
+) -> pd.DataFrame:
+    """Return the top locations of a trend table, e.g. the fastest-growing counties
+
+    Args:
+        table (pd.DataFrame): Trends, as returned by build_trend_table
+        by (str): column to rank by
+        level (str): level of the location hierarchy (see risk_table.select_level)
+        country (Optional[str]): if given, only locations in this country are ranked
+        n (int): number of locations returned
+        min_rolling (float): locations whose 7-day means are both below this are
+            excluded, as growth rates of small counts are noise
+        ascending (bool): if True, the lowest values are returned instead
+    Returns:
+        top (pd.DataFrame): the top n rows of table, in rank order
+    """
+    table = risk_table.select_level(table, level)
+    if country is not None:
+        table = table.loc[table.index.get_level_values('Country_Region') == country]
+    counts = table[['rolling_7', 'rolling_7_prior']].max(axis=1)
+    table = table.loc[(counts >= min_rolling) & table[by].notna()]
+
+    if ascending:
+        return table.nsmallest(n, by)
+
+    return table.nlargest(n, by)
@@ -4,8 +4,12 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
-from src.data import data
-from src.model import covid_bayes
+from src.data import caching, data, instrument, locations, population, vaccinations
+from src.model import covid_bayes, risk_table
+
+
+# Slider values of vaccine efficacy and detection rate, in 1% steps
+_GRID_STEPS = 100
 
 
 def write(
@@ -13,7 +17,11 @@ def write(
     vacc_data: pd.DataFrame,
     country: str,
     region: str,
-    sub_region: str
+    sub_region: str,
+    index: Optional[dict]=None,
+    table: Optional[pd.DataFrame]=None,
+    window: int=15,
+    uncertainty: Optional[dict]=None
 ) -> None:
     st.title('COVID-19 infeciton likelihood estimation')
     model_control = st.container()
@@ -31,6 +39,8 @@ def write(
                 'Estimated vaccine efficacy (%)', min_value=1, max_value=100, value=65
             )
             vaccine_efficacy /= 100 # Rescale from % to decimal
+        with cols[2]:
+            show_uncertainty = st.checkbox('Show uncertainty')
     run_model(
         df,
         vacc_data,
@@ -38,7 +48,11 @@ def write(
         region=region,
         sub_region=sub_region,
         identification_rate=identification_rate,
-        vaccine_efficacy=vaccine_efficacy
+        vaccine_efficacy=vaccine_efficacy,
+        index=index,
+        table=table,
+        window=window,
+        uncertainty=(uncertainty or {}) if show_uncertainty else None
     )
     return None
 
@@ -51,7 +65,11 @@ def run_model(
     sub_region: Optional[str]=None,
     infectious_duration: int=10,
     identification_rate: float=1.0,
-    vaccine_efficacy: float = 0.65
+    vaccine_efficacy: float = 0.65,
+    index: Optional[dict]=None,
+    table: Optional[pd.DataFrame]=None,
+    window: int=15,
+    uncertainty: Optional[dict]=None
 ):
     """
     Args:
@@ -61,19 +79,38 @@ def run_model(
         sub_region (str): Sub-region of interest
         infectious_duration (int): Number of days following +ve test that individuals 
             are assumed to remain infectious
+        index (Optional[dict]): Location index of df. If given, only the selected
+            location's rows are passed on for filtering and aggregation.
+        table (Optional[pd.DataFrame]): Model inputs for every location, as returned
+            by risk_table.build_location_table with the same infectious_duration. If
+            given, inputs are read from the table instead of being recomputed.
+        window (int): Number of days of data loaded (see data.load_cases), one more
+            than the number of days expected for the location
+        uncertainty (Optional[dict]): If given, credible intervals of risk are also
+            shown, using the 'priors', 'draws', 'seed' and 'interval' settings of
+            covid_bayes.predict_risk_uncertainty
     """
-    loc_inputs = (country, region, sub_region)
-    subset = data.subset_data(df, *loc_inputs)
-    infectious_rate = get_model_inputs(
-            subset, vacc_data, infectious_duration, *loc_inputs
-    )
-    vaccination_rate = calc_vacc_rate(df, vacc_data, country, region, sub_region)
+    # Inputs depend only on the location, so are memoised apart from the sliders
+    with instrument.stage('location_inputs'):
+        inputs = location_inputs(
+            df,
+            vacc_data,
+            country,
+            region,
+            sub_region,
+            infectious_duration=infectious_duration,
+            index=index if table is None else None,
+            table=table
+        )
+    n_days = inputs['n_days']
+    infectious_rate = inputs['infectious_rate']
+    vaccination_rate = inputs['vaccination_rate']
 
     loc_inputs = [n for n in [country, region, sub_region] if n]
     locs = [loc for loc in loc_inputs if loc!='All']
     location = ', '.join(locs)
 
-    if subset.shape[0] != 14:
+    if n_days != window - 1:
         st.write(
             """## Unexpected data! \n \n There appears to be an unexpected number of
              entries in the subset of data requested. Rather than deliver questionable
@@ -82,12 +119,10 @@ def run_model(
         )
     else:
 
-        risk = covid_bayes.predict_risk(
-            infectious_rate,
-            vaccination_rate,
-            vaccine_efficacy,
-            identification_rate=identification_rate
-        )
+        with instrument.stage('lookup_risk'):
+            risk = lookup_risk(
+                infectious_rate, vaccination_rate, vaccine_efficacy, identification_rate
+            )
 
         st.write("""### The model estmates that in {loc}: \n \n * ### A vaccinatied individual has a **{v_prob}%** probability of active COVID-19 infection\n * ### An unvaccinatied individual has a **{uv_prob}%** probability of active COVID-19 infection
         """.format(
@@ -104,10 +139,207 @@ def run_model(
             inf_rate_scaled = np.round(1e5*infectious_rate/identification_rate, 2)
             )
         )
+        if uncertainty is not None:
+            try:
+                with instrument.stage('risk_uncertainty'):
+                    bands = calc_risk_uncertainty(
+                        df,
+                        vacc_data,
+                        country,
+                        region,
+                        sub_region,
+                        vaccination_rate,
+                        infectious_duration=infectious_duration,
+                        identification_rate=identification_rate,
+                        vaccine_efficacy=vaccine_efficacy,
+                        **uncertainty
+                    )
+            except ValueError as e:
+                st.write(
+                    'Credible intervals are unavailable for {}: {}'.format(location, e)
+                )
+            else:
+                st.write("""
+        ### Allowing for uncertainty in vaccine efficacy, detection rate, infectious duration and vaccination data lag, the {interval}% credible intervals are:\n * Vaccinated: **{v_lower}%** to **{v_upper}%** (median {v_median}%)\n * Unvaccinated: **{uv_lower}%** to **{uv_upper}%** (median {uv_median}%)""".format(
+                    interval=round(100*uncertainty.get('interval', 0.9)),
+                    **{
+                        '{}_{}'.format(prefix, stat): np.round(100*bands[name][stat], 2)
+                        for prefix, name in [('v', 'vaccinated'), ('uv', 'unvaccinated')]
+                        for stat in ['lower', 'median', 'upper']
+                    }
+                    )
+                )
     
     return None
 
 
+@caching.cached
+def location_inputs(
+    df: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None,
+    infectious_duration: int=10,
+    index: Optional[dict]=None,
+    table: Optional[pd.DataFrame]=None
+) -> dict:
+    """Return the model inputs of a location, independent of the model parameters
+
+    Args:
+        df (pd.DataFrame): JHU COVID data window
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        country (str): Selected country
+        region (Optional[str]): Selected state/region
+        sub_region (Optional[str]): Selected county/sub_region
+        infectious_duration (int): Number of days following +ve test that individuals
+            are assumed to remain infectious
+        index (Optional[dict]): Location index of df, used if table is not given
+        table (Optional[pd.DataFrame]): Model inputs for every location (see
+            run_model). If given, inputs are read from the table.
+    Returns:
+        inputs (dict): n_days, infectious_rate and vaccination_rate
+    """
+    loc_inputs = (country, region, sub_region)
+    if table is not None:
+        row = risk_table.lookup(table, *loc_inputs)
+        return {
+            'n_days': 0 if row is None else row.n_days,
+            'infectious_rate': np.nan if row is None else row.infectious_rate,
+            'vaccination_rate': np.nan if row is None else row.vaccination_rate
+        }
+
+    # Population is joined from the table of the whole window, built once
+    populations = population.build_table(df)
+    if index is not None:
+        subset = data.subset_data(
+            locations.select(df, index, *loc_inputs), *loc_inputs,
+            populations=populations
+        )
+    else:
+        subset = data.subset_data(df, *loc_inputs, populations=populations)
+    if subset is None or subset.empty:
+        # No case data for the selection, as for a location missing from the table
+        return {'n_days': 0, 'infectious_rate': np.nan, 'vaccination_rate': np.nan}
+
+    return {
+        'n_days': subset.shape[0],
+        'infectious_rate': get_model_inputs(
+            subset, vacc_data, infectious_duration, *loc_inputs
+        ),
+        'vaccination_rate': calc_vacc_rate(df, vacc_data, country, region, sub_region)
+    }
+
+
+@caching.cached
+def risk_grid(
+    infectious_rate: float, vaccination_rate: float, steps: int=_GRID_STEPS
+) -> dict:
+    """Return risk over the grid of slider values for a location's inputs
+
+    Args:
+        infectious_rate (float): Reported rate of active infection of the location
+        vaccination_rate (float): Vaccination rate of the location
+        steps (int): Number of slider values, 1% to 100% in 1% steps by default
+    Returns:
+        grid (dict): 'vaccinated' and 'unvaccinated' risk as (steps, steps) arrays,
+            indexed by [vaccine efficacy step, detection rate step] and rounded as
+            by covid_bayes.predict_risk
+    """
+    values = np.arange(1, steps + 1) / steps
+    risk = covid_bayes.predict_risk_batch(
+        infectious_rate,
+        vaccination_rate,
+        values[:, None],
+        identification_rate=values[None, :]
+    )
+
+    return {
+        name: np.round(risk[name], 3) for name in ['vaccinated', 'unvaccinated']
+    }
+
+
+def lookup_risk(
+    infectious_rate: float,
+    vaccination_rate: float,
+    vaccine_efficacy: float,
+    identification_rate: float
+) -> dict:
+    """Return risk of the location for slider values, from its precomputed grid
+
+    Parameters between the grid's steps are evaluated directly.
+    """
+    steps = _GRID_STEPS
+    i = int(round(vaccine_efficacy * steps))
+    j = int(round(identification_rate * steps))
+    on_grid = all([
+        np.isclose(vaccine_efficacy * steps, i),
+        np.isclose(identification_rate * steps, j),
+        1 <= i <= steps,
+        1 <= j <= steps
+    ])
+    if not on_grid:
+        return covid_bayes.predict_risk(
+            infectious_rate,
+            vaccination_rate,
+            vaccine_efficacy,
+            identification_rate=identification_rate
+        )
+
+    grid = risk_grid(infectious_rate, vaccination_rate)
+
+    return {name: grid[name][i - 1, j - 1] for name in grid}
+
+
+def calc_risk_uncertainty(
+    df: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    country: str,
+    region: Optional[str],
+    sub_region: Optional[str],
+    vaccination_rate: float,
+    infectious_duration: int=10,
+    identification_rate: float=1.0,
+    vaccine_efficacy: float=0.65,
+    **kwargs
+) -> dict:
+    """Return credible intervals of risk for a location
+
+    Args:
+        df (pd.DataFrame): JHU COVID data window
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
+        country (str): Selected country
+        region (Optional[str]): Selected state/region
+        sub_region (Optional[str]): Selected county/sub_region
+        vaccination_rate (float): Reported vaccination rate of the location
+        infectious_duration (int): Point value of days individuals remain infectious
+        identification_rate (float): Point value of the detection rate
+        vaccine_efficacy (float): Point value of vaccine efficacy
+        **kwargs: passed to covid_bayes.predict_risk_uncertainty (priors, draws, seed,
+            interval)
+    Returns:
+        risk (dict): See covid_bayes.predict_risk_uncertainty
+    Raises:
+        ValueError: if the location has no case series or population
+    """
+    # The same series and population as the point estimate (see run_model)
+    series = risk_table.location_series(
+        risk_table.build_daily_series(df), country, region, sub_region
+    )
+    pop = series.population.iloc[-1] if len(series) else np.nan
+
+    return covid_bayes.predict_risk_uncertainty(
+        series.new_cases.to_numpy(),
+        pop,
+        vaccination_rate,
+        vaccine_efficacy=vaccine_efficacy,
+        identification_rate=identification_rate,
+        infectious_duration=infectious_duration,
+        vaccination_growth=calc_vacc_growth(df, vacc_data, country, region),
+        **kwargs
+    )
+
+
 def get_model_inputs(
     subset: pd.DataFrame,
     vacc_data: pd.DataFrame,
@@ -121,7 +353,7 @@ def get_model_inputs(
     Args:
         subset (pd.DataFrame): Location-specific subset of JHU COVID data for last 14 
             days 
-        vacc_data (pd.DataFrame): Latest merged CCI vaccination dataset
+        vacc_data (pd.DataFrame): Vaccination snapshot (see data.load_vaccinations)
         infectious_duration (int): Number of days following +ve test that individuals 
             are assumed to remain infectious
         country (str): Selected country
@@ -131,18 +363,13 @@ def get_model_inputs(
     Returns:
         tuple: [description]
     """
+    if subset is None or subset.empty:
+        return np.nan
+
     # Subset-derived inputs
     pop = subset.population.iloc[-1]
     infectious_cases = subset.new_cases[-infectious_duration:].sum()
     infectious_rate = infectious_cases / pop
-    # Vaccination-related inputs
-
-    if country != 'US':
-        filter = (vacc_data.Country_Region==country) & (vacc_data.Province_State.isna())
-    elif country=='US':
-        filter = (vacc_data.Country_Region==country)
-        if region != 'All':
-            filter = (filter) & (vacc_data.Province_State==region)
 
     return (infectious_rate)
 
@@ -154,44 +381,45 @@ def calc_vacc_rate(
     region,
     sub_region
 ):
-    if country != 'US':
-        filter = (vacc_data.Country_Region==country) & (vacc_data.Province_State.isna())
-
-    elif country=='US':
-        filter = (vacc_data.Country_Region==country)
-        if region != 'All':
-            filter = (filter) & (vacc_data.Province_State==region)
-    
-    vacc_count = vacc_data.loc[filter, 'People_Fully_Vaccinated'].max()
+    # Constant-time lookup in the vaccination snapshot
+    latest = vaccinations.lookup(vacc_data, country, region)
+    vacc_count = np.nan if latest is None else latest.People_Fully_Vaccinated
     pop = get_pop(df, country, region=region)
     vaccination_rate = vacc_count/pop
 
     return vaccination_rate
 
 
-def get_pop(df: pd.DataFrame, country: str, region: Optional[str]=None):
-    """Return subset population at granularity of available vaccination data"""
-    c1 = country=='US'
-    c2 = region != None
-    c3 = region != 'All'
+def calc_vacc_growth(
+    df: pd.DataFrame,
+    vacc_data: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None
+) -> float:
+    """Return the mean daily increase in vaccination rate before the snapshot date"""
+    latest = vaccinations.lookup(vacc_data, country, region)
+    if latest is None or pd.isna(latest.Prior_Date):
+        return 0.0
+    days = (latest.Date - latest.Prior_Date).days
+    if days <= 0:
+        return 0.0
+    pop = get_pop(df, country, region=region)
+
+    growth = latest.People_Fully_Vaccinated - latest.People_Fully_Vaccinated_Prior
+
+    return growth / days / pop
 
-    if all([c1, c2, c3]):
-        pop_agg = df.groupby(
-                by=['date', 'Country_Region', 'Province_State'], as_index=False
-            ).agg({'population': sum})
-        pop_agg = pop_agg.loc[
-            (pop_agg.Country_Region==country) & (pop_agg.Province_State==region)
-        ]
-    
-    c4 = country != 'US'
-    c5 = all([country=='US', any([not region, region=='All'])])
-    
-    if any([c4, c5]) :
-        pop_agg = df.groupby(
-            by=['date', 'Country_Region'], as_index=False
-        ).agg({'population': sum})
-        pop_agg = pop_agg.loc[pop_agg.Country_Region==country]
 
-    pop=np.round(pop_agg.population.max())
+def get_pop(
+    df: pd.DataFrame,
+    country: str,
+    region: Optional[str]=None
+) -> float:
+    """Return population at granularity of available vaccination data
+
+    Vaccinations are reported by state in the US and by country elsewhere.
+    """
+    if country != 'US':
+        region = None
 
-    return pop
\ No newline at end of file
+    return population.lookup(population.build_table(df), country, region)
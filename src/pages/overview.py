@@ -0,0 +1,77 @@
+import pandas as pd
+import pydeck as pdk
+import streamlit as st
+
+from src.data import instrument
+from src.model import overview
+
+
+# Initial map position and point radius (metres) of each view
+_VIEW_STATES = {
+    'Countries': {'latitude': 20.0, 'longitude': 0.0, 'zoom': 0.8, 'radius': 150_000},
+    'US counties': {'latitude': 38.0, 'longitude': -96.0, 'zoom': 3.0, 'radius': 8_000}
+}
+
+
+def write(df: pd.DataFrame, table: pd.DataFrame, window: int=15) -> None:
+    st.title('COVID-19 infection likelihood overview')
+    cols = st.columns(3)
+
+    with cols[0]:
+        identification_rate = st.slider(
+            'Infection detection rate (%)', min_value=1, max_value=100, value=100
+        )
+        identification_rate /= 100 # Rescale from % to decimal
+    with cols[1]:
+        vaccine_efficacy = st.slider(
+            'Estimated vaccine efficacy (%)', min_value=1, max_value=100, value=65
+        )
+        vaccine_efficacy /= 100 # Rescale from % to decimal
+    with cols[2]:
+        view = st.radio('Show', list(overview.VIEWS))
+        measure = st.radio('Colour by risk if', ['Unvaccinated', 'Vaccinated']).lower()
+
+    if 'Lat' not in df.columns:
+        # Published before coordinates were stored; replaced by the next refresh
+        st.write('The map will be available once the latest data has loaded.')
+        return None
+
+    # Locations are gathered once per data version; slider moves only re-evaluate
+    # the model over them
+    with instrument.stage('overview', view=view):
+        locs = overview.build_overview(df, table, view, n_days=window - 1)
+        points = overview.map_points(
+            locs, vaccine_efficacy, identification_rate, measure=measure
+        )
+    write_map(points, view)
+    st.caption(
+        'Darkest: {}% or more. Locations without a defined risk are not shown.'.format(
+            points[measure].quantile(0.95).round(2) if len(points) else 0
+        )
+    )
+
+    return None
+
+
+def write_map(points: pd.DataFrame, view: str) -> None:
+    """Draw points, as returned by overview.map_points, shaded by risk"""
+    state = dict(_VIEW_STATES[view])
+    radius = state.pop('radius')
+    layer = pdk.Layer(
+        'ScatterplotLayer',
+        data=points,
+        get_position=['lon', 'lat'],
+        get_fill_color='[255, 255 - shade, 0, 180]',
+        get_radius=radius,
+        radius_min_pixels=2,
+        pickable=True
+    )
+    st.pydeck_chart(pdk.Deck(
+        layers=[layer],
+        initial_view_state=pdk.ViewState(**state),
+        tooltip={
+            'text': '{name}\nVaccinated: {vaccinated}%\nUnvaccinated: {unvaccinated}%'
+        }
+    ))
+
+    return None
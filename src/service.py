@@ -0,0 +1,355 @@
+"""JSON HTTP service for risk lookups, alongside the Streamlit app
+
+    python -m src.service --port 8502
+
+Endpoints:
+    GET  /risk?country=US&region=Texas&sub_region=Harris&efficacy=0.65&detection=0.5
+    POST /risk  with {"queries": [{"country": ..., "efficacy": ..., ...}, ...]}
+    GET  /locations[?country=US[&region=Texas]]
+    GET  /health
+
+Model inputs of every location are precomputed once per data version (see
+risk_table.build_location_table) and refreshed in the background (see
+src.data.refresh). Responses to GET requests are cached by query and data version.
+"""
+import json
+import argparse
+import functools
+import datetime as dt
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.data import bundle, caching, locations, publish, refresh
+from src.model import covid_bayes, risk_table
+
+
+_DEFAULTS = {'efficacy': 0.65, 'detection': 1.0}
+# Maximum number of queries in a batch request
+_MAX_BATCH = 10_000
+
+
+class ServiceError(Exception):
+    """Error returned to the client with an HTTP status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def load_data(
+    today: dt.date,
+    data_dir: str='./data/',
+    config: Optional[dict]=None,
+    download: bool=True
+) -> dict:
+    """Load the data served, for refresh.refresh
+
+    Args:
+        today (dt.date): Today's date
+        data_dir (str): root directory for app data
+        config (Optional[dict]): app config
+        download (bool): if False, only data already downloaded is used
+    Returns:
+        snapshot (dict): 'version', 'today', 'table' (model inputs indexed by
+            risk_table.KEYS) and 'index' (see locations.build_index)
+    """
+    # Frames are prepared and published as for the app, which shares them
+    published_dir = data_dir + 'published/'
+    version = bundle.prepare(today, data_dir, config=config, download=download)
+    frames = publish.open_frames(
+        published_dir, ['cases', 'vaccinations'], version=version
+    )
+    df = frames['cases']
+    table = risk_table.build_location_table(
+        risk_table.build_daily_series(df), frames['vaccinations']
+    )
+
+    return {
+        'version': version,
+        'today': str(today),
+        'table': table,
+        'index': locations.build_index(df)
+    }
+
+
+def risk(
+    snapshot: dict,
+    country: str,
+    region: Optional[str]=None,
+    sub_region: Optional[str]=None,
+    efficacy: float=_DEFAULTS['efficacy'],
+    detection: float=_DEFAULTS['detection']
+) -> dict:
+    """Return the risk of a location for model parameters, as served by /risk
+
+    Args:
+        snapshot (dict): data served, as returned by load_data
+        country (str): Country of interest
+        region (Optional[str]): Region of interest
+        sub_region (Optional[str]): Sub-region of interest
+        efficacy (float): Proportion of potential infections blocked by vaccine
+        detection (float): Proportion of true infection count represented in data
+    Returns:
+        response (dict): location, parameters, model inputs and risk
+    """
+    row = risk_table.lookup(snapshot['table'], country, region, sub_region)
+    if row is None:
+        raise ServiceError(404, 'unknown location: {}'.format(
+            ', '.join(n for n in [country, region, sub_region] if n)
+        ))
+    for name, value in [('efficacy', efficacy), ('detection', detection)]:
+        if not 0 < value <= 1:
+            raise ServiceError(400, '{} must be in (0, 1]'.format(name))
+
+    result = covid_bayes.predict_risk(
+        row.infectious_rate,
+        row.vaccination_rate,
+        efficacy,
+        identification_rate=detection
+    )
+
+    return {
+        'location': {
+            'country': country,
+            'region': region or 'All',
+            'sub_region': sub_region or 'All'
+        },
+        'parameters': {'efficacy': efficacy, 'detection': detection},
+        'inputs': {
+            'n_days': int(row.n_days),
+            'population': _number(row.population),
+            'infectious_rate': _number(row.infectious_rate),
+            'vaccination_rate': _number(row.vaccination_rate)
+        },
+        'risk': {
+            'vaccinated': _number(result['vaccinated']),
+            'unvaccinated': _number(result['unvaccinated'])
+        },
+        'version': snapshot['version']
+    }
+
+
+def children(
+    snapshot: dict, country: Optional[str]=None, region: Optional[str]=None
+) -> dict:
+    """Return the countries, regions of country or sub-regions of region"""
+    index = snapshot['index']
+    if country is None:
+        return {'countries': sorted(index)}
+    if country not in index:
+        raise ServiceError(404, 'unknown country: {}'.format(country))
+    if region is None:
+        return {'country': country, 'regions': locations.get_children(index, country)}
+    if region not in index[country]['regions']:
+        raise ServiceError(404, 'unknown region: {}, {}'.format(region, country))
+
+    return {
+        'country': country,
+        'region': region,
+        'sub_regions': locations.get_children(index, country, region)
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, keep-alive clients
+    # wait on delayed ACKs between them
+    disable_nagle_algorithm = True
+    load = None
+    data_dir = './data/'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/health':
+            snapshot = refresh.current()
+            return self._send(200, json.dumps({
+                'status': 'ok' if snapshot else 'loading',
+                'version': snapshot and snapshot['data']['version'],
+                'loaded': snapshot and snapshot['loaded'].isoformat(timespec='seconds')
+            }).encode())
+
+        try:
+            snapshot = self._ensure()
+        except ServiceError as e:
+            return self._send(e.status, json.dumps({'error': str(e)}).encode())
+        self._send(*_get(snapshot['version'], url.path, url.query))
+
+    def do_POST(self):
+        try:
+            if urllib.parse.urlsplit(self.path).path != '/risk':
+                raise ServiceError(404, 'not found: {}'.format(self.path))
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                queries = json.loads(self.rfile.read(length))['queries']
+            except (ValueError, KeyError, TypeError):
+                queries = None
+            if not isinstance(queries, list):
+                raise ServiceError(400, 'expected {"queries": [...]}')
+            if len(queries) > _MAX_BATCH:
+                raise ServiceError(400, 'at most {} queries'.format(_MAX_BATCH))
+
+            snapshot = self._ensure()
+            results = []
+            for query in queries:
+                try:
+                    results.append(_risk(snapshot['version'], *_parse_query(query)))
+                except ServiceError as e:
+                    results.append({'error': str(e), 'status': e.status})
+            self._send(200, json.dumps({'results': results}).encode())
+        except ServiceError as e:
+            self._send(e.status, json.dumps({'error': str(e)}).encode())
+
+    def _ensure(self) -> dict:
+        """Return the current snapshot, loading it if there is none"""
+        try:
+            return refresh.ensure(self.load, self.data_dir)['data']
+        except Exception as e:
+            # Reported to the client rather than dropping the connection
+            raise ServiceError(503, 'data unavailable: {}'.format(e))
+
+    def log_message(self, format, *args):
+        return None
+
+    def _send(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _get(version: str, path: str, query: str) -> Tuple[int, bytes]:
+    """Return the status and body of a GET request, cached by data version"""
+    params = dict(urllib.parse.parse_qsl(query))
+    try:
+        if path == '/risk':
+            body = _risk(version, *_parse_query(params))
+        elif path == '/locations':
+            body = children(
+                _snapshot(version), params.get('country'), params.get('region')
+            )
+        else:
+            raise ServiceError(404, 'not found: {}'.format(path))
+    except ServiceError as e:
+        return e.status, json.dumps({'error': str(e)}).encode()
+
+    return 200, json.dumps(body).encode()
+
+
+@functools.lru_cache(maxsize=65536)
+def _risk(version: str, *query) -> dict:
+    return risk(_snapshot(version), *query)
+
+
+def _snapshot(version: str) -> dict:
+    """Return the current snapshot, which is of version for cached calls"""
+    snapshot = refresh.current()['data']
+    if snapshot['version'] != version:
+        # Refreshed while the request was being served; it is retried as new
+        raise ServiceError(503, 'data version changed, please retry')
+
+    return snapshot
+
+
+def _parse_query(params: dict) -> tuple:
+    """Return (country, region, sub_region, efficacy, detection) of a risk query"""
+    if not isinstance(params, dict):
+        raise ServiceError(400, 'each query must be an object')
+    if not params.get('country'):
+        raise ServiceError(400, 'country is required')
+    try:
+        efficacy = float(params.get('efficacy', _DEFAULTS['efficacy']))
+        detection = float(params.get('detection', _DEFAULTS['detection']))
+    except (TypeError, ValueError):
+        raise ServiceError(400, 'efficacy and detection must be numbers')
+
+    return (
+        params['country'],
+        params.get('region') or None,
+        params.get('sub_region') or None,
+        efficacy,
+        detection
+    )
+
+
+def _number(value) -> Optional[float]:
+    """Return value as a JSON number, or None if it is missing"""
+    return None if pd.isna(value) else float(np.round(value, 8))
+
+
+def serve(
+    config: dict,
+    host: str='127.0.0.1',
+    port: int=8502,
+    download: bool=True
+) -> ThreadingHTTPServer:
+    """Load the data and return a server for it, refreshed in the background
+
+    Args:
+        config (dict): app config
+        host (str): address to listen on
+        port (int): port to listen on. If 0, a free port is chosen.
+        download (bool): if False, only data already downloaded is served
+    Returns:
+        server (ThreadingHTTPServer): server, not yet started; call
+            server.serve_forever()
+    """
+    data_dir = config['data_dir']
+    allow_download = download
+
+    def load(today: dt.date, download: bool=True) -> dict:
+        download = download and allow_download
+        return load_data(today, data_dir, config=config, download=download)
+
+    refresh.ensure(load, data_dir)
+    refresh.start(
+        load,
+        data_dir,
+        interval=config.get('refresh', {}).get('interval_minutes', 60) * 60
+    )
+    handler = type('Handler', (_Handler,), {
+        'load': staticmethod(load), 'data_dir': data_dir
+    })
+
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default='./config.yaml', help='app config file')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument(
+        '--no-download', action='store_true', help='serve downloaded data only'
+    )
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    caching.set_backend(
+        config.get('cache', {}).get('backend', 'versioned'),
+        cache_dir=config['data_dir'] + 'cache/'
+    )
+    service_config = config.get('service', {})
+    server = serve(
+        config,
+        host=args.host or service_config.get('host', '127.0.0.1'),
+        port=args.port or service_config.get('port', 8502),
+        download=not args.no_download
+    )
+    print(
+        'Serving risk lookups at http://{}:{}/'.format(*server.server_address),
+        flush=True
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,163 @@
+import os
+import asyncio
+import threading
+import socketserver
+import urllib.error
+
+import pytest
+
+from src.data import afetch, standin
+
+
+_PROXY_VARIABLES = ['http_proxy', 'https_proxy', 'no_proxy']
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    for name in _PROXY_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    directory = tmp_path / 'mirror'
+    directory.mkdir()
+    for i in range(10):
+        (directory / '{}.csv'.format(i)).write_bytes(os.urandom(100_000 + i))
+    return directory
+
+
+@pytest.fixture
+def dest(tmp_path):
+    directory = tmp_path / 'dest'
+    directory.mkdir()
+    return directory
+
+
+def jobs(server, dest, names):
+    return [(server.url + name, str(dest / name)) for name in names]
+
+
+def names(n=10):
+    return ['{}.csv'.format(i) for i in range(n)]
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_connections_are_reused(mirror, dest):
+    server = standin.serve_async(str(mirror))
+    try:
+        results = afetch.fetch_many(jobs(server, dest, names()), workers=3)
+    finally:
+        server.close()
+
+    assert [changed for changed, _ in results] == [True] * 10
+    assert server.requests == 10
+    assert server.connections < server.requests
+    for name in names():
+        assert (dest / name).read_bytes() == (mirror / name).read_bytes()
+
+
+def test_not_modified_is_skipped(mirror, dest):
+    server = standin.serve_async(str(mirror))
+    try:
+        url, path = jobs(server, dest, ['0.csv'])[0]
+        [(changed, validators)] = afetch.fetch_many([(url, path, {})])
+        mtime = os.stat(path).st_mtime_ns
+        [(unchanged, same)] = afetch.fetch_many([(url, path, validators)])
+    finally:
+        server.close()
+
+    assert changed and validators['etag'] and validators['sha256']
+    assert not unchanged
+    assert same == validators
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_failure_leaves_no_partial_files(mirror, dest):
+    server = standin.serve_async(str(mirror))
+    try:
+        with pytest.raises(urllib.error.HTTPError):
+            afetch.fetch_many(
+                jobs(server, dest, names() + ['missing.csv']), workers=4, retries=0
+            )
+    finally:
+        server.close()
+
+    assert leftovers(dest) == []
+    assert not (dest / 'missing.csv').exists()
+
+
+def test_cancellation_leaves_no_partial_files(tmp_path, dest):
+    directory = tmp_path / 'slow'
+    directory.mkdir()
+    (directory / 'large.csv').write_bytes(os.urandom(2_000_000))
+    server = standin.serve_async(str(directory), delay=0.05)
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+    try:
+        with pytest.raises(asyncio.CancelledError):
+            afetch.fetch_many(jobs(server, dest, ['large.csv']), cancel=cancel)
+    finally:
+        server.close()
+
+    assert leftovers(dest) == []
+    assert not (dest / 'large.csv').exists()
+
+
+def test_chunked_bodies(mirror, dest):
+    server = standin.serve_async(str(mirror), chunked=True)
+    try:
+        afetch.fetch_many(jobs(server, dest, names()), workers=2)
+    finally:
+        server.close()
+
+    assert server.connections < server.requests
+    for name in names():
+        assert (dest / name).read_bytes() == (mirror / name).read_bytes()
+
+
+class _MalformedOnce(socketserver.StreamRequestHandler):
+    """Send a malformed chunk size on the first request, a valid body after"""
+    calls = 0
+
+    def handle(self):
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        type(self).calls += 1
+        body = b'zz\r\n' if self.calls == 1 else b'5\r\nhello\r\n0\r\n\r\n'
+        self.wfile.write(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+            b'Connection: close\r\n\r\n' + body
+        )
+
+
+def test_malformed_chunk_is_retried(dest):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _MalformedOnce)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/a.csv'.format(server.server_address[1])
+    try:
+        afetch.fetch_many([(url, str(dest / 'a.csv'))], retries=1, backoff=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert _MalformedOnce.calls == 2
+    assert (dest / 'a.csv').read_bytes() == b'hello'
+    assert leftovers(dest) == []
+
+
+def test_proxy_from_environment_is_used(monkeypatch, mirror, dest):
+    # The stand-in serves the path of absolute-form requests, so acts as a proxy
+    server = standin.serve_async(str(mirror))
+    monkeypatch.setenv('http_proxy', server.url)
+    try:
+        afetch.fetch_many([('http://mirror.invalid/0.csv', str(dest / '0.csv'))])
+    finally:
+        server.close()
+
+    assert server.requests == 1
+    assert (dest / '0.csv').read_bytes() == (mirror / '0.csv').read_bytes()
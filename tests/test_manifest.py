@@ -0,0 +1,55 @@
+import os
+import datetime as dt
+
+import pytest
+
+from benchmarks import synthetic
+from src.data import caching, data, manifest, store
+
+
+_TODAY = dt.date(2021, 9, 1)
+
+
+@pytest.fixture(autouse=True)
+def no_cache():
+    caching.set_backend('none')
+
+
+@pytest.fixture
+def config(tmp_path):
+    mirror = str(tmp_path / 'mirror') + '/'
+    synthetic.write_mirror(mirror, _TODAY, n_counties=20, n_countries=3, n_days=15)
+    return synthetic.mirror_config(mirror, data_dir=str(tmp_path / 'data') + '/')
+
+
+def corrupt(path):
+    """Change a byte of path, keeping its size and mtime"""
+    stat = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.seek(stat.st_size // 2)
+        byte = f.read(1)
+        f.seek(stat.st_size // 2)
+        f.write(b'0' if byte != b'0' else b'1')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_corrupted_report_of_same_size_is_fetched_again(config, monkeypatch):
+    data_dir = config['data_dir']
+    data.load_cases(_TODAY, data_dir, config=config, window=15)
+    date = (_TODAY - dt.timedelta(days=5)).strftime('%m-%d-%Y')
+    path = manifest.raw_path(date, data_dir)
+    with open(path, 'rb') as f:
+        original = f.read()
+    partition = os.stat(store.partition_path(date, data_dir)).st_mtime_ns
+
+    corrupt(path)
+    # Metadata alone does not tell
+    assert manifest.validate(manifest.read(data_dir), [date], data_dir, deep=False) == []
+    # As in a new process
+    monkeypatch.setattr(manifest, '_VERIFIED', set())
+    data.load_cases(_TODAY, data_dir, config=config, window=15)
+
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    assert os.stat(store.partition_path(date, data_dir)).st_mtime_ns != partition
+    assert manifest.read(data_dir)[date]['sha256'] == manifest.describe(path)['sha256']
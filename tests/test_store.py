@@ -0,0 +1,73 @@
+import os
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from src.data import caching, data, store
+
+
+_TODAY = dt.date(2021, 9, 1)
+
+
+@pytest.fixture(autouse=True)
+def no_cache():
+    caching.set_backend('none')
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    directory = str(tmp_path / 'mirror') + '/'
+    synthetic.write_mirror(directory, _TODAY, n_counties=20, n_countries=3, n_days=30)
+    return directory
+
+
+def load(mirror, data_dir, window):
+    config = synthetic.mirror_config(mirror, data_dir=data_dir)
+    data.load_cases(_TODAY, data_dir, config=config, window=window)
+
+
+def stored(data_dir, window=30):
+    dates = [
+        (_TODAY - dt.timedelta(days=d)).strftime('%m-%d-%Y')
+        for d in range(1, window + 1)
+    ]
+    df = store.read_window(dates, data_dir)
+    for column in ['Admin2', 'Province_State', 'Country_Region']:
+        df[column] = df[column].astype(object)
+    return df.sort_values(
+        ['date', 'Country_Region', 'Province_State', 'Admin2']
+    ).reset_index(drop=True)
+
+
+def test_extended_window_matches_fresh_ingest(mirror, tmp_path):
+    extended = str(tmp_path / 'extended') + '/'
+    fresh = str(tmp_path / 'fresh') + '/'
+    load(mirror, extended, window=15)
+    load(mirror, extended, window=30)
+    load(mirror, fresh, window=30)
+
+    df = stored(extended)
+    pd.testing.assert_frame_equal(df, stored(fresh))
+    # Only the first day of the window lacks a previous day
+    assert df.groupby('date').new_cases.apply(lambda s: s.isna().all()).sum() == 1
+
+
+def test_ingesting_a_gap_rewrites_later_partitions(mirror, tmp_path):
+    fresh = str(tmp_path / 'fresh') + '/'
+    data_dir = str(tmp_path / 'gap') + '/'
+    load(mirror, fresh, window=30)
+    load(mirror, data_dir, window=30)
+    dates = [
+        (_TODAY - dt.timedelta(days=d)).strftime('%m-%d-%Y') for d in range(1, 31)
+    ]
+    gap = dates[19]
+
+    # The later days are computed without the gap day, which is then ingested
+    for date in dates:
+        os.remove(store.partition_path(date, data_dir))
+    store.ingest_JHU([date for date in dates if date != gap], data_dir)
+    store.ingest_JHU([gap], data_dir)
+
+    pd.testing.assert_frame_equal(stored(data_dir), stored(fresh))
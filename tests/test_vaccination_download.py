@@ -0,0 +1,130 @@
+import os
+import json
+
+import pandas as pd
+import pytest
+
+from src.data import data, standin
+
+
+_NAMES = ['vaccinations_us.csv', 'vaccinations_global.csv']
+
+
+def rows(start, days, value=100):
+    dates = pd.date_range(start, periods=days).strftime('%Y-%m-%d')
+    return pd.DataFrame({
+        'Date': dates,
+        'Country_Region': 'US',
+        'People_Fully_Vaccinated': [str(value + i) for i in range(days)]
+    })
+
+
+def publish(mirror, df):
+    for name in _NAMES:
+        df.to_csv(mirror / name, index=False)
+
+
+def read(data_dir, name):
+    return pd.read_csv(
+        os.path.join(data_dir, 'raw/vaccinations/', name), dtype=str,
+        keep_default_na=False
+    )
+
+
+def sources(data_dir):
+    with open(os.path.join(data_dir, 'raw/vaccinations/sources.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    for name in ['http_proxy', 'HTTP_PROXY']:
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = tmp_path / 'mirror'
+    mirror.mkdir()
+    publish(mirror, rows('2021-08-01', 3))
+    return mirror
+
+
+@pytest.fixture
+def server(mirror):
+    server = standin.serve_async(str(mirror))
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    (tmp_path / 'data' / 'raw' / 'vaccinations').mkdir(parents=True)
+    return str(tmp_path / 'data') + '/'
+
+
+def refresh(server, data_dir):
+    data.download_and_save_CCI(
+        data_dir,
+        url_us=server.url + _NAMES[0],
+        url_global=server.url + _NAMES[1],
+        retries=0
+    )
+
+
+def test_unchanged_files_are_skipped(server, data_dir):
+    refresh(server, data_dir)
+    path = os.path.join(data_dir, 'raw/vaccinations/', _NAMES[0])
+    mtime = os.stat(path).st_mtime_ns
+    recorded = sources(data_dir)
+
+    refresh(server, data_dir)
+
+    assert server.requests == 4
+    assert os.stat(path).st_mtime_ns == mtime
+    assert sources(data_dir) == recorded
+    assert recorded[_NAMES[0]]['validators']['etag']
+    assert not [name for name in os.listdir(os.path.dirname(path)) if '.download' in name]
+
+
+def test_only_new_rows_are_appended(mirror, server, data_dir):
+    refresh(server, data_dir)
+    # Upstream restates an old row and adds two days
+    upstream = rows('2021-08-01', 5, value=500)
+    publish(mirror, upstream)
+
+    refresh(server, data_dir)
+
+    for name in _NAMES:
+        local = read(data_dir, name)
+        expected = pd.concat(
+            [rows('2021-08-01', 3), upstream.iloc[3:]], ignore_index=True
+        )
+        pd.testing.assert_frame_equal(local, expected)
+        assert sources(data_dir)[name]['high_water'] == '2021-08-05'
+
+
+def test_interrupted_append_is_recovered(mirror, server, data_dir):
+    refresh(server, data_dir)
+    # An append interrupted part-way through a row
+    path = os.path.join(data_dir, 'raw/vaccinations/', _NAMES[0])
+    with open(path, 'ab') as f:
+        f.write(b'2021-08-04,US,1')
+    publish(mirror, rows('2021-08-01', 5))
+
+    refresh(server, data_dir)
+
+    pd.testing.assert_frame_equal(read(data_dir, _NAMES[0]), rows('2021-08-01', 5))
+    assert sources(data_dir)[_NAMES[0]]['size'] == os.path.getsize(path)
+
+
+def test_truncated_copy_is_replaced(mirror, server, data_dir):
+    refresh(server, data_dir)
+    path = os.path.join(data_dir, 'raw/vaccinations/', _NAMES[0])
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    publish(mirror, rows('2021-08-01', 4))
+
+    refresh(server, data_dir)
+
+    pd.testing.assert_frame_equal(read(data_dir, _NAMES[0]), rows('2021-08-01', 4))